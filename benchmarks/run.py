@@ -0,0 +1,372 @@
+'''Throughput benchmarks for the pipeline's stages
+
+Generates CSV and Excel inputs of several sizes and times each
+stage of a representative pipeline over them: extraction, schema
+validation (plain and compiled), loading to CKAN through a stub
+session and over HTTP to a local mock CKAN server (see
+:py:mod:`pipeline.mock_ckan`), and a full streaming pipeline run.
+For every stage and size, rows per second and peak traced memory
+are reported.
+
+Results can be saved as a JSON baseline, and later runs compared
+against it; the command exits with a non-zero status if any stage
+is slower or uses more memory than the baseline by more than the
+threshold. Baselines depend on the machine they were recorded on,
+so compare against one recorded on the same machine.
+
+Usage::
+
+    python -m benchmarks.run --save
+    python -m benchmarks.run --threshold 0.2
+'''
+import os
+import csv
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import tracemalloc
+
+import click
+from marshmallow import fields
+from openpyxl import Workbook
+
+import pipeline as pl
+from pipeline.mock_ckan import MockCKANServer
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'baselines', 'baseline.json')
+DEFAULT_SIZES = (1000, 10000, 50000)
+
+HEADERS = ['id', 'name', 'amount', 'visit_date', 'last_visit']
+CKAN_FIELDS = [
+    {'id': 'id', 'type': 'int'}, {'id': 'name', 'type': 'text'},
+    {'id': 'amount', 'type': 'numeric'}, {'id': 'visit_date', 'type': 'date'},
+    {'id': 'last_visit', 'type': 'timestamp'},
+]
+
+class BenchmarkSchema(pl.BaseSchema):
+    id = fields.Integer()
+    name = fields.String()
+    amount = fields.Float()
+    visit_date = fields.Date(format='%Y-%m-%d')
+    last_visit = fields.DateTime(format='%Y-%m-%dT%H:%M:%S')
+
+class StubResponse(object):
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+class StubSession(object):
+    '''Stands in for a CKAN instance's :py:class:`requests.Session`
+
+    Requests are answered immediately with a successful response, so
+    only the loader's own work (chunking, serializing, bookkeeping)
+    is measured.
+    '''
+    def post(self, url, data=None, timeout=None):
+        return StubResponse({'success': True, 'result': {
+            'id': 'benchmark', 'resource_id': 'benchmark',
+            'resources': [{'id': 'benchmark', 'name': 'benchmark'}]
+        }})
+
+def generate_rows(size):
+    '''Yield ``size`` rows of text, as an extractor would read them
+    '''
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(size):
+        visit = start + datetime.timedelta(minutes=i * 7)
+        yield [
+            str(i), 'Name {}'.format(i % 997), '{:.2f}'.format(i * 1.37),
+            visit.strftime('%Y-%m-%d'), visit.strftime('%Y-%m-%dT%H:%M:%S')
+        ]
+
+def generate_csv(path, size):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(generate_rows(size))
+
+def generate_xlsx(path, size):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADERS)
+    for row in generate_rows(size):
+        sheet.append(row)
+    workbook.save(path)
+
+def extract(connector, extractor_class, path):
+    connector = connector('', encoding=None) if extractor_class is pl.ExcelExtractor \
+        else connector('')
+    try:
+        extractor = extractor_class(connector.connect(path))
+        rows = []
+        for line in extractor.process_connection():
+            try:
+                rows.append(extractor.handle_line(line))
+            except pl.IsHeaderException:
+                continue
+        return rows
+    finally:
+        connector.close()
+
+def validate(schema, rows):
+    dumped = []
+    for row in rows:
+        loaded = schema.load(row)
+        dumped.append(schema.dump(loaded.data).data)
+    return dumped
+
+def load_to_ckan(records):
+    loader = pl.CKANDatastoreLoader(
+        ckan_root_url='http://ckan.invalid', ckan_api_key='',
+        package_id='benchmark', resource_name='benchmark',
+        fields=CKAN_FIELDS, key_fields=['id'], chunk_size=1000,
+        session=StubSession()
+    )
+    batches = (records[i:i + 5000] for i in range(0, len(records), 5000))
+    return loader.load_batches(batches)
+
+def load_to_mock_ckan(records, concurrency=1):
+    '''Load records to a local mock CKAN server over HTTP
+    '''
+    with MockCKANServer() as server:
+        loader = pl.CKANDatastoreLoader(
+            ckan_root_url=server.url, ckan_api_key='',
+            package_id='benchmark', resource_name='benchmark',
+            fields=CKAN_FIELDS, key_fields=['id'], chunk_size=1000,
+            concurrency=concurrency
+        )
+        batches = (records[i:i + 5000] for i in range(0, len(records), 5000))
+        return loader.load_batches(batches)
+
+def run_pipeline(path):
+    return pl.Pipeline('benchmark', 'Benchmark', settings_from_file=False, streaming=True) \
+        .connect(pl.FileConnector, path) \
+        .extract(pl.CSVExtractor) \
+        .schema(BenchmarkSchema, compiled=True) \
+        .load(
+            pl.CKANDatastoreLoader, ckan_root_url='http://ckan.invalid',
+            ckan_api_key='', package_id='benchmark', resource_name='benchmark',
+            fields=CKAN_FIELDS, key_fields=['id'], chunk_size=1000,
+            session=StubSession()
+        ) \
+        .run()
+
+class Inputs(object):
+    '''Inputs of one size, each generated the first time a stage
+    needs it
+
+    Arguments:
+        workdir: directory to write the input files to
+        size: number of rows
+    '''
+    def __init__(self, workdir, size):
+        self.workdir = workdir
+        self.size = size
+        self._cache = {}
+
+    def get(self, name):
+        '''Get an input by name: ``csv_path``, ``xlsx_path``, ``rows``
+        (extracted from the CSV) or ``records`` (the validated rows)
+        '''
+        if name not in self._cache:
+            self._cache[name] = getattr(self, 'make_' + name)()
+        return self._cache[name]
+
+    def make_csv_path(self):
+        path = os.path.join(self.workdir, 'input_{}.csv'.format(self.size))
+        generate_csv(path, self.size)
+        return path
+
+    def make_xlsx_path(self):
+        path = os.path.join(self.workdir, 'input_{}.xlsx'.format(self.size))
+        generate_xlsx(path, self.size)
+        return path
+
+    def make_rows(self):
+        return extract(pl.FileConnector, pl.CSVExtractor, self.get('csv_path'))
+
+    def make_records(self):
+        return validate(BenchmarkSchema(), self.get('rows'))
+
+# name, inputs the stage takes, stage
+BENCHMARKS = [
+    ('csv_extract', ['csv_path'], lambda path: extract(pl.FileConnector, pl.CSVExtractor, path)),
+    ('csv_extract_mmap', ['csv_path'], lambda path: extract(pl.MmapFileConnector, pl.CSVExtractor, path)),
+    ('xlsx_extract', ['xlsx_path'], lambda path: extract(pl.FileConnector, pl.ExcelExtractor, path)),
+    ('schema_validate', ['rows'], lambda rows: validate(BenchmarkSchema(), rows)),
+    ('schema_validate_compiled', ['rows'], lambda rows: validate(BenchmarkSchema().compile(), rows)),
+    ('ckan_load', ['records'], load_to_ckan),
+    ('ckan_load_http', ['records'], load_to_mock_ckan),
+    ('ckan_load_http_concurrent', ['records'], lambda records: load_to_mock_ckan(records, 4)),
+    ('pipeline', ['csv_path'], run_pipeline),
+]
+
+def measure(stage, rows, repeats=5, warmup=1):
+    '''Time a stage, then run it again to trace its peak memory
+
+    The stage is run ``warmup`` times untimed, so that imports and
+    caches don't count, then timed ``repeats`` times, keeping the
+    fastest run; slower runs are slowed down by noise from the rest
+    of the machine rather than by the stage itself. Memory is traced
+    in a separate run because tracing slows down allocation-heavy
+    code enough to skew the timing.
+
+    Arguments:
+        stage: a callable that runs the stage
+        rows: number of rows the stage processes
+
+    Keyword Arguments:
+        repeats: number of timed runs. Defaults to 5.
+        warmup: number of untimed runs first. Defaults to 1.
+
+    Returns:
+        A dictionary of ``rows``, ``seconds``, ``rows_per_sec``
+        and ``peak_memory`` (in bytes)
+    '''
+    for _ in range(warmup):
+        stage()
+
+    times = []
+    for _ in range(max(repeats, 1)):
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+    seconds = min(times)
+
+    tracemalloc.start()
+    try:
+        stage()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'rows': rows, 'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'peak_memory': peak_memory
+    }
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, workdir=None, repeats=5, warmup=1):
+    '''Run every benchmark stage over inputs of each size
+
+    Only the inputs that the selected stages need are generated.
+
+    Keyword Arguments:
+        sizes: numbers of rows in the generated inputs
+        stages: names of the stages to run. Defaults to all of them.
+        workdir: directory for the generated inputs. Defaults to a
+            temporary directory, removed afterwards.
+        repeats: number of timed runs of each stage, see
+            :py:func:`measure`. Defaults to 5.
+        warmup: number of untimed runs of each stage first.
+            Defaults to 1.
+
+    Returns:
+        A dictionary of results keyed by ``<stage>@<size>``, see
+        :py:func:`measure`
+    '''
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='pipeline-benchmarks-')
+    results = {}
+    try:
+        for size in sizes:
+            inputs = Inputs(workdir, size)
+            for name, needs, stage in BENCHMARKS:
+                if stages and name not in stages:
+                    continue
+                args = [inputs.get(i) for i in needs]
+                results['{}@{}'.format(name, size)] = measure(
+                    lambda: stage(*args), size, repeats, warmup
+                )
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+    return results
+
+def compare(results, baseline, threshold=0.25):
+    '''Find benchmarks that regressed against a baseline
+
+    Benchmarks that are missing from either side are ignored.
+
+    Arguments:
+        results: results from :py:func:`run_benchmarks`
+        baseline: results from an earlier run
+
+    Keyword Arguments:
+        threshold: fraction by which throughput may drop, or peak
+            memory may grow, before it counts as a regression.
+            Defaults to 0.25.
+
+    Returns:
+        A list of strings describing each regression
+    '''
+    regressions = []
+    for key in sorted(set(results) & set(baseline)):
+        current, previous = results[key], baseline[key]
+        if current.get('rows_per_sec') and previous.get('rows_per_sec') and \
+                current['rows_per_sec'] < previous['rows_per_sec'] * (1 - threshold):
+            regressions.append('{}: {:.0f} rows/sec, baseline {:.0f}'.format(
+                key, current['rows_per_sec'], previous['rows_per_sec']
+            ))
+        if current.get('peak_memory') and previous.get('peak_memory') and \
+                current['peak_memory'] > previous['peak_memory'] * (1 + threshold):
+            regressions.append('{}: {} bytes peak memory, baseline {}'.format(
+                key, current['peak_memory'], previous['peak_memory']
+            ))
+    return regressions
+
+@click.command()
+@click.option('--size', '-n', 'sizes', multiple=True, type=int,
+              help='Number of input rows; can be repeated')
+@click.option('--stage', '-s', 'stages', multiple=True,
+              help='Only run this stage; can be repeated')
+@click.option('--baseline', '-b', default=DEFAULT_BASELINE,
+              help='JSON baseline to compare against or save to')
+@click.option('--save', is_flag=True, help='Save the results as the baseline')
+@click.option('--threshold', '-t', default=0.25,
+              help='Allowed fractional regression, defaults to 0.25')
+@click.option('--output', '-o', default=None, help='Also write the results to this file')
+@click.option('--repeats', '-r', default=5,
+              help='Number of timed runs of each stage, the fastest is kept; defaults to 5')
+def main(sizes, stages, baseline, save, threshold, output, repeats):
+    '''Run the benchmarks and compare them to a stored baseline
+    '''
+    results = run_benchmarks(sizes or DEFAULT_SIZES, stages, repeats=repeats)
+    for key in sorted(results):
+        result = results[key]
+        click.echo('{:<36} {:>12.0f} rows/sec {:>12} bytes peak'.format(
+            key, result['rows_per_sec'] or 0, result['peak_memory']
+        ))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline)), exist_ok=True)
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo('Saved baseline to {}'.format(baseline))
+        return
+
+    if not os.path.exists(baseline):
+        click.echo('No baseline at {}; run with --save to record one'.format(baseline))
+        return
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), threshold)
+    for regression in regressions:
+        click.echo('REGRESSION ' + regression, err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo('No regressions beyond {:.0%} of {}'.format(threshold, baseline))
+
+if __name__ == '__main__':
+    main()
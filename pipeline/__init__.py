@@ -1,12 +1,13 @@
 from pipeline.extractors import CSVExtractor, ExcelExtractor
 from pipeline.connectors import (
-    FileConnector, RemoteFileConnector, HTTPConnector,
-    SFTPConnector
+    FileConnector, MmapFileConnector, RemoteFileConnector,
+    HTTPConnector, SFTPConnector, HashingReader
 )
 from pipeline.loaders import CKANDatastoreLoader
 from pipeline.pipeline import Pipeline
-from pipeline.schema import BaseSchema
+from pipeline.schema import BaseSchema, CompiledSchema, NativeDateTime, NativeDate
 from pipeline.exceptions import (
     InvalidConfigException, IsHeaderException, HTTPConnectorError,
-    DuplicateFileException, MissingStatusDatabaseError
+    DuplicateFileException, MissingStatusDatabaseError,
+    NotModifiedException
 )
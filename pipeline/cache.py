@@ -0,0 +1,248 @@
+import json
+import time
+import sqlite3
+import hashlib
+
+from contextlib import contextmanager
+
+
+class MetadataCache(object):
+    '''Persistent cache of CKAN resource metadata
+
+    Stores package/resource name -> resource id lookups along with a
+    fingerprint of the datastore fields in a sqlite table, so that
+    pipelines loading to the same resources don't have to call
+    ``package_show`` every time they are constructed. The table can
+    live in its own file or alongside the ``status`` table in the
+    status database.
+
+    Attributes:
+        path: location of the sqlite database
+        ttl: number of seconds before a cached entry is considered
+            stale
+    '''
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        with self.connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS
+                ckan_metadata (
+                    ckan_url TEXT NOT NULL,
+                    package_id TEXT NOT NULL,
+                    resource_name TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    fields_fingerprint TEXT,
+                    updated INTEGER NOT NULL,
+                    PRIMARY KEY (ckan_url, package_id, resource_name)
+                )
+            ''')
+
+    @contextmanager
+    def connect(self):
+        '''Open a short-lived connection, so that the cache can be
+        shared between processes without holding locks
+        '''
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def fingerprint(fields, key_fields=None):
+        '''Get a stable hash of a list of CKAN fields and primary key
+
+        Arguments:
+            fields: list of CKAN field dictionaries
+
+        Keyword Arguments:
+            key_fields: list of primary key fields
+
+        Returns:
+            A hexidecimal digest
+        '''
+        return hashlib.md5(json.dumps(
+            [fields, key_fields], sort_keys=True
+        ).encode('utf-8')).hexdigest()
+
+    def get(self, ckan_url, package_id, resource_name):
+        '''Look up a cached resource
+
+        Returns:
+            A two-tuple of the resource id and field fingerprint
+            if a fresh entry exists, ``None`` otherwise
+        '''
+        with self.connect() as conn:
+            result = conn.execute('''
+                SELECT resource_id, fields_fingerprint
+                FROM ckan_metadata
+                WHERE ckan_url = ?
+                AND package_id = ?
+                AND resource_name = ?
+                AND updated >= ?
+            ''', (ckan_url, package_id, resource_name, time.time() - self.ttl)).fetchone()
+        return tuple(result) if result else None
+
+    def set(self, ckan_url, package_id, resource_name, resource_id, fields_fingerprint=None):
+        '''Insert or replace a cached resource
+        '''
+        with self.connect() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO ckan_metadata (
+                    ckan_url, package_id, resource_name,
+                    resource_id, fields_fingerprint, updated
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                ckan_url, package_id, resource_name,
+                resource_id, fields_fingerprint, time.time()
+            ))
+
+    def invalidate(self, ckan_url, package_id, resource_name):
+        '''Remove a cached resource, for example after CKAN returns a 404 for it
+        '''
+        with self.connect() as conn:
+            conn.execute('''
+                DELETE FROM ckan_metadata
+                WHERE ckan_url = ?
+                AND package_id = ?
+                AND resource_name = ?
+            ''', (ckan_url, package_id, resource_name))
+
+
+class RowHashStore(object):
+    '''Hashes of the rows loaded to CKAN resources, keyed by primary key
+
+    Used by :py:class:`~pipeline.loaders.CKANDatastoreLoader` to only
+    upsert rows that are new or have changed since the last load.
+    Hashes are staged in a temporary table and only saved once the
+    rows they belong to have been upserted, so rows from a failed
+    upsert are loaded again the next time.
+
+    Attributes:
+        path: location of the sqlite database
+    '''
+    # number of keys looked up per query, below sqlite's variable limit
+    LOOKUP_SIZE = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self.conn
+
+    @property
+    def conn(self):
+        '''Connection to the database, opened on first use and again
+        after :py:meth:`close`
+        '''
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS
+                row_hashes (
+                    ckan_url TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    row_hash TEXT NOT NULL,
+                    PRIMARY KEY (ckan_url, resource_id, row_key)
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS
+                pending_row_hashes (
+                    ckan_url TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    row_hash TEXT NOT NULL,
+                    PRIMARY KEY (ckan_url, resource_id, row_key)
+                )
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def row_key(record, key_fields):
+        '''Get a string identifying a record by its primary key
+        '''
+        return json.dumps([record.get(k) for k in key_fields], default=str)
+
+    @staticmethod
+    def row_hash(record, salt=''):
+        '''Get a stable hash of a record
+
+        Keyword Arguments:
+            salt: string hashed along with the record, for example
+                a fingerprint of the datastore fields so that all
+                rows are loaded again when the fields change
+        '''
+        return hashlib.md5((salt + json.dumps(
+            record, sort_keys=True, default=str
+        )).encode('utf-8')).hexdigest()
+
+    def changed(self, ckan_url, resource_id, records, key_fields, salt=''):
+        '''Filter records down to the ones that are new or changed
+
+        The hashes of the returned records are staged, to be saved
+        with :py:meth:`commit`.
+
+        Arguments:
+            ckan_url: url of the CKAN instance
+            resource_id: id of the resource being loaded
+            records: a list of records
+            key_fields: the resource's primary key fields
+
+        Keyword Arguments:
+            salt: passed to :py:meth:`row_hash`
+
+        Returns:
+            A list of the records whose hashes don't match the
+            last saved load
+        '''
+        hashed = [
+            (self.row_key(record, key_fields), self.row_hash(record, salt), record)
+            for record in records
+        ]
+        stored = {}
+        for start in range(0, len(hashed), self.LOOKUP_SIZE):
+            keys = [i[0] for i in hashed[start:start + self.LOOKUP_SIZE]]
+            stored.update(self.conn.execute('''
+                SELECT row_key, row_hash
+                FROM row_hashes
+                WHERE ckan_url = ?
+                AND resource_id = ?
+                AND row_key IN ({})
+            '''.format(', '.join('?' * len(keys))), [ckan_url, resource_id] + keys).fetchall())
+
+        changed = [i for i in hashed if stored.get(i[0]) != i[1]]
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO pending_row_hashes
+            (ckan_url, resource_id, row_key, row_hash)
+            VALUES (?, ?, ?, ?)
+        ''', [(ckan_url, resource_id, key, row_hash) for key, row_hash, _ in changed])
+        return [i[2] for i in changed]
+
+    def commit(self):
+        '''Save the staged hashes
+        '''
+        with self.conn:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO row_hashes
+                SELECT ckan_url, resource_id, row_key, row_hash
+                FROM pending_row_hashes
+            ''')
+            self.conn.execute('DELETE FROM pending_row_hashes')
+
+    def rollback(self):
+        '''Throw away the staged hashes
+        '''
+        with self.conn:
+            self.conn.execute('DELETE FROM pending_row_hashes')
+
+    def close(self):
+        '''Close the connection. Any hashes that are still staged
+        are thrown away.
+        '''
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,22 +1,225 @@
 import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import mmap
+import zlib
+import zipfile
+import tempfile
+import atexit
 import hashlib
+import threading
 import requests
 import urllib
+import urllib.error
+import urllib.request
+import urllib.parse
 import paramiko
 
 from io import TextIOWrapper
 
-from pipeline.exceptions import HTTPConnectorError
+from pipeline.exceptions import HTTPConnectorError, NotModifiedException
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+class CRC32Hash(object):
+    '''hashlib-style wrapper around :py:func:`zlib.crc32`
+    '''
+    name = 'crc32'
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return '{:08x}'.format(self.value)
+
+def new_hash(algorithm='md5'):
+    '''Create a hash object for computing input checksums
+
+    Arguments:
+        algorithm: ``'crc32'``, an ``xxhash`` algorithm such as
+            ``'xxh64'`` or ``'xxh3_64'`` (which needs the optional
+            ``xxhash`` package), or any algorithm supported by
+            :py:func:`hashlib.new`, such as ``'md5'`` or ``'blake2b'``
+
+    Returns:
+        An object with ``update`` and ``hexdigest`` methods
+
+    Raises:
+        RuntimeError: if an ``xxhash`` algorithm is requested
+            and ``xxhash`` is not installed
+        ValueError: if the algorithm is unknown
+    '''
+    if algorithm == 'crc32':
+        return CRC32Hash()
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise RuntimeError('The xxhash package is required for {}'.format(algorithm))
+        if not hasattr(xxhash, algorithm):
+            raise ValueError('Unknown hash algorithm: {}'.format(algorithm))
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+class HashingReader(io.RawIOBase):
+    '''Raw stream wrapper that hashes bytes as they are read
+
+    Wrapping a connector's underlying byte stream in a
+    ``HashingReader`` lets the checksum of the input come out of
+    the same read that the extractor does, instead of reading the
+    source twice.
+
+    Arguments:
+        raw: a binary file-like object
+
+    Keyword Arguments:
+        blocksize: size of the reads used to drain the stream
+            when the digest is requested early. Defaults to 8192.
+        algorithm: hash algorithm, see
+            :py:func:`~pipeline.connectors.new_hash`. Defaults to
+            ``'md5'``.
+    '''
+    def __init__(self, raw, blocksize=8192, algorithm='md5'):
+        self.raw = raw
+        self.blocksize = blocksize
+        self.algorithm = algorithm
+        self.position, self.hashed = 0, 0
+        self.hash = new_hash(algorithm)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return hasattr(self.raw, 'seekable') and self.raw.seekable()
+
+    def readinto(self, b):
+        if hasattr(self.raw, 'readinto'):
+            n = self.raw.readinto(b) or 0
+        else:
+            data = self.raw.read(len(b))
+            n = len(data)
+            b[:n] = data
+        if self.position == self.hashed:
+            self.hash.update(memoryview(b)[:n])
+            self.hashed += n
+        self.position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = self.raw.seek(offset, whence)
+        if self.position == 0:
+            self.hash = new_hash(self.algorithm)
+            self.hashed = 0
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def hexdigest(self):
+        '''Get the hash of the whole stream
+
+        Any bytes that haven't been read yet are read and hashed
+        first. If the stream is seekable, its position is restored
+        afterwards so that reading can carry on.
+
+        Returns:
+            A hexidecimal representation of the stream's contents
+        '''
+        if self.position != self.hashed:
+            self.raw.seek(self.hashed)
+        for chunk in iter(lambda: self.raw.read(self.blocksize), b''):
+            self.hash.update(chunk)
+            self.hashed += len(chunk)
+        if self.seekable():
+            self.raw.seek(self.position)
+        else:
+            self.position = self.hashed
+        return self.hash.hexdigest()
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super(HashingReader, self).close()
 
 class Connector(object):
     '''Base connector class.
 
     Subclasses must implement ``connect``, ``checksum_contents``,
     and ``close`` methods.
+
+    Keyword Arguments:
+        encoding: encoding of the input. Defaults to ``utf-8``.
+        hash_algorithm: algorithm used for the input checksum, see
+            :py:func:`~pipeline.connectors.new_hash`. Defaults to
+            ``'md5'``. The algorithm is recorded in the status table
+            next to the checksum, so that checksums from different
+            algorithms are never compared.
+        blocksize: size in bytes of the reads used to read and hash
+            the input. Defaults to 1MB.
+
+    Attributes:
+        previous_validators: validators (``etag``, ``last_modified``,
+            ``content_length``) the source returned on the last
+            successful run, set by the pipeline before ``connect``
+        validators: validators returned by the source on this run,
+            stored by the pipeline if the run succeeds
     '''
     def __init__(self, *args, **kwargs):
         self.encoding = kwargs.get('encoding', 'utf-8')
+        self.hash_algorithm = kwargs.get('hash_algorithm', 'md5')
+        self.blocksize = kwargs.get('blocksize', 1024 * 1024)
+        # fail on an unknown or unavailable algorithm before connecting
+        new_hash(self.hash_algorithm)
         self.checksum = None
+        self.previous_validators, self.validators = {}, {}
+
+    def conditional_headers(self):
+        '''Build conditional request headers from ``previous_validators``
+
+        Returns:
+            A dictionary with ``If-None-Match`` and/or
+            ``If-Modified-Since`` headers
+        '''
+        headers = {}
+        if self.previous_validators.get('etag'):
+            headers['If-None-Match'] = self.previous_validators['etag']
+        if self.previous_validators.get('last_modified'):
+            headers['If-Modified-Since'] = self.previous_validators['last_modified']
+        return headers
+
+    def check_validators(self, status_code, headers):
+        '''Record a response's validators and stop if it is unchanged
+
+        Arguments:
+            status_code: HTTP status code of the response
+            headers: the response headers
+
+        Raises:
+            NotModifiedException: if the response is a 304, or has
+                the same strong ETag as the last run
+        '''
+        if status_code == 304:
+            raise NotModifiedException
+
+        content_length = headers.get('Content-Length')
+        self.validators = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_length': int(content_length) if content_length else None
+        }
+
+        etag = self.validators['etag']
+        # some servers ignore If-None-Match; a matching strong ETag
+        # still means the content is byte-for-byte the same
+        if etag and not etag.startswith('W/') and etag == self.previous_validators.get('etag'):
+            raise NotModifiedException
 
     def connect(self, target):
         '''Base connect method
@@ -27,10 +230,23 @@ class Connector(object):
         raise NotImplementedError
 
     def checksum_contents(self, target):
-        '''Should return an md5 hash of the contents of the conn object
+        '''Should return a hash of the contents of the conn object,
+        using the ``hash_algorithm``
         '''
         raise NotImplementedError
 
+    def rewindable(self, connection):
+        '''Check whether the checksum of the input can be taken before
+        it is extracted, without losing what the extractor will read
+
+        Arguments:
+            connection: the object returned by ``connect``
+
+        Returns:
+            Boolean for whether or not the input can be rewound
+        '''
+        return hasattr(connection, 'seekable') and connection.seekable()
+
     def close(self):
         '''Teardown any open connections (like to a file, for example)
         '''
@@ -38,12 +254,168 @@ class Connector(object):
 
 class FileConnector(Connector):
     '''Base connector for file objects.
+
+    The raw bytes of the file are read through a
+    :py:class:`~pipeline.connectors.HashingReader`, so that the
+    checksum is computed as the extractor reads the file. The
+    checksum is always of the raw bytes, so compressed inputs are
+    hashed before they are decompressed.
+
+    Compressed files are decompressed as they are read. gzip, bz2
+    and xz files are detected by their extension or their first
+    bytes; zip archives only by their ``.zip`` extension, since
+    xlsx workbooks are zip archives too.
+
+    Keyword Arguments:
+        compression: ``'infer'`` (the default) to detect the
+            compression, ``None`` to read the file as is, or one
+            of ``'gzip'``, ``'bz2'``, ``'xz'`` or ``'zip'``
+        zip_member: name of the file to read out of a zip archive.
+            Only needed if the archive holds more than one file.
+
+    The file object returned by ``connect`` has a ``local_path``
+    attribute: the absolute path of the file if its bytes are read
+    exactly as they are on disk, or ``None`` if the file is remote or
+    decompressed. Extractors can use it to read the file directly,
+    see :py:class:`~pipeline.extractors.CSVExtractor`.
     '''
+    COMPRESSION_EXTENSIONS = {
+        '.gz': 'gzip', '.gzip': 'gzip', '.bz2': 'bz2',
+        '.xz': 'xz', '.lzma': 'xz', '.zip': 'zip'
+    }
+    COMPRESSION_SIGNATURES = [
+        (b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz')
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super(FileConnector, self).__init__(*args, **kwargs)
+        self.compression = kwargs.get('compression', 'infer')
+        self.zip_member = kwargs.get('zip_member', None)
+        self._file, self._hasher = None, None
+        self.decompressed = False
+        self._streams = []
+
+    def infer_compression(self, stream, name=None):
+        '''Detect the compression of a stream from its name or first bytes
+
+        Arguments:
+            stream: a buffered binary stream, which is peeked at
+                without being moved
+
+        Keyword Arguments:
+            name: file name or path of the stream
+
+        Returns:
+            The compression, or ``None`` if the stream isn't compressed
+        '''
+        if self.compression != 'infer':
+            return self.compression
+        extension = os.path.splitext(name or '')[1].lower()
+        if extension in self.COMPRESSION_EXTENSIONS:
+            return self.COMPRESSION_EXTENSIONS[extension]
+        head = stream.peek(6)[:6]
+        for signature, compression in self.COMPRESSION_SIGNATURES:
+            if head.startswith(signature):
+                return compression
+        return None
+
+    def decompress(self, stream, name=None):
+        '''Wrap a buffered binary stream to decompress it as it is read
+
+        Zip archives need random access, so archives that come from
+        a stream that can't seek are spooled to a temporary file
+        first.
+
+        Arguments:
+            stream: a buffered binary stream
+
+        Keyword Arguments:
+            name: file name or path of the stream
+
+        Returns:
+            A binary stream of the decompressed contents, or
+            ``stream`` itself if it isn't compressed
+
+        Raises:
+            RuntimeError: if the compression isn't supported, or
+                the member to read from a zip archive is ambiguous
+        '''
+        compression = self.infer_compression(stream, name)
+        if compression is None:
+            return stream
+        if compression == 'gzip':
+            return gzip.GzipFile(fileobj=stream, mode='rb')
+        if compression == 'bz2':
+            return bz2.BZ2File(stream, mode='rb')
+        if compression == 'xz':
+            return lzma.LZMAFile(stream, mode='rb')
+        if compression != 'zip':
+            raise RuntimeError('Unsupported compression: {}'.format(compression))
+
+        if not stream.seekable():
+            spooled = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                spooled.write(chunk)
+            spooled.seek(0)
+            self._streams.append(stream)
+            stream = spooled
+        archive = zipfile.ZipFile(stream)
+        self._streams.extend([archive, stream])
+        members = [i.filename for i in archive.infolist() if not i.is_dir()]
+        member = self.zip_member
+        if member is None:
+            if len(members) != 1:
+                raise RuntimeError(
+                    'zip_member must be one of {}'.format(', '.join(members))
+                )
+            member = members[0]
+        elif member not in members:
+            raise RuntimeError('{} is not in the zip archive'.format(member))
+        return archive.open(member)
+
+    def wrap(self, raw, name=None):
+        '''Wrap a raw byte stream for hashing, decompressing and decoding
+
+        Arguments:
+            raw: a binary file-like object
+
+        Keyword Arguments:
+            name: file name or path of the stream, used to infer
+                its compression
+
+        Returns:
+            A text stream in the connector's encoding, or a
+            buffered binary stream if the encoding is ``None``
+        '''
+        self._hasher = HashingReader(raw, self.blocksize, self.hash_algorithm)
+        buffered = io.BufferedReader(self._hasher, buffer_size=self.blocksize)
+        self._file = self.decompress(buffered, name)
+        self.decompressed = self._file is not buffered
+        if self.decompressed:
+            self._streams.append(buffered)
+        if self.encoding:
+            self._file = TextIOWrapper(self._file, encoding=self.encoding)
+        self._file.local_path = None
+        return self._file
+
+    def set_local_path(self, target):
+        '''Set ``local_path`` on the connected file, if its bytes are
+        the local file's bytes as they are on disk
+
+        Arguments:
+            target: path of the connected file
+
+        Returns:
+            The connected file
+        '''
+        self._file.local_path = None if self.decompressed else os.path.abspath(target)
+        return self._file
+
     def connect(self, target):
         '''Connect to a file
 
-        Runs :py:func:`open` on the passed ``target``, sets the
-        result on the class as ``_file``, and returns it.
+        Opens the passed ``target``, sets the result on the
+        class as ``_file``, and returns it.
 
         Arguments:
             target: a valid filepath
@@ -51,47 +423,170 @@ class FileConnector(Connector):
         Returns:
             A `file-object`_
         '''
-        if self.encoding:
-            self._file = open(target, 'r', encoding=self.encoding)
-        else:
-            self._file = open(target, 'rb', encoding=self.encoding)
-        return self._file
+        self.wrap(open(target, 'rb', buffering=0), target)
+        return self.set_local_path(target)
 
-    def checksum_contents(self, target, blocksize=8192):
-        '''Open a file and get a md5 hash of its contents
+    def checksum_contents(self, target, blocksize=None):
+        '''Get a hash of a file's raw contents
+
+        The hash is taken from the bytes that have already been
+        read from the connected file; whatever hasn't been read
+        yet is read to finish it. For seekable files this can be
+        called before extraction without disturbing the reader.
 
         Arguments:
             target: a valid filepath
 
         Keyword Arguments:
             blocksize: the size of the block to read at a time
-                in the file. Defaults to 8192.
+                in the file. Defaults to the connector's
+                ``blocksize``.
 
         Returns:
             A hexidecimal representation of a file's contents.
         '''
-        _file = self._file if self._file else self.connect(target)
-        m = hashlib.md5()
-        for chunk in iter(lambda: _file.read(blocksize, ), b''):
-            if not chunk:
-                break
-            m.update(chunk.encode(self.encoding) if self.encoding else chunk)
-        self._file.seek(0)
-        return m.hexdigest()
+        if self._hasher is None:
+            self.connect(target)
+        self._hasher.blocksize = blocksize or self.blocksize
+        return self._hasher.hexdigest()
+
+    def rewindable(self, connection):
+        '''Check whether the raw bytes of the connected file can be
+        rewound. Decompressors can report that they are seekable even
+        when the stream they read from isn't, so the raw stream is
+        checked rather than ``connection``.
+        '''
+        return self._hasher is not None and self._hasher.seekable()
 
     def close(self):
         '''Closes the connected file if it is not closed already
         '''
         if not self._file.closed:
             self._file.close()
+        # decompressors don't close the streams they read from
+        while self._streams:
+            self._streams.pop().close()
         return
 
+class MmapReader(io.RawIOBase):
+    '''Raw stream over a memory-mapped file
+
+    Reads copy straight from the mapping into the caller's buffer,
+    without going through the operating system's file reads.
+
+    Arguments:
+        mapping: a :py:class:`mmap.mmap` object
+        name: path of the mapped file
+    '''
+    def __init__(self, mapping, name=None):
+        self.mapping = mapping
+        self.name = name
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.mapping) - self.position)
+        if n <= 0:
+            return 0
+        with memoryview(self.mapping) as view:
+            b[:n] = view[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.mapping)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+class MmapFileConnector(FileConnector):
+    '''Connector for large local files, read through a memory map
+
+    The file is mapped into memory read-only. The extractor reads
+    from the mapping, and the checksum is taken over the mapped bytes
+    directly, without a separate read of the file. Empty files can't
+    be mapped, so they are read like with
+    :py:class:`~pipeline.connectors.FileConnector`.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(MmapFileConnector, self).__init__(*args, **kwargs)
+        self._mapping = None
+
+    def connect(self, target):
+        '''Map a file into memory
+
+        Arguments:
+            target: a valid filepath
+
+        Returns:
+            A `file-object`_ reading from the mapping
+        '''
+        if os.path.getsize(target) == 0:
+            return super(MmapFileConnector, self).connect(target)
+        with open(target, 'rb') as f:
+            self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffered = io.BufferedReader(
+            MmapReader(self._mapping, name=target), buffer_size=self.blocksize
+        )
+        self._file = self.decompress(buffered, target)
+        self.decompressed = self._file is not buffered
+        if self.decompressed:
+            self._streams.append(buffered)
+        if self.encoding:
+            self._file = TextIOWrapper(self._file, encoding=self.encoding)
+        return self.set_local_path(target)
+
+    def checksum_contents(self, target, blocksize=None):
+        '''Get a hash of the mapped file's contents
+
+        Arguments:
+            target: a valid filepath
+
+        Returns:
+            A hexidecimal representation of a file's contents.
+        '''
+        if self._mapping is None and self._hasher is None:
+            self.connect(target)
+        if self._mapping is None:
+            return super(MmapFileConnector, self).checksum_contents(target, blocksize)
+        checksum = new_hash(self.hash_algorithm)
+        checksum.update(self._mapping)
+        return checksum.hexdigest()
+
+    def rewindable(self, connection):
+        '''The checksum is taken from the mapping, so it never
+        disturbs the reader
+        '''
+        if self._mapping is not None:
+            return True
+        return super(MmapFileConnector, self).rewindable(connection)
+
+    def close(self):
+        '''Closes the connected file and its memory map
+        '''
+        super(MmapFileConnector, self).close()
+        if self._mapping is not None and not self._mapping.closed:
+            self._mapping.close()
+
 class RemoteFileConnector(FileConnector):
     '''Connector for a file located at a remote (HTTP-accessible) resource
 
     This class should be used to connect to a file available over
     HTTP. For example, if there is a CSV that is streamed from a
     web server, this is the correct connector to use.
+
+    Requests are made conditional on the validators from the last
+    successful run, so an unchanged file is never downloaded.
     '''
     def connect(self, target):
         '''Connect to a remote target
@@ -101,31 +596,196 @@ class RemoteFileConnector(FileConnector):
 
         Returns:
             :py:class:`io.TextIOWrapper` around the opened URL.
+
+        Raises:
+            NotModifiedException: if the server reports that the
+                file hasn't changed since the last run
         '''
-        self._file = TextIOWrapper(urllib.request.urlopen(target), encoding=self.encoding)
-        return self._file
+        headers = self.conditional_headers()
+        request = urllib.request.Request(target, headers=headers) if headers else target
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                raise NotModifiedException
+            raise
+
+        headers = getattr(response, 'headers', None)
+        if headers is not None:
+            try:
+                self.check_validators(getattr(response, 'status', 200), headers)
+            except NotModifiedException:
+                response.close()
+                raise
+
+        return self.wrap(response, urllib.parse.urlparse(target).path)
 
 class HTTPConnector(Connector):
     ''' Connect to remote file via HTTP
+
+    Requests are made conditional on the validators from the last
+    successful run, and raise
+    :py:class:`~pipeline.exceptions.NotModifiedException` on a 304.
     '''
     def connect(self, target):
-        response = requests.get(target)
+        response = requests.get(target, headers=self.conditional_headers())
+        if response.status_code == 304:
+            raise NotModifiedException
         if response.status_code > 299:
             raise HTTPConnectorError(
                 'Request could not be processed. Status Code: ' +
                 str(response.status_code)
             )
 
+        self.check_validators(response.status_code, response.headers)
+        self._response = response
+
         if 'application/json' in response.headers['content-type']:
             return response.json()
 
         return response.text
 
+    def checksum_contents(self, target):
+        '''Get a hash of the response body fetched by ``connect``
+        '''
+        checksum = new_hash(self.hash_algorithm)
+        checksum.update(self._response.content)
+        return checksum.hexdigest()
+
     def close(self):
         return True
 
+class SFTPSessionPool(object):
+    '''Process-level pool of authenticated SFTP sessions
+
+    Sessions are keyed by host, port, username and a hash of the
+    password, so connectors pulling from the same server with the
+    same credentials one after the other reuse an open, authenticated
+    transport instead of performing key exchange and authentication
+    again. Idle sessions are closed once they expire, and sessions
+    are health checked before being handed out.
+    '''
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host, port, username, password):
+        '''Key of the sessions opened with these credentials. Only a
+        hash of the password is kept.
+        '''
+        digest = hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+        return (host, port, username, digest)
+
+    @staticmethod
+    def connect(host, port, username, password):
+        '''Open an authenticated session, closing the transport if
+        authentication fails so that its thread doesn't linger
+
+        Returns:
+            A two-tuple of a :py:class:`paramiko.Transport` and a
+            :py:class:`paramiko.SFTPClient`
+        '''
+        transport = paramiko.Transport((host, port))
+        try:
+            transport.connect(username=username, password=password)
+            return transport, paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+
+    def acquire(self, host, port, username, password):
+        '''Get a healthy session from the pool, or open a new one
+
+        Health checks make a round trip to the server, so they are
+        done without holding the lock.
+
+        Returns:
+            A two-tuple of a :py:class:`paramiko.Transport` and a
+            :py:class:`paramiko.SFTPClient`
+        '''
+        key = self.key(host, port, username, password)
+        while True:
+            with self._lock:
+                self.evict()
+                sessions = self._sessions.get(key)
+                if not sessions:
+                    break
+                transport, client, _ = sessions.pop()
+            if self.is_healthy(transport, client):
+                return transport, client
+            self.close_session(transport, client)
+
+        return self.connect(host, port, username, password)
+
+    def release(self, host, port, username, password, transport, client, idle_timeout=300):
+        '''Return a session to the pool
+
+        Keyword Arguments:
+            idle_timeout: number of seconds the session is kept
+                open without being used. Defaults to 300.
+        '''
+        with self._lock:
+            self._sessions.setdefault(self.key(host, port, username, password), []).append(
+                (transport, client, time.time() + idle_timeout)
+            )
+            self.evict()
+
+    @staticmethod
+    def is_healthy(transport, client):
+        '''Check that a session's transport is up and answering requests
+        '''
+        try:
+            if not (transport.is_active() and transport.is_authenticated()):
+                return False
+            client.normalize('.')
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def close_session(transport, client):
+        try:
+            client.close()
+        finally:
+            transport.close()
+
+    def evict(self):
+        '''Close sessions that have been idle past their timeout.
+        Must be called with the lock held.
+        '''
+        now = time.time()
+        for key, sessions in self._sessions.items():
+            for session in [i for i in sessions if i[2] < now]:
+                sessions.remove(session)
+                self.close_session(*session[:2])
+
+    def close_all(self):
+        '''Close every pooled session
+        '''
+        with self._lock:
+            for sessions in self._sessions.values():
+                for transport, client, _ in sessions:
+                    self.close_session(transport, client)
+            self._sessions = {}
+
+sftp_pool = SFTPSessionPool()
+atexit.register(sftp_pool.close_all)
+
 class SFTPConnector(FileConnector):
     ''' Connect to remote file via SFTP
+
+    The remote file is streamed with pipelined, prefetched reads
+    rather than being downloaded before extraction starts. Its size
+    and modification time are recorded as the connector's
+    validators; if they match the last successful run, the file is
+    skipped before anything is transferred.
+
+    If the ``pool`` keyword argument is set, the authenticated
+    session is taken from and returned to
+    :py:class:`~pipeline.connectors.SFTPSessionPool`, where it stays
+    open for ``pool_idle_timeout`` seconds (default 300) for other
+    connectors to the same host and user.
     '''
     def __init__(self, *args, **kwargs):
         super(SFTPConnector, self).__init__(*args, **kwargs)
@@ -134,26 +794,97 @@ class SFTPConnector(FileConnector):
         self.password = kwargs.get('password', '')
         self.port = kwargs.get('port', 22)
         self.root_dir = kwargs.get('root_dir', '').rstrip('/') + '/'
+        self.pool = kwargs.get('pool', False)
+        self.pool_idle_timeout = kwargs.get('pool_idle_timeout', 300)
         self.conn, self.transport, self._file = None, None, None
+        self.session_open = False
 
-    def connect(self, target):
-        try:
-            self.transport = paramiko.Transport((self.host, self.port))
-            self.transport.connect(
-                username=self.username, password=self.password
+    def open_session(self):
+        '''Open an authenticated session, from the pool if enabled
+        '''
+        if self.pool:
+            self.transport, self.conn = sftp_pool.acquire(
+                self.host, self.port, self.username, self.password
+            )
+        else:
+            self.transport, self.conn = SFTPSessionPool.connect(
+                self.host, self.port, self.username, self.password
             )
-            self.conn = paramiko.SFTPClient.from_transport(self.transport)
-            self._file = io.BytesIO(self.conn.open(self.root_dir + target, 'r').read())
-            if self.encoding:
-                self._file = io.TextIOWrapper(self._file, self.encoding)
+        self.session_open = True
+
+    def close_session(self, discard=False):
+        '''Close the session, or return it to the pool if enabled
+
+        Keyword Arguments:
+            discard: boolean for whether or not to close a pooled
+                session instead of returning it, e.g. after an error
+                that may have left it broken
+        '''
+        if not self.session_open:
+            return
+        if self.pool and not discard:
+            sftp_pool.release(
+                self.host, self.port, self.username, self.password,
+                self.transport, self.conn, self.pool_idle_timeout
+            )
+        else:
+            SFTPSessionPool.close_session(self.transport, self.conn)
+        self.session_open = False
 
-        except IOError as e:
-            raise e
+    def check_stat(self, path):
+        '''Record the remote file's size and mtime and stop if they are unchanged
+
+        Arguments:
+            path: full path of the remote file
+
+        Returns:
+            The remote file's size in bytes
+
+        Raises:
+            NotModifiedException: if the size and modification time
+                match the last successful run
+        '''
+        attributes = self.conn.stat(path)
+        self.validators = {
+            'etag': None,
+            'last_modified': str(int(attributes.st_mtime)),
+            'content_length': attributes.st_size
+        }
+        previous = self.previous_validators
+        if previous.get('last_modified') is not None and all(
+            previous.get(k) == self.validators[k] for k in ('last_modified', 'content_length')
+        ):
+            raise NotModifiedException
+        return attributes.st_size
+
+    def connect(self, target):
+        self.open_session()
+
+        path = self.root_dir + target
+        remote = None
+        try:
+            size = self.check_stat(path)
+            remote = self.conn.open(path, 'r')
+            if hasattr(remote, 'prefetch'):
+                # request all of the file's blocks up front instead
+                # of waiting on a round trip for each read
+                remote.prefetch(size)
+            self.wrap(remote, path)
+        except NotModifiedException:
+            self.close_session()
+            raise
+        except Exception:
+            # the session may be broken, so it isn't returned to the pool
+            if remote is not None:
+                remote.close()
+            self.close_session(discard=True)
+            raise
 
         return self._file
 
     def close(self):
-        self.conn.close()
-        self.transport.close()
-        if not self._file.closed:
-            self._file.close()
\ No newline at end of file
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        while self._streams:
+            self._streams.pop().close()
+        self.close_session()
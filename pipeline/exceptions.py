@@ -21,6 +21,11 @@ class DuplicateFileException(Exception):
     '''Thrown when two checksums match
     '''
 
+class NotModifiedException(DuplicateFileException):
+    '''Thrown when a source reports that it hasn't changed since the
+    last run, before any of it is downloaded
+    '''
+
 class InvalidPipelineError(Exception):
     pass
 
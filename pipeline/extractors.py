@@ -1,9 +1,124 @@
+import os
 import csv
 import datetime
 import io
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from pipeline.exceptions import IsHeaderException
-from xlrd import open_workbook, xldate_as_tuple, XL_CELL_DATE
+from xlrd import open_workbook, xldate_as_datetime, XL_CELL_DATE
+from openpyxl import load_workbook
+
+
+def split_records(path, start, size, quotechar='"', blocksize=1 << 20):
+    '''Split a delimited file into byte ranges on record boundaries
+
+    Each range ends just after a newline. A newline only ends a
+    record if an even number of quote characters comes before it,
+    so newlines inside quoted fields never split a record (escaped
+    quotes are doubled, which keeps the count even).
+
+    Arguments:
+        path: path to a local file
+        start: byte offset to start from, e.g. the end of the
+            header line
+        size: approximate size of each range, in bytes
+
+    Keyword Arguments:
+        quotechar: the file's quote character
+        blocksize: size of the reads used to scan the file
+
+    Returns:
+        A list of ``(start, end)`` byte offsets covering the file
+        from ``start`` to the end
+    '''
+    length = os.path.getsize(path)
+    quote = quotechar.encode('ascii') if quotechar else None
+    boundaries, target = [start], start + size
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position, quotes = start, 0
+        while target < length:
+            block = f.read(blocksize)
+            if not block:
+                break
+            offset = 0
+            while target < length:
+                newline = block.find(b'\n', max(target - position, offset))
+                if newline == -1:
+                    break
+                if quote is None or (quotes + block.count(quote, 0, newline)) % 2 == 0:
+                    boundaries.append(position + newline + 1)
+                    target = boundaries[-1] + size
+                offset = newline + 1
+            if quote is not None:
+                quotes += block.count(quote)
+            position += len(block)
+    if boundaries[-1] < length:
+        boundaries.append(length)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def parse_range(path, start, end, encoding='utf-8', newline=None, **fmtparams):
+    '''Parse the records in a byte range of a delimited file
+
+    The range is decoded the same way the connectors decode files,
+    with universal newlines by default, so that parsed values match
+    the ones read from the connection.
+
+    Arguments:
+        path: path to a local file
+        start: byte offset of the first record
+        end: byte offset just after the last record
+
+    Keyword Arguments:
+        encoding: the file's encoding
+        newline: passed to :py:class:`io.TextIOWrapper`
+        fmtparams: passed to :py:func:`csv.reader`
+
+    Returns:
+        A list of records, each a list of strings
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline=newline)
+    return list(csv.reader(text, **fmtparams))
+
+
+def ascii_compatible(encoding, characters='\r\n'):
+    '''Check whether an encoding stores ASCII characters as the same
+    single bytes, so that a file can be split by searching for them
+
+    Arguments:
+        encoding: name of the encoding
+
+    Keyword Arguments:
+        characters: the characters that have to be found
+    '''
+    try:
+        encoded = characters.encode('ascii')
+        return encoded.decode(encoding) == characters
+    except (LookupError, UnicodeError):
+        return False
+
+
+def header_end(path, quotechar='"', blocksize=1 << 20):
+    '''Get the byte offset just after a delimited file's first record
+    '''
+    quote = quotechar.encode('ascii') if quotechar else None
+    with open(path, 'rb') as f:
+        position, quotes = 0, 0
+        for block in iter(lambda: f.read(blocksize), b''):
+            newline = block.find(b'\n')
+            while newline != -1:
+                if quote is None or (quotes + block.count(quote, 0, newline)) % 2 == 0:
+                    return position + newline + 1
+                newline = block.find(b'\n', newline + 1)
+            if quote is not None:
+                quotes += block.count(quote)
+            position += len(block)
+    return position
 
 
 class Extractor(object):
@@ -28,8 +143,61 @@ class Extractor(object):
         raise NotImplementedError
 
 
+class Row(Mapping):
+    '''Compact, read-only mapping of schema headers to a line's values
+
+    All of the rows from an extractor share one header -> position
+    index, so each row only holds a reference to it and to the
+    line it was read from. Empty strings are read as ``None``.
+
+    Arguments:
+        index: dictionary of schema headers to column positions
+        values: the line's values
+    '''
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index, values):
+        self.index = index
+        self.values = values
+
+    def get(self, key, default=None):
+        position = self.index.get(key)
+        if position is None or position >= len(self.values):
+            return default
+        value = self.values[position]
+        return None if value == '' else value
+
+    def __getitem__(self, key):
+        position = self.index[key]
+        if position >= len(self.values):
+            raise KeyError(key)
+        value = self.values[position]
+        return None if value == '' else value
+
+    def __iter__(self):
+        length = len(self.values)
+        return (key for key, position in self.index.items() if position < length)
+
+    def __len__(self):
+        return min(len(self.index), len(self.values))
+
+    def __repr__(self):
+        return 'Row({})'.format(dict(self))
+
+
 class TableExtractor(Extractor):
     '''Abstract Extractor subclass for extracting data in a tabular format
+
+    Keyword Arguments:
+        headers: list of headers
+        delimiter: column delimiter. Defaults to ``,``
+        firstline_headers: boolean for whether or not the first line
+            holds the headers. Defaults to True.
+        compact_rows: boolean for whether or not the pipeline should
+            read rows with :py:meth:`extract_rows`, which yields
+            :py:class:`~pipeline.extractors.Row` objects and skips the
+            header line by its position instead of comparing every
+            line to the headers. Defaults to False.
     '''
 
     def __init__(self, connection, *args, **kwargs):
@@ -37,6 +205,7 @@ class TableExtractor(Extractor):
         self.headers = kwargs.get('headers', None)
         self.delimiter = kwargs.get('delimiter', ',')
         self.firstline_headers = kwargs.get('firstline_headers', True)
+        self.compact_rows = kwargs.get('compact_rows', False)
 
     def set_headers(self, headers=None):
         '''Sets headers from file or passed headers
@@ -65,12 +234,19 @@ class TableExtractor(Extractor):
             self.schema_headers = self.headers
             return
         elif self.firstline_headers:
-            reader = self.process_connection()
+            reader = self.header_reader()
             self.headers = next(reader)
             self.schema_headers = self.create_schema_headers(self.headers)
         else:
             raise RuntimeError('No headers were passed or detected.')
 
+    def header_reader(self):
+        '''Get an iterator over the connection whose first line is the
+        header line, used by :py:meth:`set_headers`. Defaults to
+        :py:meth:`process_connection`.
+        '''
+        return self.process_connection()
+
     def create_schema_headers(self, headers):
         '''Maps headers to schema headers
 
@@ -94,54 +270,229 @@ class TableExtractor(Extractor):
             raise IsHeaderException
         return OrderedDict(zip(self.schema_headers, [i if i != '' else None for i in line]))
 
+    def extract_rows(self, raw):
+        '''Generator of compact rows
+
+        Arguments:
+            raw: iterable returned from ``process_connection``
+
+        Yields:
+            A :py:class:`~pipeline.extractors.Row` for each line
+            that isn't the header line. Only the first line is
+            checked, since some ``process_connection`` methods start
+            from the header line and others start after it.
+        '''
+        raw = iter(raw)
+        index = {header: position for position, header in enumerate(self.schema_headers)}
+        for line in raw:
+            if line != self.headers:
+                yield Row(index, line)
+            break
+        for line in raw:
+            yield Row(index, line)
+
 
 class CSVExtractor(TableExtractor):
     def __init__(self, connection, *args, **kwargs):
         '''TableExtractor subclass for csv or character-delimited files
+
+        Keyword Arguments:
+            parse_workers: number of processes used to parse the
+                file. If greater than 1 and the connection is an
+                uncompressed local file (its ``local_path`` is set by
+                :py:class:`~pipeline.connectors.FileConnector`), the
+                file is split into byte ranges on record boundaries,
+                which are parsed in a process pool and yielded in
+                their original order. Defaults to 1.
+                The file is read once to find the record boundaries
+                and once more by the workers, and a pipeline reads it
+                again for its input checksum, so this pays off when
+                parsing rather than disk reads is the bottleneck.
+            range_size: approximate size in bytes of the ranges
+                parsed by each worker. Defaults to 16MB.
+                Parallel parsing needs an ASCII-compatible encoding,
+                such as utf-8 or latin-1; a RuntimeError is raised
+                for others, such as utf-16.
+            quotechar: the file's quote character. Defaults to ``"``.
         '''
         super(CSVExtractor, self).__init__(connection, *args, **kwargs)
         self.delimiter = kwargs.get('delimiter', ',')
+        self.quotechar = kwargs.get('quotechar', '"')
+        self.encoding = getattr(connection, 'encoding', None) or 'utf-8'
+        if kwargs.get('parse_workers', 1) > 1 and \
+                not ascii_compatible(self.encoding, '\r\n' + (self.quotechar or '')):
+            raise RuntimeError(
+                'Parallel parsing needs an ASCII-compatible encoding and quote '
+                'character, not {}'.format(self.encoding)
+            )
+        self.parse_workers = kwargs.get('parse_workers', 1)
+        self.range_size = kwargs.get('range_size', 16 * 1024 * 1024)
         self.set_headers()
 
+    def header_reader(self):
+        '''Headers are always read sequentially from the connection
+        '''
+        return self.reader()
+
+    def reader(self):
+        '''Get a :py:func:`csv.reader` over the connection
+        '''
+        return csv.reader(self.connection, delimiter=self.delimiter, quotechar=self.quotechar)
+
     def process_connection(self):
-        reader = csv.reader(self.connection, delimiter=self.delimiter)
-        return reader
+        # only files that the connector reads unchanged from disk,
+        # see FileConnector
+        path = getattr(self.connection, 'local_path', None)
+        if self.parse_workers > 1 and path:
+            return self.parse_parallel(path)
+        return self.reader()
+
+    def parse_parallel(self, path):
+        '''Parse a local file in ``parse_workers`` processes
+
+        At most two ranges per worker are parsed at a time, so
+        memory stays bounded by the ``range_size``. The connection
+        itself is left unread past the header line, so computing the
+        connector's checksum afterwards reads the rest of the file.
+
+        Arguments:
+            path: path to the connected file
+
+        Yields:
+            Each record after the header line, as a list of strings
+        '''
+        start = header_end(path, self.quotechar) if self.firstline_headers else 0
+        fmtparams = {
+            'encoding': self.encoding,
+            'delimiter': self.delimiter, 'quotechar': self.quotechar
+        }
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as executor:
+            pending = deque()
+            for range_start, range_end in split_records(path, start, self.range_size, self.quotechar):
+                pending.append(executor.submit(parse_range, path, range_start, range_end, **fmtparams))
+                while len(pending) > self.parse_workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
 
 
 class ExcelExtractor(TableExtractor):
     '''TableExtractor subclass for Microsft Excel spreadsheet files (xls, xlsx)
+
+    The workbook is opened once, the first time rows are read, and
+    released once they have all been read; rows are yielded lazily.
+    xls workbooks are opened with ``on_demand`` so that only the
+    selected sheet is loaded, and xlsx workbooks are streamed with
+    openpyxl's read-only reader.
+
+    Date cells are returned as strings in ``date_format``, which
+    defaults to ``%m/%d/%Y``. Pass ``native_dates=True`` to get them
+    as :py:class:`datetime.datetime` objects instead, without the
+    format and parse round trip; they can be validated with
+    :py:class:`~pipeline.schema.NativeDateTime` and
+    :py:class:`~pipeline.schema.NativeDate` schema fields.
     '''
 
     def __init__(self, connection, *args, **kwargs):
         super(ExcelExtractor, self).__init__(connection, *args, **kwargs)
         self.firstline_headers = kwargs.get('firstline_headers', True)
         self.sheet_index = kwargs.get('sheet_index', 0)
+        self.date_format = kwargs.get('date_format', '%m/%d/%Y')
+        self.native_dates = kwargs.get('native_dates', False)
         self.datemode = None
+        self.workbook = None
+        self.sheet = None
         self.set_headers()
 
-    def process_connection(self):
-        data = []
+    def open_workbook(self):
+        '''Open the workbook and select the sheet, if that hasn't
+        been done yet
+
+        xlsx files are zip archives, so they are told apart from xls
+        files by their first bytes.
+        '''
+        if self.sheet is not None:
+            return
         self.connection.seek(0)
-        contents = self.connection.read()
-        workbook = open_workbook(file_contents=contents)
-        sheet = workbook.sheet_by_index(self.sheet_index)
-        self.datemode = workbook.datemode
-        for i in range(sheet.nrows):
-            data.append(self._read_line(sheet, i))
-
-        return iter(data)
-
-    def _read_line(self, sheet, row):
-        '''Helper function to read line from Excel files and handle representations of
-            different data types
-        '''
-        line = []
-        for col in range(sheet.ncols):
-            cell = sheet.cell(row, col)
-            if cell.ctype == XL_CELL_DATE:
-                date = datetime.datetime(*xldate_as_tuple(cell.value, self.datemode))
-                dt = date.strftime('%m/%d/%Y')  # todo: return datetime and handle the formatting elsewhere
-                line.append(dt)
-            else:
-                line.append(cell.value)
-        return line
+        is_xlsx = self.connection.read(4) == b'PK\x03\x04'
+        self.connection.seek(0)
+        if is_xlsx:
+            self.workbook = load_workbook(self.connection, read_only=True, data_only=True)
+            self.sheet = self.workbook.worksheets[self.sheet_index]
+        else:
+            self.workbook = open_workbook(file_contents=self.connection.read(), on_demand=True)
+            self.sheet = self.workbook.sheet_by_index(self.sheet_index)
+            self.datemode = self.workbook.datemode
+
+    def release_workbook(self):
+        '''Close the workbook, so that it stops holding on to the
+        file and the sheets it has loaded
+        '''
+        if self.workbook is None:
+            return
+        if self.datemode is None:
+            self.workbook.close()
+        else:
+            self.workbook.release_resources()
+        self.workbook = None
+        self.sheet = None
+
+    def header_reader(self):
+        # read the header line without releasing the workbook, which
+        # is then reused by process_connection
+        return self.rows()
+
+    def process_connection(self):
+        '''Generator of the rows in the selected sheet, as lists
+
+        The workbook is released once the rows have been read, or the
+        generator is closed.
+        '''
+        try:
+            yield from self.rows()
+        finally:
+            self.release_workbook()
+
+    def rows(self):
+        '''Generator of the rows in the selected sheet, as lists,
+        which leaves the workbook open
+        '''
+        self.open_workbook()
+        if self.datemode is None:
+            # openpyxl already returns datetimes for date cells
+            for row in self.sheet.iter_rows(values_only=True):
+                row = list(row)
+                if not self.native_dates:
+                    for col, value in enumerate(row):
+                        if isinstance(value, datetime.datetime):
+                            row[col] = value.strftime(self.date_format)
+                yield row
+        else:
+            dates = self.date_columns()
+            for i in range(self.sheet.nrows):
+                line = self.sheet.row_values(i)
+                for col, values in dates.items():
+                    line[col] = values[i]
+                yield line
+
+    def date_columns(self):
+        '''Convert the date cells of an xls sheet, a column at a time
+
+        Each column's cell types are read in one go, and only the
+        columns that hold dates are converted.
+
+        Returns:
+            A dictionary of column index -> the column's values, with
+            its date cells converted
+        '''
+        columns = {}
+        for col in range(self.sheet.ncols):
+            types = self.sheet.col_types(col)
+            if XL_CELL_DATE not in types:
+                continue
+            values = self.sheet.col_values(col)
+            for row in [i for i, ctype in enumerate(types) if ctype == XL_CELL_DATE]:
+                date = xldate_as_datetime(values[row], self.datemode)
+                values[row] = date if self.native_dates else date.strftime(self.date_format)
+            columns[col] = values
+        return columns
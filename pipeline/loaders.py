@@ -1,10 +1,74 @@
 import requests
 import json
+import time
 import datetime
+import itertools
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from pipeline.cache import MetadataCache, RowHashStore
 from pipeline.exceptions import CKANException
 
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(ckan_root_url, api_key, pool_size=10, keep_alive=True):
+    '''Get a pooled HTTP session for a CKAN instance
+
+    Sessions are shared across every loader in the process that
+    talks to the same CKAN instance with the same API key, so
+    repeated and chunked API calls reuse open connections instead
+    of paying for a new TCP/TLS handshake each time.
+
+    Arguments:
+        ckan_root_url: root url of the CKAN instance
+        api_key: CKAN API key, sent as the default
+            ``authorization`` header
+
+    Keyword Arguments:
+        pool_size: maximum number of connections kept open to
+            the CKAN host. Defaults to 10.
+        keep_alive: whether or not to keep connections open
+            between requests. Defaults to ``True``.
+
+    Returns:
+        A :py:class:`requests.Session`
+    '''
+    key = (ckan_root_url, api_key, pool_size, keep_alive)
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            session.headers.update({
+                'content-type': 'application/json',
+                'authorization': api_key
+            })
+            if not keep_alive:
+                session.headers['connection'] = 'close'
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
 class Loader(object):
+    '''Base loader
+
+    Attributes:
+        checkpoint: optional callable, called with the number of
+            input records that have been committed whenever the
+            loader commits more of them. Set by the pipeline when
+            it logs its status.
+        resume_from: number of input records committed by an
+            earlier, failed run with the same input, which are
+            skipped. Set by the pipeline when it is resumed.
+    '''
+    # class attributes, so that subclasses which don't call
+    # ``Loader.__init__`` still have them
+    checkpoint = None
+    resume_from = 0
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -16,17 +80,93 @@ class Loader(object):
         '''
         raise NotImplementedError
 
+    def load_batches(self, batches):
+        '''Load an iterable of batches of data
+
+        Used by pipelines running in streaming mode. By default,
+        each batch is passed to ``load`` in turn; loaders that
+        have one-off setup or teardown work should override this.
+
+        Arguments:
+            batches: an iterable of lists of data
+        '''
+        committed = self.resume_from
+        for batch in self.skip_committed(batches):
+            self.load(batch)
+            committed += len(batch)
+            self.save_checkpoint(committed)
+
+    def skip_committed(self, batches):
+        '''Drop the first ``resume_from`` records from batches
+
+        Arguments:
+            batches: an iterable of lists of data
+
+        Yields:
+            The remaining lists of data
+        '''
+        skip = self.resume_from
+        for batch in batches:
+            if skip and skip >= len(batch):
+                skip -= len(batch)
+                continue
+            yield batch[skip:] if skip else batch
+            skip = 0
+
+    def save_checkpoint(self, committed):
+        '''Report the number of committed input records, if a
+        ``checkpoint`` callback is set
+        '''
+        if self.checkpoint:
+            self.checkpoint(committed)
+
 class CKANLoader(Loader):
-    """Connection to ckan datastore"""
+    """Connection to ckan datastore
+
+    All API calls go through a pooled :py:class:`requests.Session`,
+    see :py:func:`~pipeline.loaders.get_session`. A session can also
+    be passed in directly with the ``session`` keyword argument;
+    ``pool_size`` and ``keep_alive`` configure the shared one.
+
+    If a ``metadata_cache`` path is passed, resource ids and datastore
+    field fingerprints are cached there for ``metadata_ttl`` seconds
+    (default 3600), see :py:class:`~pipeline.cache.MetadataCache`.
+    """
 
     def __init__(self, *args, **kwargs):
         super(CKANLoader, self).__init__(*args, **kwargs)
         self.ckan_url = kwargs.get('ckan_root_url').rstrip('/') + '/api/3/'
         self.dump_url = kwargs.get('ckan_root_url').rstrip('/') + '/datastore/dump/'
         self.key = kwargs.get('ckan_api_key')
+        self.timeout = kwargs.get('timeout', None)
+        self.session = kwargs.get('session', None) or get_session(
+            kwargs.get('ckan_root_url'), self.key,
+            pool_size=kwargs.get('pool_size', max(10, kwargs.get('concurrency', 1))),
+            keep_alive=kwargs.get('keep_alive', True)
+        )
         self.package_id = kwargs.get('package_id')
         self.resource_name = kwargs.get('resource_name')
-        self.resource_id = self.get_resource_id(self.package_id, self.resource_name)
+        self.metadata_cache = MetadataCache(
+            kwargs['metadata_cache'], kwargs.get('metadata_ttl', 3600)
+        ) if kwargs.get('metadata_cache') else None
+        self.fields_fingerprint = None
+        self.resource_id = self.lookup_resource_id()
+
+    def post(self, action, payload):
+        """POST a payload to a CKAN API action using the loader's session
+
+        Params:
+            action: name of the CKAN action, e.g. ``package_show``
+            payload: JSON-serializable request body
+
+        Returns:
+            The :py:class:`requests.Response`
+        """
+        return self.session.post(
+            self.ckan_url + 'action/' + action,
+            data=json.dumps(payload),
+            timeout=self.timeout
+        )
 
     def get_resource_id(self, package_id, resource_name):
         """Search for resource within CKAN dataset and returns its id
@@ -39,20 +179,44 @@ class CKANLoader(Loader):
             The resource id if the resource is found within the package,
             ``None`` otherwise
         """
-        response = requests.post(
-            self.ckan_url + 'action/package_show',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'id': package_id
-            })
-        )
+        response = self.post('package_show', {
+            'id': package_id
+        })
         # todo: handle bad request
         response_json = response.json()
         return next((i['id'] for i in response_json['result']['resources'] if resource_name in i['name']), None)
 
+    def lookup_resource_id(self):
+        """Get the configured resource's id, using the metadata cache if possible
+
+        Sets ``fields_fingerprint`` from the cache as a side effect.
+
+        Returns:
+            The resource id if the resource is found, ``None`` otherwise
+        """
+        if self.metadata_cache:
+            cached = self.metadata_cache.get(self.ckan_url, self.package_id, self.resource_name)
+            if cached:
+                resource_id, self.fields_fingerprint = cached
+                return resource_id
+
+        resource_id = self.get_resource_id(self.package_id, self.resource_name)
+        if self.metadata_cache and resource_id is not None:
+            self.metadata_cache.set(self.ckan_url, self.package_id, self.resource_name, resource_id)
+        return resource_id
+
+    def refresh_resource_id(self):
+        """Invalidate cached metadata and look the resource up again
+
+        Returns:
+            The resource id if the resource is found, ``None`` otherwise
+        """
+        if self.metadata_cache:
+            self.metadata_cache.invalidate(self.ckan_url, self.package_id, self.resource_name)
+        self.fields_fingerprint = None
+        self.resource_id = self.lookup_resource_id()
+        return self.resource_id
+
     def resource_exists(self, package_id, resource_name):
         """Search for resource the existence of a resource on ckan instance
 
@@ -80,20 +244,13 @@ class CKANLoader(Loader):
         '''
 
         # Make api call
-        response = requests.post(
-            self.ckan_url + 'action/resource_create',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'package_id': package_id,
-                'url': '#',
-                'name': resource_name,
-                'url_type': 'datapusher',
-                'format': 'CSV'
-            })
-        )
+        response = self.post('resource_create', {
+            'package_id': package_id,
+            'url': '#',
+            'name': resource_name,
+            'url_type': 'datapusher',
+            'format': 'CSV'
+        })
 
         response_json = response.json()
 
@@ -117,19 +274,12 @@ class CKANLoader(Loader):
         """
 
         # Make API call
-        create_datastore = requests.post(
-            self.ckan_url + 'action/datastore_create',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'resource_id': resource_id,
-                'force': True,
-                'fields': fields,
-                'primary_key': self.key_fields if hasattr(self, 'key_fields') else None
-            })
-        )
+        create_datastore = self.post('datastore_create', {
+            'resource_id': resource_id,
+            'force': True,
+            'fields': fields,
+            'primary_key': self.key_fields if hasattr(self, 'key_fields') else None
+        })
 
         create_datastore = create_datastore.json()
 
@@ -139,9 +289,31 @@ class CKANLoader(Loader):
         return create_datastore['result']['resource_id']
 
     def generate_datastore(self, fields):
+        """Create the resource and its datastore if they don't exist yet
+
+        If the metadata cache has a fingerprint for the datastore's
+        fields that doesn't match ``fields``, the datastore is
+        created again so that new fields are added.
+
+        Params:
+            fields: header fields for csv file
+
+        Returns:
+            resource_id of the datastore
+        """
+        fingerprint = MetadataCache.fingerprint(fields, getattr(self, 'key_fields', None))
         if self.resource_id is None:
             self.resource_id = self.create_resource(self.package_id, self.resource_name)
             self.create_datastore(self.resource_id, fields)
+        elif self.fields_fingerprint not in (None, fingerprint):
+            self.create_datastore(self.resource_id, fields)
+
+        if self.metadata_cache and self.fields_fingerprint != fingerprint:
+            self.metadata_cache.set(
+                self.ckan_url, self.package_id, self.resource_name,
+                self.resource_id, fingerprint
+            )
+        self.fields_fingerprint = fingerprint
 
         return self.resource_id
 
@@ -154,17 +326,10 @@ class CKANLoader(Loader):
         Returns:
             Status code from the request
         """
-        delete = requests.post(
-            self.ckan_url + 'action/datastore_delete',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'resource_id': resource_id,
-                'force': True
-            })
-        )
+        delete = self.post('datastore_delete', {
+            'resource_id': resource_id,
+            'force': True
+        })
         return delete.status_code
 
     def upsert(self, resource_id, data, method='upsert'):
@@ -177,19 +342,12 @@ class CKANLoader(Loader):
         Returns:
             request status
         """
-        upsert = requests.post(
-            self.ckan_url + 'action/datastore_upsert',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'resource_id': resource_id,
-                'method': method,
-                'force': True,
-                'records': data
-            })
-        )
+        upsert = self.post('datastore_upsert', {
+            'resource_id': resource_id,
+            'method': method,
+            'force': True,
+            'records': data
+        })
         return upsert.status_code
 
     def update_metadata(self, resource_id):
@@ -203,19 +361,12 @@ class CKANLoader(Loader):
         Returns:
             request status
         """
-        update = requests.post(
-            self.ckan_url + 'action/resource_patch',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
-                'id': resource_id,
-                'url': self.dump_url + str(resource_id),
-                'url_type': 'datapusher',
-                'last_modified': datetime.datetime.now().isoformat(),
-            })
-        )
+        update = self.post('resource_patch', {
+            'id': resource_id,
+            'url': self.dump_url + str(resource_id),
+            'url_type': 'datapusher',
+            'last_modified': datetime.datetime.now().isoformat(),
+        })
         return update.status_code
 
 class CKANDatastoreLoader(CKANLoader):
@@ -236,21 +387,56 @@ class CKANDatastoreLoader(CKANLoader):
             method: Must be one of ``upsert`` or ``insert``.
                 Defaults to ``upsert``. See
                 :~pipeline.loaders.CKANLoader.upsert:
+            chunk_size: Maximum number of records to send in a
+                single ``datastore_upsert`` request. Defaults to
+                ``None``, which sends each batch in one request.
+            chunk_bytes: Maximum size, in bytes of serialized JSON,
+                of the records sent in a single request. Can be
+                combined with ``chunk_size``; whichever limit is hit
+                first closes the chunk.
+            chunk_retries: Number of times to retry a chunk that
+                fails with a server error or a dropped connection.
+                Defaults to 0.
+            retry_backoff: Seconds to wait before the first retry,
+                doubled on each subsequent attempt. Defaults to 1.
+            concurrency: Number of upsert requests to keep in flight
+                at once. Rows are partitioned by a hash of their
+                ``key_fields`` so that the same primary key is never
+                part of two concurrent requests. Defaults to 1.
+            row_hashes: location of a sqlite database to keep a hash
+                of every loaded row in, keyed by ``key_fields``. If
+                set, only rows that are new or have changed since
+                they were last loaded are upserted. Rows are never
+                deleted by an upsert, so rows removed from the input
+                are not tracked. If the datastore is changed outside
+                of the pipeline, remove the database to load every
+                row again.
 
         Raises:
             RuntimeError if fields is not specified or method is
-            ``upsert`` and no ``key_fields`` are passed.
+            ``upsert`` and no ``key_fields`` are passed, or if
+            ``row_hashes`` is set and no ``key_fields`` are passed.
         '''
         super(CKANDatastoreLoader, self).__init__(*args, **kwargs)
         self.fields = kwargs.get('fields', None)
         self.key_fields = kwargs.get('key_fields', None)
         self.method = kwargs.get('method', 'upsert')
         self.header_fix = kwargs.get('header_fix', None)
+        self.chunk_size = kwargs.get('chunk_size', None)
+        self.chunk_bytes = kwargs.get('chunk_bytes', None)
+        self.chunk_retries = kwargs.get('chunk_retries', 0)
+        self.retry_backoff = kwargs.get('retry_backoff', 1)
+        self.concurrency = kwargs.get('concurrency', 1)
+        self._refresh_lock = threading.Lock()
+        self.row_hashes = RowHashStore(kwargs['row_hashes']) if kwargs.get('row_hashes') else None
+        self.skipped_rows = 0
 
         if self.fields is None:
             raise RuntimeError('Fields must be specified.')
         if self.method == 'upsert' and self.key_fields is None:
             raise RuntimeError('Upsert method requires primary key(s).')
+        if self.row_hashes and self.key_fields is None:
+            raise RuntimeError('Row hashes require primary key(s).')
 
     def load(self, data):
         '''Load data to CKAN using an upsert strategy
@@ -267,13 +453,264 @@ class CKANDatastoreLoader(CKANLoader):
             A two-tuple of the status codes for the upsert
             and metadata update calls
         '''
+        return self.load_batches([data])
+
+    def chunk_records(self, records):
+        '''Split records into chunks bounded by ``chunk_size`` and ``chunk_bytes``
+
+        Arguments:
+            records: an iterable of records
+
+        Yields:
+            Lists of records small enough to be sent in a
+            single upsert request. A single record larger than
+            ``chunk_bytes`` is sent on its own. If neither limit is
+            set, all records are yielded as one chunk.
+        '''
+        if self.chunk_size is None and self.chunk_bytes is None:
+            yield list(records)
+            return
+
+        chunk, chunk_bytes = [], 0
+        for record in records:
+            # account for the separator between records in the payload
+            size = len(json.dumps(record)) + 2 if self.chunk_bytes else 0
+            if chunk and (
+                (self.chunk_size and len(chunk) >= self.chunk_size) or
+                (self.chunk_bytes and chunk_bytes + size > self.chunk_bytes)
+            ):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(record)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def upsert_chunk(self, chunk):
+        '''Upsert a single chunk, retrying server errors
+
+        Arguments:
+            chunk: a list of records
+
+        If the metadata cache is in use and CKAN responds with a 404,
+        the cached resource id is assumed to be stale: it is looked up
+        again and the chunk is retried once.
+
+        Returns:
+            Status code of the final upsert attempt
+        '''
+        attempt, refreshed = 0, False
+        while True:
+            resource_id = self.resource_id
+            try:
+                status = self.upsert(resource_id, chunk, self.method)
+            except requests.exceptions.RequestException:
+                if attempt >= self.chunk_retries:
+                    raise
+            else:
+                if status == 404 and self.metadata_cache and not refreshed:
+                    with self._refresh_lock:
+                        # another thread may have refreshed it already
+                        if self.resource_id == resource_id:
+                            self.refresh_resource_id()
+                            self.generate_datastore(self.fields)
+                    refreshed = True
+                    continue
+                if str(status)[0] != '5' or attempt >= self.chunk_retries:
+                    return status
+            time.sleep(self.retry_backoff * (2 ** attempt))
+            attempt += 1
+
+    def check_upsert_status(self, status, description):
+        '''Raise if an upsert status code is a client or server error
+
+        Arguments:
+            status: status code returned by the upsert
+            description: which records were being upserted, used
+                in the error message
+
+        Raises:
+            RuntimeError if the status code is a 4xx or 5xx
+        '''
+        if str(status)[0] in ['4', '5']:
+            raise RuntimeError('Upsert failed with status code {} ({}).'.format(
+                str(status), description
+            ))
+
+    def partition_records(self, records):
+        '''Partition records by a hash of their key fields
+
+        Arguments:
+            records: a list of records
+
+        Returns:
+            A list of ``concurrency`` lists of records. Records
+            that share a primary key always end up in the same
+            partition, in their original order. Without
+            ``key_fields``, records are dealt out round-robin.
+        '''
+        partitions = [[] for _ in range(self.concurrency)]
+        for index, record in enumerate(records):
+            if self.key_fields:
+                index = hash(tuple(record.get(k) for k in self.key_fields))
+            partitions[index % self.concurrency].append(record)
+        return partitions
+
+    def upsert_partition(self, records):
+        '''Upsert one partition of records chunk by chunk
+
+        Arguments:
+            records: a list of records from
+                :py:meth:`~pipeline.loaders.CKANDatastoreLoader.partition_records`
+
+        Returns:
+            Status code of the last upsert
+        '''
+        status = None
+        for chunk in self.chunk_records(records):
+            status = self.upsert_chunk(chunk)
+            self.check_upsert_status(status, 'partition of {} records'.format(len(records)))
+        return status
+
+    def windows(self, batches):
+        '''Regroup batches into windows to be upserted concurrently
+
+        When ``chunk_size`` is set, each window holds enough records
+        for one chunk per concurrent request; otherwise each
+        incoming batch is its own window.
+
+        Arguments:
+            batches: an iterable of lists of records
+
+        Yields:
+            Lists of records
+        '''
+        if self.chunk_size is None:
+            for batch in batches:
+                yield batch
+            return
+
+        records = itertools.chain.from_iterable(batches)
+        size = self.chunk_size * self.concurrency
+        while True:
+            window = list(itertools.islice(records, size))
+            if not window:
+                return
+            yield window
+
+    def filter_changed(self, records):
+        '''Filter records down to the ones that are new or changed
+
+        Arguments:
+            records: a list of records
+
+        Returns:
+            The records whose hashes don't match the ones saved in
+            ``row_hashes``, or all of them if ``row_hashes`` isn't
+            set. The number of records that were left out is added
+            to ``skipped_rows``.
+        '''
+        if not self.row_hashes:
+            return records
+        changed = self.row_hashes.changed(
+            self.ckan_url, self.resource_id, records, self.key_fields,
+            MetadataCache.fingerprint(self.fields, self.key_fields)
+        )
+        self.skipped_rows += len(records) - len(changed)
+        return changed
+
+    def commit_records(self, committed):
+        '''Mark input records as committed to CKAN
+
+        Saves the staged row hashes and reports the checkpoint.
+
+        Arguments:
+            committed: number of input records committed so far
+        '''
+        if self.row_hashes:
+            self.row_hashes.commit()
+        self.save_checkpoint(committed)
+
+    def load_batches(self, batches):
+        '''Load batches of data to CKAN using an upsert strategy
+
+        The datastore is generated and the resource metadata is
+        updated once. Each batch is split up by
+        :py:meth:`~pipeline.loaders.CKANDatastoreLoader.chunk_records`
+        and sent with one upsert call per chunk, so a failed request
+        only needs that chunk to be retried.
+
+        If ``concurrency`` is greater than 1, records are grouped
+        into windows which are partitioned by primary key, and
+        the partitions are upserted in parallel. Each window is
+        fully committed before the next is started, so a primary
+        key is never in two requests in flight at the same time.
+
+        If ``row_hashes`` is set, unchanged rows are left out of each
+        chunk or window, see
+        :py:meth:`~pipeline.loaders.CKANDatastoreLoader.filter_changed`.
+
+        After each chunk (or window, if ``concurrency`` is greater
+        than 1) is committed, the hashes of its rows are saved and
+        the number of input records committed so far is reported to
+        the ``checkpoint`` callback. The first ``resume_from`` input
+        records are skipped.
+
+        Arguments:
+            batches: an iterable of lists of data to be inserted
+                or upserted to the configured CKAN instance
+
+        Raises:
+            RuntimeError if any upsert or the update metadata
+                calls are unsuccessful
+
+        Returns:
+            A two-tuple of the status codes for the last upsert
+            and metadata update calls
+        '''
         self.generate_datastore(self.fields)
-        upsert_status = self.upsert(self.resource_id, data, self.method)
-        update_status = self.update_metadata(self.resource_id)
+        upsert_status, offset = None, self.resume_from
+        batches = self.skip_committed(batches)
+
+        try:
+            if self.concurrency > 1:
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    for window in self.windows(batches):
+                        futures = [
+                            executor.submit(self.upsert_partition, partition)
+                            for partition in self.partition_records(
+                                self.filter_changed(window)
+                            ) if partition
+                        ]
+                        for future in futures:
+                            upsert_status = future.result() or upsert_status
+                        offset += len(window)
+                        self.commit_records(offset)
+            else:
+                for batch in batches:
+                    for chunk in self.chunk_records(batch):
+                        records = self.filter_changed(chunk)
+                        if records or not chunk:
+                            upsert_status = self.upsert_chunk(records)
+                            self.check_upsert_status(upsert_status, 'records {} to {}'.format(
+                                offset, offset + len(chunk) - 1
+                            ))
+                        offset += len(chunk)
+                        self.commit_records(offset)
+        except Exception:
+            if self.row_hashes:
+                self.row_hashes.rollback()
+            raise
+        finally:
+            # long-lived processes run many loads; don't hold on to
+            # the connection between them
+            if self.row_hashes:
+                self.row_hashes.close()
 
-        if str(upsert_status)[0] in ['4', '5']:
-            raise RuntimeError('Upsert failed with status code {}.'.format(str(upsert_status)))
-        elif str(update_status)[0] in ['4', '5']:
-            raise RuntimeError('Metadata update failed with status code {}'.format(str(upsert_status)))
+        update_status = self.update_metadata(self.resource_id)
+        if update_status == 404 and self.metadata_cache:
+            self.metadata_cache.invalidate(self.ckan_url, self.package_id, self.resource_name)
+        if str(update_status)[0] in ['4', '5']:
+            raise RuntimeError('Metadata update failed with status code {}'.format(str(update_status)))
         else:
-            return upsert_status, update_status
\ No newline at end of file
+            return upsert_status, update_status
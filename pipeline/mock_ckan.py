@@ -0,0 +1,320 @@
+import json
+import time
+import uuid
+import random
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Throttle(object):
+    '''Caps the rate at which a shared resource is used
+
+    Callers reserve an amount of the resource and are told how long
+    to wait so that, across all threads, no more than ``rate`` units
+    are used per second.
+
+    Arguments:
+        rate: units per second, or ``None`` for no cap
+    '''
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._available = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        '''Reserve ``amount`` units
+
+        Returns:
+            Number of seconds to wait before the units are available
+        '''
+        if not self.rate or amount <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._available)
+            self._available = start + amount / self.rate
+            return self._available - now
+
+
+class MockCKAN(object):
+    '''In-memory stand-in for the CKAN action API
+
+    Implements the actions the loaders use: ``package_show``,
+    ``resource_create``, ``datastore_create``, ``datastore_upsert``,
+    ``resource_patch`` and ``datastore_delete``. Upserts honor the
+    datastore's primary key, so repeated loads replace rows rather
+    than adding them.
+
+    Keyword Arguments:
+        latency: seconds added to every request. Defaults to 0.
+        jitter: up to this many seconds are added to the latency at
+            random. Defaults to 0.
+        bytes_per_second: cap on the request bodies read per second,
+            shared by all requests. Defaults to no cap.
+        records_per_second: cap on the records upserted per second,
+            shared by all requests. Defaults to no cap.
+        max_payload: largest request body, in bytes, accepted before
+            responding with a 413. Defaults to no limit.
+        error_rate: fraction of requests answered with a 500 at
+            random. Defaults to 0.
+        error_actions: actions that ``error_rate`` applies to.
+            Defaults to ``datastore_upsert``.
+        auto_create_packages: boolean for whether or not unknown
+            packages are created by ``package_show`` instead of
+            returning a 404. Defaults to True.
+        seed: seed for the random latency and errors, so that runs
+            are reproducible
+
+    Attributes:
+        packages: package id -> list of resource dictionaries
+        datastores: resource id -> dictionary of ``fields``,
+            ``primary_key`` and ``records``
+        stats: counts of ``requests`` and ``errors`` by action, and
+            totals of ``bytes`` received and ``records`` upserted
+    '''
+    ACTIONS = (
+        'package_show', 'resource_create', 'datastore_create',
+        'datastore_upsert', 'resource_patch', 'datastore_delete'
+    )
+
+    def __init__(self, **kwargs):
+        self.latency = kwargs.get('latency', 0)
+        self.jitter = kwargs.get('jitter', 0)
+        self.bytes_throttle = Throttle(kwargs.get('bytes_per_second', None))
+        self.records_throttle = Throttle(kwargs.get('records_per_second', None))
+        self.max_payload = kwargs.get('max_payload', None)
+        self.error_rate = kwargs.get('error_rate', 0)
+        self.error_actions = kwargs.get('error_actions', ['datastore_upsert'])
+        self.auto_create_packages = kwargs.get('auto_create_packages', True)
+        self.random = random.Random(kwargs.get('seed', None))
+        self.packages, self.datastores = {}, {}
+        self.stats = {'requests': {}, 'errors': {}, 'bytes': 0, 'records': 0}
+        self._failures = {}
+        self._lock = threading.RLock()
+
+    def fail_next(self, action, status=500, count=1):
+        '''Answer the next ``count`` calls to ``action`` with an error
+
+        Arguments:
+            action: name of the action, e.g. ``datastore_upsert``
+
+        Keyword Arguments:
+            status: status code to respond with. Defaults to 500.
+            count: number of calls to fail. Defaults to 1.
+        '''
+        with self._lock:
+            self._failures.setdefault(action, []).extend([status] * count)
+
+    def records(self, resource_id):
+        '''Get the records stored in a resource's datastore, in load order
+        '''
+        with self._lock:
+            return list(self.datastores[resource_id]['records'].values())
+
+    def handle(self, action, body):
+        '''Respond to a request for an action
+
+        Arguments:
+            action: name of the action
+            body: raw request body
+
+        Returns:
+            A two-tuple of the status code and the response dictionary
+        '''
+        with self._lock:
+            self.stats['requests'][action] = self.stats['requests'].get(action, 0) + 1
+            self.stats['bytes'] += len(body)
+            failures = self._failures.get(action)
+            status = failures.pop(0) if failures else None
+            if status is None and action in self.error_actions and \
+                    self.random.random() < self.error_rate:
+                status = 500
+            delay = self.latency + self.random.uniform(0, self.jitter)
+
+        time.sleep(delay + self.bytes_throttle.reserve(len(body)))
+
+        if status is None and self.max_payload is not None and len(body) > self.max_payload:
+            status = 413
+        if status is not None:
+            return self.error(action, status, 'Injected error')
+
+        if action not in self.ACTIONS:
+            return self.error(action, 400, 'Unknown action: {}'.format(action))
+        try:
+            payload = json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            return self.error(action, 400, 'Request body is not valid JSON')
+
+        try:
+            return 200, {'success': True, 'result': getattr(self, action)(payload)}
+        except KeyError as e:
+            return self.error(action, 404, 'Not found: {}'.format(e))
+        except ValueError as e:
+            return self.error(action, 409, str(e))
+
+    def error(self, action, status, message):
+        '''Build an error response shaped like CKAN's
+
+        CKAN reports validation errors (409s) as lists of messages
+        keyed by the field they are about, and other errors with a
+        single ``message``. The mock has no fields to blame, so
+        validation errors are reported under ``name``.
+        '''
+        with self._lock:
+            self.stats['errors'][action] = self.stats['errors'].get(action, 0) + 1
+        if status == 409:
+            error = {'__type': 'Validation Error', 'name': [message]}
+        else:
+            error_type = {404: 'Not Found Error', 403: 'Authorization Error'}.get(status, 'Error')
+            error = {'__type': error_type, 'message': message}
+        return status, {'success': False, 'error': error}
+
+    def package_show(self, payload):
+        with self._lock:
+            package_id = payload['id']
+            if package_id not in self.packages:
+                if not self.auto_create_packages:
+                    raise KeyError(package_id)
+                self.packages[package_id] = []
+            return {'id': package_id, 'name': package_id, 'resources': list(self.packages[package_id])}
+
+    def resource_create(self, payload):
+        with self._lock:
+            resource = dict(payload, id=str(uuid.uuid4()))
+            self.packages.setdefault(payload['package_id'], []).append(resource)
+            return resource
+
+    def find_resource(self, resource_id):
+        for resources in self.packages.values():
+            for resource in resources:
+                if resource['id'] == resource_id:
+                    return resource
+        raise KeyError(resource_id)
+
+    def datastore_create(self, payload):
+        with self._lock:
+            resource_id = payload['resource_id']
+            self.find_resource(resource_id)
+            primary_key = payload.get('primary_key') or []
+            if isinstance(primary_key, str):
+                primary_key = [primary_key]
+            existing = self.datastores.get(resource_id, {}).get('records', {})
+            self.datastores[resource_id] = {
+                'fields': payload.get('fields', []),
+                'primary_key': primary_key, 'records': existing
+            }
+            return {'resource_id': resource_id, 'fields': payload.get('fields', [])}
+
+    def datastore_upsert(self, payload):
+        records = payload.get('records', [])
+        time.sleep(self.records_throttle.reserve(len(records)))
+        with self._lock:
+            datastore = self.datastores[payload['resource_id']]
+            method, primary_key = payload.get('method', 'upsert'), datastore['primary_key']
+            if method != 'insert' and not primary_key:
+                raise ValueError('The datastore has no primary key to {} on'.format(method))
+            stored = datastore['records']
+            for record in records:
+                if primary_key:
+                    key = json.dumps([record.get(k) for k in primary_key], default=str)
+                    if method == 'insert' and key in stored:
+                        raise ValueError('Duplicate key: {}'.format(key))
+                else:
+                    key = len(stored)
+                stored[key] = record
+            self.stats['records'] += len(records)
+            return {'resource_id': payload['resource_id'], 'method': method}
+
+    def resource_patch(self, payload):
+        with self._lock:
+            resource = self.find_resource(payload['id'])
+            resource.update(payload)
+            return resource
+
+    def datastore_delete(self, payload):
+        with self._lock:
+            del self.datastores[payload['resource_id']]
+            return {'resource_id': payload['resource_id']}
+
+
+class MockCKANHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; without this, kept
+    # alive connections stall on delayed acks
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        prefix = '/api/3/action/'
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.startswith(prefix):
+            status, response = self.server.ckan.handle(self.path[len(prefix):].split('?')[0], body)
+        else:
+            status, response = 404, {'success': False, 'error': {'message': 'Not found'}}
+        data = json.dumps(response, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(MockCKANHandler, self).log_message(format, *args)
+
+
+class MockCKANServer(object):
+    '''Serve a :py:class:`~pipeline.mock_ckan.MockCKAN` over HTTP
+
+    Each request is handled in its own thread, so concurrent loaders
+    see the configured latency in parallel, as they would against
+    a real CKAN instance. Can be used as a context manager, which
+    starts the server in a background thread and stops it on exit.
+
+    Keyword Arguments:
+        ckan: the :py:class:`~pipeline.mock_ckan.MockCKAN` to serve.
+            Defaults to one with no latency or errors.
+        host: interface to listen on. Defaults to ``127.0.0.1``.
+        port: port to listen on. Defaults to 0, which picks a free
+            port.
+        verbose: boolean for whether or not to log each request
+
+    Attributes:
+        url: root url of the server, to use as a loader's
+            ``ckan_root_url``
+    '''
+    def __init__(self, ckan=None, host='127.0.0.1', port=0, verbose=False):
+        self.ckan = ckan or MockCKAN()
+        self.httpd = ThreadingHTTPServer((host, port), MockCKANHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.ckan = self.ckan
+        self.httpd.verbose = verbose
+        self.url = 'http://{}:{}/'.format(*self.httpd.server_address[:2])
+        self._thread = None
+
+    def start(self):
+        '''Start serving in a background thread
+        '''
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        '''Stop serving and close the listening socket
+        '''
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
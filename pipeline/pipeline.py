@@ -3,15 +3,81 @@ import json
 import sqlite3
 import time
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from pipeline.exceptions import (
     IsHeaderException, InvalidConfigException, DuplicateFileException, MissingStatusDatabaseError
 )
-from pipeline.status import Status
+from pipeline.status import (
+    Status, upgrade_status_table, get_validators, save_validators,
+    save_checkpoint, get_checkpoint, has_checkpoints, clear_checkpoints
+)
 from pipeline.exceptions import InvalidConfigException
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PARENT = os.path.join(HERE, '..')
 
+# schema instances used by validation worker processes, keyed by
+# schema class and whether it is compiled
+_worker_schemas = {}
+
+
+def worker_schema(schema, compiled=False):
+    '''Get a pipeline's schema in a validation worker process,
+    instantiating it the first time the process needs it
+    '''
+    key = (schema, compiled)
+    if key not in _worker_schemas:
+        instance = schema()
+        _worker_schemas[key] = instance.compile() if compiled else instance
+    return _worker_schemas[key]
+
+
+def validate_batch(schema, compiled, lines):
+    '''Validate and serialize a batch of lines in a worker process
+
+    Arguments:
+        schema: the pipeline's schema class
+        compiled: boolean for whether or not to compile the schema
+        lines: the batch of lines
+
+    Returns:
+        A two-tuple of the serialized lines and the schema's errors
+    '''
+    instance = worker_schema(schema, compiled)
+    loaded = instance.load(lines, many=True)
+    if loaded.errors:
+        return None, loaded.errors
+    return instance.dump(loaded.data, many=True).data, {}
+
+
+def check_batch_errors(errors, lines, offset=0):
+    '''Raise an error for a batch of lines that failed validation
+
+    Arguments:
+        errors: errors returned from a schema's ``load`` with
+            ``many=True``, keyed by index in the batch
+        lines: the batch of lines
+        offset: index of the batch's first line in the input
+
+    Raises:
+        RuntimeError: if there are any errors, listing them by
+            their index in the input
+    '''
+    if not errors:
+        return
+    errors = {
+        (offset + index if isinstance(index, int) else index): error
+        for index, error in errors.items()
+    }
+    raise RuntimeError('There were errors in the input data: {} (passed data: {})'.format(
+        errors.__str__(), {
+            index: lines[index - offset] for index in errors
+            if isinstance(index, int)
+        }
+    ))
+
 
 class Pipeline(object):
     '''Main pipeline class
@@ -24,7 +90,9 @@ class Pipeline(object):
 
     def __init__(
             self, name, display_name, settings_file=None,
-            settings_from_file=True, log_status=False, conn=None, conn_name=None
+            settings_from_file=True, log_status=False, conn=None, conn_name=None,
+            streaming=False, batch_size=5000, validation_batch_size=None,
+            validation_workers=1
     ):
         '''
         Arguments:
@@ -40,8 +108,31 @@ class Pipeline(object):
             conn: optionally passed sqlite3 connection object. if no
                 connection is passed, one will be instantiated when the
                 pipeline's ``run`` method is called
+            streaming: boolean for whether or not to stream rows from
+                the extractor through the schema into the loader in
+                batches instead of accumulating them in ``data`` first.
+                keeps memory bounded by ``batch_size`` for large inputs
+            batch_size: number of rows handed to the loader at a time
+                when ``streaming`` is set. Defaults to 5000.
+            validation_batch_size: if set, rows are validated and
+                serialized this many at a time with the schema's
+                ``load`` and ``dump`` methods called with
+                ``many=True``, instead of once per row. Errors are
+                reported with the index of the failing rows.
+            validation_workers: number of processes used to validate
+                rows. If greater than 1, batches of
+                ``validation_batch_size`` rows (or ``batch_size`` if
+                that isn't set) are validated in a process pool and
+                returned in input order. The schema class must be
+                importable by the worker processes. Defaults to 1.
         '''
         self.data = []
+        self.num_lines = 0
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.validation_batch_size = validation_batch_size
+        self.validation_workers = validation_workers
+        self.compiled_schema = False
         self._connector, self._extractor, self._schema, self._loader = \
             None, None, None, None
         self.name = name
@@ -135,16 +226,23 @@ class Pipeline(object):
         self.extractor_kwargs = dict(**kwargs)
         return self
 
-    def schema(self, schema):
+    def schema(self, schema, compiled=False):
         '''Set the schema class
 
         Arguments:
             schema: Schema class
 
+        Keyword Arguments:
+            compiled: boolean for whether or not to validate rows with
+                the schema's compiled row converter, see
+                :py:meth:`~pipeline.schema.BaseSchema.compile`.
+                Defaults to False.
+
         Returns:
             modified Pipeline object
         '''
         self._schema = schema
+        self.compiled_schema = compiled
         return self
 
     def load(self, loader, config_string=None, *args, **kwargs):
@@ -162,20 +260,169 @@ class Pipeline(object):
         self.loader_kwargs = {**kwargs, **loader_config}
         return self
 
-    def load_line(self, data):
-        '''Load a line into the pipeline's data or throw an error
+    def convert_line(self, data):
+        '''Validate a line against the schema and return its dumped form
 
         Arguments:
             data: A parsed line from an extractor's handle_line
                 method
+
+        Returns:
+            The line as serialized by the pipeline's schema
+
+        Raises:
+            RuntimeError: if the schema reports errors for the line
         '''
         loaded = self.__schema.load(data)
         if loaded.errors:
             raise RuntimeError('There were errors in the input data: {} (passed data: {})'.format(
                 loaded.errors.__str__(), data
             ))
+        self.num_lines += 1
+        return self.__schema.dump(loaded.data).data
+
+    def convert_lines(self, lines, offset=0):
+        '''Validate a batch of lines against the schema and return their
+        dumped forms
+
+        Arguments:
+            lines: A list of parsed lines from an extractor's
+                handle_line method
+
+        Keyword Arguments:
+            offset: index of the batch's first line in the input,
+                used when reporting errors
+
+        Returns:
+            A list of the lines as serialized by the pipeline's schema
+
+        Raises:
+            RuntimeError: if the schema reports errors for any of the
+                lines
+        '''
+        loaded = self.__schema.load(lines, many=True)
+        check_batch_errors(loaded.errors, lines, offset)
+        self.num_lines += len(lines)
+        return self.__schema.dump(loaded.data, many=True).data
+
+    def convert_parallel(self, batches):
+        '''Validate batches of lines in ``validation_workers`` processes
+
+        The schema class is sent along with each batch, and each
+        worker process instantiates it the first time it is used.
+        At most two batches per worker are in flight at a time, so
+        memory stays bounded when streaming.
+
+        Arguments:
+            batches: iterable of lists of parsed lines
+
+        Yields:
+            Each line as serialized by the pipeline's schema, in
+            input order
+
+        Raises:
+            RuntimeError: if the schema reports errors for any of the
+                lines
+        '''
+        # the schema class is sent with each batch, rather than to a
+        # pool initializer, which needs Python 3.7
+        with ProcessPoolExecutor(max_workers=self.validation_workers) as executor:
+            pending, offset = deque(), 0
+            for batch in batches:
+                future = executor.submit(validate_batch, self._schema, self.compiled_schema, batch)
+                pending.append((offset, batch, future))
+                offset += len(batch)
+                while len(pending) > self.validation_workers * 2:
+                    yield from self.collect_batch(*pending.popleft())
+            while pending:
+                yield from self.collect_batch(*pending.popleft())
+
+    def collect_batch(self, offset, lines, future):
+        '''Wait for a batch submitted by ``convert_parallel``
+        '''
+        dumped, errors = future.result()
+        check_batch_errors(errors, lines, offset)
+        self.num_lines += len(lines)
+        return dumped
+
+    def load_line(self, data):
+        '''Load a line into the pipeline's data or throw an error
+
+        Arguments:
+            data: A parsed line from an extractor's handle_line
+                method
+        '''
+        self.data.append(self.convert_line(data))
+
+    def stream_lines(self, extractor, raw):
+        '''Generator of validated lines
+
+        Arguments:
+            extractor: instantiated extractor
+            raw: iterable returned from the extractor's
+                ``process_connection`` method
+
+        Yields:
+            Each line as serialized by the pipeline's schema
+        '''
+        lines = self.extract_lines(extractor, raw)
+        if self.validation_workers > 1:
+            yield from self.convert_parallel(
+                self.batch_lines(lines, self.validation_batch_size)
+            )
+        elif self.validation_batch_size:
+            offset = 0
+            for batch in self.batch_lines(lines, self.validation_batch_size):
+                yield from self.convert_lines(batch, offset)
+                offset += len(batch)
         else:
-            self.data.append(self.__schema.dump(loaded.data).data)
+            for data in lines:
+                yield self.convert_line(data)
+
+    def extract_lines(self, extractor, raw):
+        '''Generator of parsed lines, skipping headers
+
+        Arguments:
+            extractor: instantiated extractor
+            raw: iterable returned from the extractor's
+                ``process_connection`` method
+
+        Yields:
+            The result of the extractor's ``handle_line`` method for
+            each line, or the extractor's compact rows if it has
+            ``compact_rows`` set
+        '''
+        if getattr(extractor, 'compact_rows', False):
+            yield from extractor.extract_rows(raw)
+            return
+        for line in raw:
+            try:
+                yield extractor.handle_line(line)
+            except IsHeaderException:
+                continue
+
+    def batch_lines(self, lines, size=None):
+        '''Group an iterable of lines into lists of ``batch_size``
+
+        Arguments:
+            lines: iterable of serialized lines
+
+        Keyword Arguments:
+            size: number of lines per list, if different from
+                ``batch_size``
+
+        Yields:
+            Lists of at most ``size`` lines
+        '''
+        size = size or self.batch_size
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def enforce_full_pipeline(self):
         '''Ensure that a pipeline has an extractor, schema, and loader
@@ -193,28 +440,72 @@ class Pipeline(object):
             )
 
     def get_last_run_checksum(self):
+        '''Get the input checksum of the last run and its algorithm
+
+        Returns:
+            A two-tuple of the checksum and algorithm, or
+            ``(None, None)`` if no run has a checksum. Runs from
+            before the algorithm was recorded used ``md5``.
+        '''
         if self.log_status:
             result = self.conn.execute('''
-                SELECT input_checksum, max(last_ran)
+                SELECT input_checksum, checksum_algorithm
                 FROM status
                 WHERE name = ?
                 AND display_name = ?
-                GROUP BY input_checksum
+                AND input_checksum IS NOT NULL
+                ORDER BY last_ran DESC
+                LIMIT 1
             ''', (self.name, self.display_name)).fetchone()
             if result:
-                return result[0]
-        return None
+                return result[0], result[1] or 'md5'
+        return None, None
+
+    @staticmethod
+    def rewindable(connector, connection):
+        '''Check whether the input can be checksummed before it is
+        extracted, see :py:meth:`pipeline.connectors.Connector.rewindable`.
+        Connectors that don't implement it are rewindable if their
+        connection is seekable.
+        '''
+        if hasattr(connector, 'rewindable'):
+            return connector.rewindable(connection)
+        return hasattr(connection, 'seekable') and connection.seekable()
+
+    def check_duplicate(self, input_checksum, checksum_algorithm='md5'):
+        '''Abort the run if the input matches the previous run's input
+
+        Any status row written for the current run is removed, so
+        that duplicate runs don't show up in the status table.
+        Checksums are only compared if they use the same algorithm.
+
+        Arguments:
+            input_checksum: checksum of the current run's input
+
+        Keyword Arguments:
+            checksum_algorithm: algorithm used for ``input_checksum``
+
+        Raises:
+            DuplicateFileException: if the checksums match
+        '''
+        if (input_checksum, checksum_algorithm) == self.get_last_run_checksum():
+            if self.log_status and hasattr(self, 'status'):
+                self.status.delete()
+                del self.status
+            raise DuplicateFileException
 
     def pre_run(self):
         '''Method to be run immediately before the pipeline runs
 
-        Enforces that a pipeline is complete and, connects to the statusdb
+        Resets any state left over from a previous run, enforces that
+        a pipeline is complete and, connects to the statusdb
 
         Returns:
             A unix timestamp of the pipeline's start time.
         '''
         start_time = time.time()
 
+        self.reset()
         self.enforce_full_pipeline()
 
         if self.log_status and not self.passed_conn:
@@ -225,9 +516,51 @@ class Pipeline(object):
             else:
                 raise MissingStatusDatabaseError("A connection name must be provided.")
 
+        if self.log_status:
+            upgrade_status_table(self.conn)
+
         return start_time
 
-    def run(self):
+    def attach_checkpoints(self, loader, start_time, input_checksum, resume=False):
+        '''Have a loader record its progress in the status database
+
+        Arguments:
+            loader: instantiated loader
+            start_time: the run's start time
+            input_checksum: checksum of the run's input, or ``None``
+                if it isn't known before loading
+
+        Keyword Arguments:
+            resume: boolean for whether or not to skip the input
+                records committed by the latest unfinished run with
+                the same input checksum
+
+        Raises:
+            RuntimeError: if ``resume`` is set and there are
+                checkpoints to resume from, but the input checksum
+                isn't known before loading, so they can't be matched
+                to the input. Loading anyway would upsert the
+                committed records again.
+        '''
+        if not self.log_status:
+            return
+        if resume and input_checksum is None:
+            if has_checkpoints(self.conn, self.name, self.display_name):
+                raise RuntimeError(
+                    'Cannot resume {}: the input checksum is not known before '
+                    'loading because the input cannot be rewound. Run without '
+                    'resume, or use a connector whose input can be rewound.'.format(self.name)
+                )
+        elif resume:
+            loader.resume_from = get_checkpoint(
+                self.conn, self.name, self.display_name, input_checksum
+            )
+        loader.checkpoint = lambda committed: save_checkpoint(
+            self.conn, self.name, self.display_name,
+            start_time, input_checksum, committed
+        )
+
+    def run(self, resume=False):
         '''Main pipeline run method
 
         One of the main features is that the connector, extractor,
@@ -240,20 +573,45 @@ class Pipeline(object):
         1. Run the ``pre_run`` method, which gives us the pipeline
            start time, ensures that our pipeline has all of the
            required component pieces, and connects to the status db.
-        2. Boot up a new connection object, and get the checksum
-           of the connected iterable.
-        3. Check to make sure that the incoming checksum is different
-           from the previous run's input_checksum
-        4. Instantiate our schema
-        5. Iterate through the iterable returned from the connector's
+        2. Boot up a new connection object. Connectors that support
+           it are handed the validators from the last successful run,
+           and can raise ``NotModifiedException`` without reading
+           anything if the source hasn't changed.
+        3. Instantiate our schema
+        4. Iterate through the iterable returned from the connector's
            connect method, handling each element with the extractor's
-           ``handle_line`` method before passing it to the the
-           ``load_line`` method to attach each row to the pipeline's
-           data.
-        6. After iteration, clean up the connector
+           ``handle_line`` method before validating it with the schema
+           and attaching it to the pipeline's data. If
+           ``validation_batch_size`` is set, rows are validated in
+           batches rather than one at a time.
+        5. After iteration, get the checksum of the input, which the
+           connector computes as the extractor reads it, and clean up
+           the connector
+        6. Check to make sure that the incoming checksum is different
+           from the previous run's input_checksum
         7. Instantiate the loader and load the data
         8. Finally, update the status to successful run and close
            down and clean up the pipeline.
+
+        In streaming mode, steps 4 through 7 are collapsed: the loader
+        is instantiated first and handed a generator of ``batch_size``
+        lists, so rows flow from the extractor through the schema to
+        the loader without ever being held in ``data``. Because of
+        this, the duplicate input check happens before extraction, and
+        only if the raw input can be rewound (see
+        :py:meth:`pipeline.connectors.Connector.rewindable`).
+
+        When the status is logged, loaders that support it record
+        how many input records they have committed in the
+        ``checkpoints`` table as they go.
+
+        Keyword Arguments:
+            resume: boolean for whether or not to skip the records
+                committed by the latest failed run with the same
+                input. The input is still extracted and validated in
+                full. In streaming mode, this needs a seekable
+                connection, since the input checksum has to be known
+                before loading starts.
         '''
         try:
             start_time = self.pre_run()
@@ -264,12 +622,25 @@ class Pipeline(object):
                 *(self.connector_args), **(self.connector_kwargs)
             )
 
+            # let the connector skip sources that haven't changed
+            # since the last successful run
+            if self.log_status:
+                _connector.previous_validators = get_validators(
+                    self.conn, self.name, self.display_name, self.target
+                )
+
             # connect and retreive source data
             connection = _connector.connect(self.target)
 
-            input_checksum = _connector.checksum_contents(self.target)
-            if input_checksum == self.get_last_run_checksum():
-                raise DuplicateFileException
+            # the checksum is normally taken from the same read that
+            # the extractor does. in streaming mode, rows are loaded as
+            # they are read, so the input has to be checked up front,
+            # which is only possible if the raw input can be rewound.
+            input_checksum = None
+            checksum_algorithm = getattr(_connector, 'hash_algorithm', 'md5')
+            if self.streaming and self.rewindable(_connector, connection):
+                input_checksum = _connector.checksum_contents(self.target)
+                self.check_duplicate(input_checksum, checksum_algorithm)
 
             if self.log_status:
                 self.status = Status(
@@ -289,28 +660,53 @@ class Pipeline(object):
 
             # instantiate our schema
             self.__schema = self._schema()
+            if self.compiled_schema:
+                self.__schema = self.__schema.compile()
 
             # build the data
             raw = _extractor.process_connection()
 
-            try:
-                for line in raw:
-                    try:
-                        data = _extractor.handle_line(line)
-                        self.load_line(data)
-                    except IsHeaderException:
-                        continue
-            finally:
-                _connector.close()
-
-            # load the data
-            _loader = self._loader(
-                *(self.loader_args), **(self.loader_kwargs)
-            )
-            _loader.load(self.data)
+            if self.streaming:
+                _loader = self._loader(
+                    *(self.loader_args), **(self.loader_kwargs)
+                )
+                self.attach_checkpoints(_loader, start_time, input_checksum, resume)
+                try:
+                    _loader.load_batches(
+                        self.batch_lines(self.stream_lines(_extractor, raw))
+                    )
+                    if input_checksum is None:
+                        input_checksum = _connector.checksum_contents(self.target)
+                finally:
+                    _connector.close()
+            else:
+                try:
+                    for data in self.stream_lines(_extractor, raw):
+                        self.data.append(data)
+                    input_checksum = _connector.checksum_contents(self.target)
+                finally:
+                    _connector.close()
+
+                self.check_duplicate(input_checksum, checksum_algorithm)
+
+                # load the data
+                _loader = self._loader(
+                    *(self.loader_args), **(self.loader_kwargs)
+                )
+                self.attach_checkpoints(_loader, start_time, input_checksum, resume)
+                _loader.load(self.data)
 
             if self.log_status:
-                self.status.update(status='success', input_checksum=input_checksum)
+                self.status.update(
+                    status='success', input_checksum=input_checksum,
+                    checksum_algorithm=checksum_algorithm
+                )
+                clear_checkpoints(self.conn, self.name, self.display_name)
+                if getattr(_connector, 'validators', None):
+                    save_validators(
+                        self.conn, self.name, self.display_name,
+                        self.target, _connector.validators
+                    )
 
         except Exception as e:
             if self.log_status and hasattr(self, 'status'):
@@ -320,13 +716,24 @@ class Pipeline(object):
         finally:
             if self.log_status and hasattr(self, 'status'):
                 self.status.update(
-                    num_lines=len(self.data),
+                    num_lines=self.num_lines,
                     last_ran=time.time()
                 )
             self.close()
 
         return self
 
+    def reset(self):
+        '''Clear per-run state, so that the same pipeline can be run
+        repeatedly without holding on to the previous run's data or
+        updating the previous run's status.
+        '''
+        self.data = []
+        self.num_lines = 0
+        self.__schema = None
+        if hasattr(self, 'status'):
+            del self.status
+
     def close(self):
         '''Close any open database connections.
         '''
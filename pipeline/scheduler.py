@@ -0,0 +1,194 @@
+import time
+import datetime
+
+
+class CronSchedule(object):
+    '''A cron-like schedule
+
+    Takes the five standard cron fields (minute, hour, day of month,
+    month, and day of week) separated by spaces. Each field can be
+    ``*``, a number, a range (``1-5``), a step (``*/15`` or
+    ``0-30/10``), or a comma-separated list of those. As in cron, if
+    both the day of month and day of week are restricted, a time
+    matches when either of them does. Days of the week run from
+    0 (Sunday) to 6 (Saturday); 7 is also accepted for Sunday.
+
+    Arguments:
+        expression: the cron expression, for example ``*/15 * * * *``
+
+    Raises:
+        ValueError: if the expression can't be parsed
+    '''
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(
+                'A schedule must have five fields: "{}"'.format(expression)
+            )
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self.parse_field(part, low, high)
+            for part, (low, high) in zip(parts, self.FIELD_RANGES)
+        ]
+        if 7 in self.weekdays:
+            self.weekdays = self.weekdays | {0}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def parse_field(field, low, high):
+        '''Parse a single cron field into the set of values it allows
+        '''
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(i) for i in part.split('-')]
+            else:
+                start = end = int(part)
+                if step != 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError('Invalid cron field: "{}"'.format(field))
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, dt):
+        '''Check whether a datetime's day falls on the schedule
+        '''
+        day = dt.day in self.days
+        # python's weekday() starts at Monday == 0
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, dt):
+        '''Check whether a datetime falls on the schedule
+
+        Arguments:
+            dt: a :py:class:`datetime.datetime`, compared to the
+                minute
+        '''
+        return dt.minute in self.minutes and dt.hour in self.hours \
+            and dt.month in self.months and self.day_matches(dt)
+
+    def next_run(self, after):
+        '''Get the first time on the schedule strictly after a datetime
+
+        Arguments:
+            after: a :py:class:`datetime.datetime`
+
+        Returns:
+            A :py:class:`datetime.datetime` on a whole minute
+
+        Raises:
+            ValueError: if the schedule can never match, for example
+                on February 30th
+        '''
+        dt = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        for _ in range(200000):
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError('Schedule "{}" never runs'.format(self.expression))
+
+
+class Scheduler(object):
+    '''Runs pipelines repeatedly on cron-like schedules
+
+    Jobs are run one at a time in the scheduler's process, so job
+    modules are imported and configuration is parsed only once.
+    Each pipeline is reset after it runs, so that it doesn't hold
+    on to its data between runs.
+
+    Arguments:
+        runner: callable taking a job path and a
+            :py:class:`~pipeline.pipeline.Pipeline` which runs the
+            pipeline and returns a result, see
+            :py:func:`~pipeline.scripts.execute_pipeline`
+    '''
+    def __init__(self, runner):
+        self.runner = runner
+        self.jobs = []
+
+    def add(self, job_path, pipeline, schedule, now=None):
+        '''Schedule a pipeline
+
+        Arguments:
+            job_path: name of the job, used when reporting results
+            pipeline: the :py:class:`~pipeline.pipeline.Pipeline`
+            schedule: a cron expression or
+                :py:class:`~pipeline.scheduler.CronSchedule`
+
+        Keyword Arguments:
+            now: time to schedule the first run after. Defaults to
+                the current time.
+        '''
+        if not isinstance(schedule, CronSchedule):
+            schedule = CronSchedule(schedule)
+        now = now or datetime.datetime.now()
+        self.jobs.append({
+            'job_path': job_path, 'pipeline': pipeline,
+            'schedule': schedule, 'next_run': schedule.next_run(now)
+        })
+
+    def next_due(self):
+        '''Get the time the next job is due, or ``None`` if there are no jobs
+        '''
+        return min((job['next_run'] for job in self.jobs), default=None)
+
+    def run_pending(self, now=None):
+        '''Run every job that is due
+
+        Keyword Arguments:
+            now: the current time. Defaults to
+                :py:meth:`datetime.datetime.now`
+
+        Returns:
+            A list of the results returned by the runner
+        '''
+        now = now or datetime.datetime.now()
+        results = []
+        for job in sorted(self.jobs, key=lambda i: i['next_run']):
+            if job['next_run'] > now:
+                continue
+            try:
+                results.append(self.runner(job['job_path'], job['pipeline']))
+            finally:
+                job['pipeline'].reset()
+                # jobs that were missed while others ran only run once
+                job['next_run'] = job['schedule'].next_run(
+                    max(now, datetime.datetime.now())
+                )
+        return results
+
+    def run_forever(self, callback=None, sleep=time.sleep):
+        '''Run jobs as they become due until interrupted
+
+        Keyword Arguments:
+            callback: called with each job's result
+            sleep: function used to wait between checks
+        '''
+        while True:
+            for result in self.run_pending():
+                if callback:
+                    callback(result)
+            next_due = self.next_due()
+            wait = (next_due - datetime.datetime.now()).total_seconds() if next_due else 60
+            if wait > 0:
+                sleep(min(wait, 60))
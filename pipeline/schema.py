@@ -1,16 +1,374 @@
-from marshmallow import Schema, fields
+import datetime
+from collections.abc import Mapping
+
+from marshmallow import Schema, fields, utils, missing, ValidationError
+from marshmallow.schema import MarshalResult, UnmarshalResult
+
+
+class NativeDateTime(fields.DateTime):
+    '''DateTime field that also accepts :py:class:`datetime.datetime`
+    objects, such as the ones returned by
+    :py:class:`~pipeline.extractors.ExcelExtractor`, without
+    formatting and re-parsing them
+    '''
+    def _deserialize(self, value, attr, data):
+        if isinstance(value, datetime.datetime):
+            return value
+        return super(NativeDateTime, self)._deserialize(value, attr, data)
+
+
+class NativeDate(fields.Date):
+    '''Date field that also accepts :py:class:`datetime.date` and
+    :py:class:`datetime.datetime` objects
+    '''
+    def _deserialize(self, value, attr, data):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return super(NativeDate, self)._deserialize(value, attr, data)
+
 
 FIELD_TO_CKAN_TYPE_MAPPING = {
     fields.String: 'text',
     fields.Number: 'numeric', fields.Integer: 'numeric',
     fields.DateTime: 'timestamp', fields.Date: 'date',
+    NativeDateTime: 'timestamp', NativeDate: 'date',
     fields.Float: 'float', fields. Boolean: 'bool'
 }
 
+
+def _load_string(field):
+    def convert(value):
+        if value.__class__ is not str:
+            raise TypeError
+        return value
+    return convert
+
+
+def _load_number(field):
+    return field.num_type
+
+
+def _load_date(field):
+    def convert(value):
+        if not value:
+            raise ValueError
+        return utils.from_iso_date(value)
+    return convert
+
+
+def _load_datetime(field):
+    dateformat = field.dateformat or field.DEFAULT_FORMAT
+    func = field.DATEFORMAT_DESERIALIZATION_FUNCS.get(dateformat)
+
+    def convert(value):
+        if not value:
+            raise ValueError
+        if func:
+            return func(value)
+        return datetime.datetime.strptime(value, dateformat)
+    return convert
+
+
+def _load_native_datetime(field):
+    convert = _load_datetime(field)
+
+    def native(value):
+        if isinstance(value, datetime.datetime):
+            return value
+        return convert(value)
+    return native
+
+
+def _load_native_date(field):
+    convert = _load_date(field)
+
+    def native(value):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return convert(value)
+    return native
+
+
+def _dump_string(field):
+    def convert(value):
+        if value is None:
+            return None
+        if value.__class__ is not str:
+            raise TypeError
+        return value
+    return convert
+
+
+def _dump_number(field):
+    num_type, as_string = field.num_type, field.as_string
+
+    def convert(value):
+        if value is None:
+            return None
+        return str(num_type(value)) if as_string else num_type(value)
+    return convert
+
+
+def _dump_date(field):
+    def convert(value):
+        if value is None:
+            return None
+        return value.isoformat()
+    return convert
+
+
+def _dump_datetime(field):
+    dateformat = field.dateformat or field.DEFAULT_FORMAT
+    func = field.DATEFORMAT_SERIALIZATION_FUNCS.get(dateformat)
+    localtime = field.localtime
+
+    def convert(value):
+        if value is None:
+            return None
+        if func:
+            return func(value, localtime=localtime)
+        return value.strftime(dateformat)
+    return convert
+
+
+# Fast (load, dump) converters, keyed on the exact field class so that
+# subclasses overriding _serialize or _deserialize fall back to marshmallow
+FAST_CONVERTERS = {
+    fields.String: (_load_string, _dump_string),
+    fields.Number: (_load_number, _dump_number),
+    fields.Integer: (_load_number, _dump_number),
+    fields.Float: (_load_number, _dump_number),
+    fields.Date: (_load_date, _dump_date),
+    fields.DateTime: (_load_datetime, _dump_datetime),
+    NativeDate: (_load_native_date, _dump_date),
+    NativeDateTime: (_load_native_datetime, _dump_datetime),
+}
+
+
+def compile_deserializer(field):
+    '''Build a function that deserializes a value for a field
+
+    The fast converter handles well-formed values. Anything it can't
+    handle (``None``, missing values, bad input) is passed on to the
+    field's own ``deserialize`` method, so error messages are the
+    same as marshmallow's.
+    '''
+    if type(field) not in FAST_CONVERTERS:
+        return field.deserialize
+    convert = FAST_CONVERTERS[type(field)][0](field)
+    validate = field._validate if field.validators else None
+
+    def deserialize(value, attr, data):
+        try:
+            output = convert(value)
+        except Exception:
+            return field.deserialize(value, attr, data)
+        if validate:
+            validate(output)
+        return output
+    return deserialize
+
+
+def compile_serializer(field, accessor):
+    '''Build a function that serializes a value for a field
+
+    Missing values and values the fast converter can't handle are
+    passed on to the field's own ``serialize`` and ``_serialize``
+    methods.
+    '''
+    if type(field) not in FAST_CONVERTERS:
+        return lambda value, attr, obj: field.serialize(attr, obj, accessor=accessor)
+    convert = FAST_CONVERTERS[type(field)][1](field)
+
+    def serialize(value, attr, obj):
+        if value is missing:
+            return field.serialize(attr, obj, accessor=accessor)
+        try:
+            return convert(value)
+        except Exception:
+            return field._serialize(value, attr, obj)
+    return serialize
+
+
+def store_error(errors, field_name, err):
+    '''Record a field's :py:class:`marshmallow.ValidationError` the
+    same way marshmallow does
+    '''
+    if isinstance(err.messages, dict):
+        errors[field_name] = err.messages
+    elif isinstance(errors.get(field_name), dict):
+        errors[field_name].setdefault('_field', []).extend(err.messages)
+    else:
+        errors.setdefault(field_name, []).extend(err.messages)
+
+
+class CompiledSchema(object):
+    '''Row converter generated by :py:meth:`BaseSchema.compile`
+
+    Has the same ``load`` and ``dump`` methods as the schema it was
+    compiled from, returning the same data and errors, but looks
+    up each field's converter once instead of going through
+    marshmallow's generic field dispatch for every row.
+
+    Arguments:
+        schema: an instantiated :py:class:`BaseSchema`
+    '''
+    def __init__(self, schema):
+        self.schema = schema
+        self.dict_class = schema.dict_class
+        self.loaders, self.dumpers = [], []
+        for attr_name, field in schema.fields.items():
+            key = field.attribute or attr_name
+            if not field.dump_only:
+                self.loaders.append((
+                    attr_name, field.load_from, key, field,
+                    compile_deserializer(field)
+                ))
+            if not field.load_only:
+                self.dumpers.append((
+                    field.dump_to or attr_name, attr_name, key,
+                    compile_serializer(field, schema.get_attribute)
+                ))
+
+    def load(self, data, many=False):
+        '''Deserialize a row, or a list of rows
+
+        Arguments:
+            data: a dictionary of raw values
+
+        Keyword Arguments:
+            many: if True, ``data`` is a list of rows. Errors are
+                keyed by the index of the failing row.
+
+        Returns:
+            A :py:class:`marshmallow.schema.UnmarshalResult`
+        '''
+        if many:
+            if not utils.is_collection(data):
+                return self.schema.load(data, many=True)
+            data = list(data)
+            if not all(isinstance(row, Mapping) for row in data):
+                return self.schema.load(data, many=True)
+            return UnmarshalResult(*self._many(self._load_row, data))
+        if not isinstance(data, Mapping):
+            return self.schema.load(data)
+        return UnmarshalResult(*self._load_row(data))
+
+    def dump(self, obj, many=False):
+        '''Serialize a row, or a list of rows
+
+        Arguments:
+            obj: a dictionary of deserialized values
+
+        Keyword Arguments:
+            many: if True, ``obj`` is a list of rows
+
+        Returns:
+            A :py:class:`marshmallow.schema.MarshalResult`
+        '''
+        if many:
+            if not utils.is_collection(obj):
+                return self.schema.dump(obj, many=True)
+            obj = list(obj)
+            if not all(isinstance(row, Mapping) for row in obj):
+                return self.schema.dump(obj, many=True)
+            return MarshalResult(*self._many(self._dump_row, obj))
+        if not isinstance(obj, Mapping):
+            return self.schema.dump(obj)
+        return MarshalResult(*self._dump_row(obj))
+
+    @staticmethod
+    def _many(convert, rows):
+        results, errors = [], {}
+        for index, row in enumerate(rows):
+            result, row_errors = convert(row)
+            results.append(result)
+            if row_errors:
+                errors[index] = row_errors
+        return results, errors
+
+    def _load_row(self, data):
+        result, errors = self.dict_class(), {}
+        for attr_name, load_from, key, field, deserialize in self.loaders:
+            field_name = attr_name
+            value = data.get(attr_name, missing)
+            if value is missing and load_from:
+                field_name = load_from
+                value = data.get(load_from, missing)
+            if value is missing:
+                value = field.missing() if callable(field.missing) else field.missing
+                if value is missing and not field.required:
+                    continue
+            try:
+                value = deserialize(value, load_from or attr_name, data)
+            except ValidationError as err:
+                store_error(errors, field_name, err)
+                value = err.data or missing
+            if value is not missing:
+                result[key] = value
+        return result, errors
+
+    def _dump_row(self, obj):
+        items, errors = [], {}
+        for name, attr_name, key, serialize in self.dumpers:
+            try:
+                value = serialize(obj.get(key, missing), attr_name, obj)
+            except ValidationError as err:
+                store_error(errors, name, err)
+                value = err.data or missing
+            if value is not missing:
+                items.append((name, value))
+        return self.dict_class(items), errors
+
+
 class BaseSchema(Schema):
     '''Base schema for the pipeline. Extends :py:class:`marshmallow.Schema`
     '''
 
+    def is_compilable(self):
+        '''Check whether the schema can be compiled
+
+        Schemas with hooks (``pre_load``, ``validates`` and friends),
+        ``strict``, ``many``, ``partial``, ``extra`` or ``prefix`` set,
+        custom error handlers or attribute getters, or dotted
+        attributes are left to marshmallow.
+        '''
+        cls = self.__class__
+        return not (
+            any(self.__processors__.values()) or
+            self.strict or self.many or self.partial or
+            self.extra or self.prefix or
+            self.opts.fields or self.opts.additional or
+            not self.opts.index_errors or
+            self.__error_handler__ or self.__accessor__ or
+            cls.handle_error is not Schema.handle_error or
+            cls.get_attribute is not Schema.get_attribute or
+            any('.' in (field.attribute or name) for name, field in self.fields.items())
+        )
+
+    def compile(self):
+        '''Generate a specialised row converter for the schema
+
+        ``String``, ``Number``, ``Integer``, ``Float``, ``Date``,
+        ``DateTime``, ``NativeDate`` and ``NativeDateTime`` fields get
+        fast converters; other fields use
+        marshmallow's own (de)serialization. The result has the same
+        ``load`` and ``dump`` methods as the schema and returns the
+        same data and errors, so it can be used in its place.
+
+        Returns:
+            A :py:class:`~pipeline.schema.CompiledSchema`, or the
+            schema itself if it can't be compiled (see
+            :py:meth:`~pipeline.schema.BaseSchema.is_compilable`)
+        '''
+        if not self.is_compilable():
+            return self
+        return CompiledSchema(self)
+
     def serialize_to_ckan_fields(self, capitalize=False):
         '''Convert schema fieldlist to CKAN-friendly Fields
 
@@ -2,12 +2,18 @@ import os
 import sqlite3
 import click
 import json
+import datetime
 import importlib
+from concurrent.futures import ProcessPoolExecutor
 from pipeline import Pipeline
+from pipeline.scheduler import Scheduler
+from pipeline.status import STATUS_TABLE, VALIDATORS_TABLE, CHECKPOINTS_TABLE
 from pipeline.exceptions import InvalidPipelineError, DuplicateFileException
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
+SUCCESS, SKIPPED, FAILED = 'success', 'skipped', 'failed'
+
 @click.command()
 @click.option(
     '--config', '-c', type=click.Path(exists=True),
@@ -50,65 +56,280 @@ def create_db(config, db, drop):
     if drop:
         click.echo('Dropping table...')
         cur.execute('''DROP TABLE IF EXISTS status''')
+        cur.execute('''DROP TABLE IF EXISTS validators''')
+        cur.execute('''DROP TABLE IF EXISTS checkpoints''')
         conn.commit()
 
     click.echo('Creating table...')
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS
-    status (
-        name TEXT NOT NULL,
-        display_name TEXT,
-        last_ran INTEGER,
-        start_time INTEGER NOT NULL,
-        input_checksum TEXT,
-        status TEXT,
-        num_lines INTEGER,
-        PRIMARY KEY (display_name, start_time)
-    )
-    ''')
+    cur.execute(STATUS_TABLE)
+    cur.execute(VALIDATORS_TABLE)
+    cur.execute(CHECKPOINTS_TABLE)
     conn.commit()
 
+def load_pipeline(job_path):
+    '''Import the pipeline found at a JOB_PATH
+
+    Arguments:
+        job_path: module path and pipeline name separated
+            by a : character, e.g. my.nested.job.directory:my_pipeline
+
+    Returns:
+        The :py:class:`~pipeline.pipeline.Pipeline` object
+
+    Raises:
+        InvalidPipelineError: if the job path is malformed or
+            doesn't point to a Pipeline
+    '''
+    if ':' not in job_path:
+        raise InvalidPipelineError
+    path, pipeline = job_path.split(':')
+    pipeline_module = importlib.import_module(path)
+    pipeline = getattr(pipeline_module, pipeline)
+    if not isinstance(pipeline, Pipeline):
+        raise InvalidPipelineError
+    return pipeline
+
+def execute_pipeline(job_path, pipeline, resume=False):
+    '''Run a pipeline, catching any errors
+
+    Arguments:
+        job_path: name of the job, used in the result
+        pipeline: the :py:class:`~pipeline.pipeline.Pipeline` to run
+
+    Keyword Arguments:
+        resume: passed to :py:meth:`~pipeline.pipeline.Pipeline.run`
+
+    Returns:
+        A three-tuple of the job path, one of ``success``,
+        ``skipped``, or ``failed``, and an error message
+    '''
+    try:
+        pipeline.run(resume=resume)
+
+    except DuplicateFileException:
+        return job_path, SKIPPED, 'This input has already been processed!'
+
+    except Exception as e:
+        return job_path, FAILED, 'Something went wrong in the pipeline: {}'.format(e)
+
+    return job_path, SUCCESS, None
+
+def execute_job(job_path, config=None, resume=False):
+    '''Import and run the pipeline at a JOB_PATH, catching any errors
+
+    This is a module-level function so that it can be sent to
+    worker processes.
+
+    Arguments:
+        job_path: see :py:func:`~pipeline.scripts.load_pipeline`
+
+    Keyword Arguments:
+        config: optional path to a configuration file
+        resume: see :py:func:`~pipeline.scripts.execute_pipeline`
+
+    Returns:
+        See :py:func:`~pipeline.scripts.execute_pipeline`
+    '''
+    try:
+        pipeline = load_pipeline(job_path)
+
+        if config:
+            pipeline.set_config_from_file(config)
+
+    except (InvalidPipelineError, ImportError):
+        return job_path, FAILED, 'A Pipeline could not be found at "{}"'.format(
+            job_path
+        )
+
+    except Exception as e:
+        return job_path, FAILED, 'Something went wrong in the pipeline: {}'.format(e)
+
+    return execute_pipeline(job_path, pipeline, resume)
+
+def read_manifest(manifest):
+    '''Read job paths from a manifest file
+
+    The manifest lists one job path per line. Blank lines and
+    lines starting with # are ignored.
+    '''
+    with open(manifest) as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.strip().startswith('#')
+        ]
+
 @click.command()
-@click.argument('job_path', type=click.STRING)
+@click.argument('job_paths', nargs=-1, type=click.STRING)
 @click.option(
     '--config', type=click.Path(exists=True),
     help='Path to a configuration object to use')
-def run_job(job_path, config):
-    '''Run a pipeline based on the given input JOB_PATH
+@click.option(
+    '--manifest', '-m', type=click.Path(exists=True),
+    help='Path to a file listing job paths to run, one per line.')
+@click.option(
+    '--workers', '-w', default=1, type=click.INT,
+    help='Number of processes to run jobs in.')
+@click.option(
+    '--resume', '-r', type=click.BOOL, is_flag=True,
+    help='Skip records already loaded by a failed run with the same input.')
+def run_job(job_paths, config, manifest, workers, resume):
+    '''Run pipelines based on the given input JOB_PATHS
 
     Directories should be separated based on the . character
     and the pipeline should be separated from the directories
     with a : character.
 
     For example: my.nested.job.directory:my_pipeline
+
+    If more than one job is passed (as arguments or in a
+    --manifest), the jobs are run on a pool of --workers
+    processes and a summary is printed. The command fails if
+    any job failed; jobs skipped because their input has already
+    been processed don't count as failures.
+
+    With --resume, pipelines that log their status pick up a failed
+    run where it left off: the input is extracted again, but the
+    records the failed run already loaded are skipped.
     '''
-    try:
-        if ':' not in job_path:
-            raise InvalidPipelineError
-        path, pipeline = job_path.split(':')
-        pipeline_module = importlib.import_module(path)
-        pipeline = getattr(pipeline_module, pipeline)
-        if not isinstance(pipeline, Pipeline):
-            raise InvalidPipelineError
+    job_paths = list(job_paths) + (read_manifest(manifest) if manifest else [])
+    if not job_paths:
+        raise click.ClickException('At least one JOB_PATH or a manifest is required')
+
+    if len(job_paths) == 1:
+        _, status, message = execute_job(job_paths[0], config, resume)
+        if status != SUCCESS:
+            raise click.ClickException(message)
+        return
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                execute_job, job_paths,
+                [config] * len(job_paths), [resume] * len(job_paths)
+            ))
+    else:
+        results = [execute_job(job_path, config, resume) for job_path in job_paths]
+
+    for job_path, status, message in results:
+        click.echo('{}: {}{}'.format(
+            job_path, status, ' ({})'.format(message) if message else ''
+        ))
+
+    counts = {i: len([r for r in results if r[1] == i]) for i in (SUCCESS, SKIPPED, FAILED)}
+    summary = '{} succeeded, {} skipped, {} failed'.format(
+        counts[SUCCESS], counts[SKIPPED], counts[FAILED]
+    )
+    if counts[FAILED]:
+        raise click.ClickException(summary)
+    click.echo(summary)
+
+def load_schedule(schedule_file, config=None):
+    '''Build a scheduler from a SCHEDULE_FILE
+
+    The schedule file is JSON, with a list of jobs, each with a
+    job path and a cron expression:
+
+    .. code-block:: json
+
+        {
+            "jobs": [
+                {"job": "my.nested.job.directory:my_pipeline", "schedule": "*/15 * * * *"}
+            ]
+        }
 
+    Keyword Arguments:
+        config: optional path to a configuration file, read once
+            for every pipeline
+
+    Returns:
+        A :py:class:`~pipeline.scheduler.Scheduler`
+    '''
+    with open(schedule_file) as f:
+        try:
+            jobs = json.loads(f.read())['jobs']
+        except (ValueError, KeyError):
+            raise click.ClickException(
+                'SCHEDULE_FILE must be JSON with a list of jobs'
+            )
+
+    scheduler = Scheduler(execute_pipeline)
+    for job in jobs:
+        try:
+            pipeline = load_pipeline(job['job'])
+        except (InvalidPipelineError, ImportError, AttributeError):
+            raise click.ClickException(
+                'A Pipeline could not be found at "{}"'.format(job['job'])
+            )
         if config:
             pipeline.set_config_from_file(config)
+        try:
+            scheduler.add(job['job'], pipeline, job['schedule'])
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    return scheduler
 
-        pipeline.run()
+@click.command()
+@click.argument('schedule_file', type=click.Path(exists=True))
+@click.option(
+    '--config', type=click.Path(exists=True),
+    help='Path to a configuration object to use')
+def run_scheduler(schedule_file, config):
+    '''Run pipelines on the schedules in SCHEDULE_FILE until interrupted
 
-    except (InvalidPipelineError, ImportError):
-        raise click.ClickException(
-            'A Pipeline could not be found at "{}"'.format(
-                job_path
-            )
-        )
+    Job modules are imported and configuration is read once when
+    the scheduler starts; each pipeline is then run in this process
+    whenever its cron-like schedule comes due.
+    '''
+    scheduler = load_schedule(schedule_file, config)
+    click.echo('Scheduled {} jobs, next run at {}'.format(
+        len(scheduler.jobs), scheduler.next_due()
+    ))
 
-    except DuplicateFileException:
-        raise click.ClickException(
-            'This input has already been processed!'
-        )
+    def report(result):
+        job_path, status, message = result
+        click.echo('{} {}: {}{}'.format(
+            datetime.datetime.now().isoformat(), job_path, status,
+            ' ({})'.format(message) if message else ''
+        ))
 
-    except Exception as e:
-        raise click.ClickException(
-            'Something went wrong in the pipeline: {}'.format(e)
-        )
+    try:
+        scheduler.run_forever(callback=report)
+    except KeyboardInterrupt:
+        click.echo('Stopping scheduler...')
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='Interface to listen on')
+@click.option('--port', '-p', default=8080, help='Port to listen on')
+@click.option('--latency', default=0.0, help='Seconds added to every request')
+@click.option('--jitter', default=0.0, help='Up to this many random seconds added to the latency')
+@click.option('--bytes-per-second', type=float, default=None, help='Cap on request bytes read per second')
+@click.option('--records-per-second', type=float, default=None, help='Cap on records upserted per second')
+@click.option('--max-payload', type=int, default=None, help='Largest request body in bytes; larger ones get a 413')
+@click.option('--error-rate', default=0.0, help='Fraction of upserts answered with a 500')
+@click.option('--seed', type=int, default=None, help='Seed for the random latency and errors')
+@click.option('--verbose', '-v', is_flag=True, help='Log every request')
+def run_mock_ckan(host, port, latency, jitter, bytes_per_second, records_per_second,
+                  max_payload, error_rate, seed, verbose):
+    '''Serve an in-memory mock of the CKAN action API until interrupted
+
+    Point a loader's ckan_root_url at the printed url to load test it
+    offline, see pipeline.mock_ckan.MockCKAN.
+    '''
+    # imported here so that the other commands don't depend on the
+    # mock server, which needs Python 3.7's ThreadingHTTPServer
+    from pipeline.mock_ckan import MockCKAN, MockCKANServer
+
+    ckan = MockCKAN(
+        latency=latency, jitter=jitter, bytes_per_second=bytes_per_second,
+        records_per_second=records_per_second, max_payload=max_payload,
+        error_rate=error_rate, seed=seed
+    )
+    server = MockCKANServer(ckan, host=host, port=port, verbose=verbose)
+    click.echo('Serving mock CKAN at {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.echo('Stopping mock CKAN...')
+    finally:
+        server.stop()
+        click.echo(json.dumps(ckan.stats, sort_keys=True))
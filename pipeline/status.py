@@ -1,3 +1,46 @@
+import time
+
+STATUS_TABLE = '''
+CREATE TABLE IF NOT EXISTS
+status (
+    name TEXT NOT NULL,
+    display_name TEXT,
+    last_ran INTEGER,
+    start_time INTEGER NOT NULL,
+    input_checksum TEXT,
+    status TEXT,
+    num_lines INTEGER,
+    checksum_algorithm TEXT,
+    PRIMARY KEY (display_name, start_time)
+)
+'''
+
+VALIDATORS_TABLE = '''
+CREATE TABLE IF NOT EXISTS
+validators (
+    name TEXT NOT NULL,
+    display_name TEXT,
+    target TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_length INTEGER,
+    PRIMARY KEY (name, display_name, target)
+)
+'''
+
+CHECKPOINTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS
+checkpoints (
+    name TEXT NOT NULL,
+    display_name TEXT,
+    start_time INTEGER NOT NULL,
+    input_checksum TEXT,
+    committed INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    PRIMARY KEY (display_name, start_time)
+)
+'''
+
 class Status(object):
     '''Object to represent row in status table
 
@@ -10,10 +53,12 @@ class Status(object):
         status: string representing status/errors with the pipeline
         num_lines: if successful, number of lines processed
         input_checksum: a checksum of the input's contents
+        checksum_algorithm: the algorithm used for ``input_checksum``
     '''
     def __init__(
         self, conn, name, display_name, last_ran, start_time,
-        status, frequency, num_lines, input_checksum
+        status, frequency, num_lines, input_checksum,
+        checksum_algorithm=None
     ):
         self.conn = conn
         self.name = name
@@ -23,6 +68,7 @@ class Status(object):
         self.status = status
         self.num_lines = num_lines
         self.input_checksum = input_checksum
+        self.checksum_algorithm = checksum_algorithm
 
     def update(self, **kwargs):
         '''Update the Status object with passed kwargs and write the result
@@ -39,12 +85,171 @@ class Status(object):
             '''
             INSERT OR REPLACE INTO status (
                 name, display_name, last_ran, start_time,
-                input_checksum, status, num_lines
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                input_checksum, status, num_lines, checksum_algorithm
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 self.name, self.display_name, self.last_ran,
                 self.start_time, self.input_checksum,
-                self.status, self.num_lines
+                self.status, self.num_lines, self.checksum_algorithm
             )
         )
         self.conn.commit()
+
+    def delete(self):
+        '''Delete the status row
+        '''
+        cur = self.conn.cursor()
+        cur.execute(
+            '''
+            DELETE FROM status
+            WHERE display_name = ?
+            AND start_time = ?
+            ''', (self.display_name, self.start_time)
+        )
+        self.conn.commit()
+
+
+def upgrade_status_table(conn):
+    '''Add the ``checksum_algorithm`` column to a status table
+    created before it existed
+
+    Arguments:
+        conn: database connection, usually sqlite3 connection object
+    '''
+    columns = [i[1] for i in conn.execute('PRAGMA table_info(status)')]
+    if columns and 'checksum_algorithm' not in columns:
+        conn.execute('ALTER TABLE status ADD COLUMN checksum_algorithm TEXT')
+        conn.commit()
+
+def get_validators(conn, name, display_name, target):
+    '''Get the validators a source returned on a pipeline's last successful run
+
+    Arguments:
+        conn: database connection, usually sqlite3 connection object
+        name: name of the pipeline
+        display_name: display name of the pipeline
+        target: the connector's target, for example a URL
+
+    Returns:
+        A dictionary with ``etag``, ``last_modified``, and
+        ``content_length`` keys, empty if nothing was stored
+    '''
+    conn.execute(VALIDATORS_TABLE)
+    result = conn.execute(
+        '''
+        SELECT etag, last_modified, content_length
+        FROM validators
+        WHERE name = ?
+        AND display_name = ?
+        AND target = ?
+        ''', (name, display_name, str(target))
+    ).fetchone()
+    if result is None:
+        return {}
+    return dict(zip(('etag', 'last_modified', 'content_length'), result))
+
+def save_validators(conn, name, display_name, target, validators):
+    '''Store the validators a source returned on a successful run
+
+    Arguments:
+        conn: database connection, usually sqlite3 connection object
+        name: name of the pipeline
+        display_name: display name of the pipeline
+        target: the connector's target, for example a URL
+        validators: dictionary with ``etag``, ``last_modified``,
+            and ``content_length`` keys
+    '''
+    conn.execute(VALIDATORS_TABLE)
+    conn.execute(
+        '''
+        INSERT OR REPLACE INTO validators (
+            name, display_name, target, etag,
+            last_modified, content_length
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            name, display_name, str(target), validators.get('etag'),
+            validators.get('last_modified'), validators.get('content_length')
+        )
+    )
+    conn.commit()
+
+def save_checkpoint(conn, name, display_name, start_time, input_checksum, committed):
+    '''Record how many input records a run has committed to its destination
+
+    Arguments:
+        conn: database connection, usually sqlite3 connection object
+        name: name of the pipeline
+        display_name: display name of the pipeline
+        start_time: start time of the run, as in the status table
+        input_checksum: checksum of the run's input
+        committed: number of input records committed so far
+    '''
+    conn.execute(CHECKPOINTS_TABLE)
+    conn.execute(
+        '''
+        INSERT OR REPLACE INTO checkpoints (
+            name, display_name, start_time, input_checksum,
+            committed, updated
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            name, display_name, start_time, input_checksum,
+            committed, time.time()
+        )
+    )
+    conn.commit()
+
+def get_checkpoint(conn, name, display_name, input_checksum):
+    '''Get the number of input records committed by the latest
+    unfinished run with the same input
+
+    Arguments:
+        conn: database connection, usually sqlite3 connection object
+        name: name of the pipeline
+        display_name: display name of the pipeline
+        input_checksum: checksum of the current run's input
+
+    Returns:
+        The number of committed records, 0 if there is no checkpoint
+    '''
+    conn.execute(CHECKPOINTS_TABLE)
+    result = conn.execute(
+        '''
+        SELECT committed
+        FROM checkpoints
+        WHERE name = ?
+        AND display_name = ?
+        AND input_checksum = ?
+        ORDER BY updated DESC
+        LIMIT 1
+        ''', (name, display_name, input_checksum)
+    ).fetchone()
+    return result[0] if result else 0
+
+def has_checkpoints(conn, name, display_name):
+    '''Check whether any unfinished run of a pipeline has a checkpoint,
+    whatever its input
+    '''
+    conn.execute(CHECKPOINTS_TABLE)
+    result = conn.execute(
+        '''
+        SELECT 1
+        FROM checkpoints
+        WHERE name = ?
+        AND display_name = ?
+        LIMIT 1
+        ''', (name, display_name)
+    ).fetchone()
+    return result is not None
+
+def clear_checkpoints(conn, name, display_name):
+    '''Remove a pipeline's checkpoints once a run has finished
+    '''
+    conn.execute(CHECKPOINTS_TABLE)
+    conn.execute(
+        '''
+        DELETE FROM checkpoints
+        WHERE name = ?
+        AND display_name = ?
+        ''', (name, display_name)
+    )
+    conn.commit()
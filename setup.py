@@ -7,11 +7,16 @@ setup(
     include_package_data=True,
     install_requires=[
         'Click>6,<7', 'marshmallow>=2.6,<3', 'requests>2.9,<3',
-        'paramiko>=1.16'
+        'paramiko>=1.16', 'xlrd>=0.9', 'openpyxl>=2.6'
     ],
+    extras_require={
+        'xxhash': ['xxhash>=1.0'],
+    },
     entry_points='''
     [console_scripts]
     create_monitoring_db=pipeline.scripts:create_db
     run_job=pipeline.scripts:run_job
+    run_scheduler=pipeline.scripts:run_scheduler
+    run_mock_ckan=pipeline.scripts:run_mock_ckan
     '''
 )
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.run import run_benchmarks, compare, measure
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(sizes=[20], stages=['csv_extract', 'ckan_load', 'pipeline'])
+        self.assertEquals(sorted(results), ['ckan_load@20', 'csv_extract@20', 'pipeline@20'])
+        for result in results.values():
+            self.assertEquals(result['rows'], 20)
+            self.assertGreater(result['peak_memory'], 0)
+
+    def test_only_needed_inputs_generated(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        run_benchmarks(sizes=[20], stages=['csv_extract'], workdir=workdir, repeats=1)
+        self.assertEquals(os.listdir(workdir), ['input_20.csv'])
+
+    def test_measure_repeats(self):
+        calls = []
+        result = measure(lambda: calls.append(1), 10, repeats=3, warmup=2)
+        # warm up, timed runs and the traced run
+        self.assertEquals(len(calls), 6)
+        self.assertEquals(result['rows'], 10)
+
+    def test_compare(self):
+        baseline = {
+            'a@10': {'rows_per_sec': 100.0, 'peak_memory': 1000},
+            'b@10': {'rows_per_sec': 100.0, 'peak_memory': 1000},
+            'c@10': {'rows_per_sec': 100.0, 'peak_memory': 1000},
+        }
+        results = {
+            'a@10': {'rows_per_sec': 90.0, 'peak_memory': 1100},
+            'b@10': {'rows_per_sec': 70.0, 'peak_memory': 1000},
+            'c@10': {'rows_per_sec': 100.0, 'peak_memory': 1300},
+            'd@10': {'rows_per_sec': 1.0, 'peak_memory': 1},
+        }
+        regressions = compare(results, baseline, threshold=0.25)
+        self.assertEquals(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('b@10'))
+        self.assertTrue(regressions[1].startswith('c@10'))
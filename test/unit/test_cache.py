@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import Mock, patch, PropertyMock
+
+from pipeline.cache import MetadataCache, RowHashStore
+from pipeline.loaders import CKANDatastoreLoader
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+        self.cache = MetadataCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('url', 'package', 'resource'))
+
+    def test_set_and_get(self):
+        self.cache.set('url', 'package', 'resource', 'anID', 'fingerprint')
+        self.assertEquals(
+            MetadataCache(self.path).get('url', 'package', 'resource'),
+            ('anID', 'fingerprint')
+        )
+
+    def test_expired(self):
+        self.cache.set('url', 'package', 'resource', 'anID')
+        self.assertIsNone(MetadataCache(self.path, ttl=-1).get('url', 'package', 'resource'))
+
+    def test_invalidate(self):
+        self.cache.set('url', 'package', 'resource', 'anID')
+        self.cache.invalidate('url', 'package', 'resource')
+        self.assertIsNone(self.cache.get('url', 'package', 'resource'))
+
+    def test_fingerprint(self):
+        fields = [{'id': 'words', 'type': 'text'}]
+        self.assertEquals(
+            MetadataCache.fingerprint(fields, ['words']),
+            MetadataCache.fingerprint(list(fields), ['words'])
+        )
+        self.assertNotEquals(
+            MetadataCache.fingerprint(fields, ['words']),
+            MetadataCache.fingerprint(fields, None)
+        )
+
+
+class TestCachedLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(HERE, '../mock/first_test_settings.json')) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        self.ckan_config.update({
+            'metadata_cache': os.path.join(self.tmpdir, 'cache.db'),
+            'package_id': 'package', 'resource_name': 'resource',
+            'fields': [{'id': 'words', 'type': 'text'}],
+            'key_fields': ['words'],
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('requests.Session.post')
+    def test_resource_id_cached(self, post):
+        post.return_value = Mock(json=lambda: {
+            'result': {'resources': [{'name': 'resource', 'id': 'anID'}]}
+        })
+        CKANDatastoreLoader(**self.ckan_config)
+        loader = CKANDatastoreLoader(**self.ckan_config)
+        self.assertEquals(loader.resource_id, 'anID')
+        self.assertEquals(post.call_count, 1)
+
+    @patch('requests.Session.post')
+    def test_stale_resource_id_refreshed(self, post):
+        MetadataCache(self.ckan_config['metadata_cache']).set(
+            'localhost:9000/api/3/', 'package', 'resource', 'staleID'
+        )
+        loader = CKANDatastoreLoader(**self.ckan_config)
+        self.assertEquals(loader.resource_id, 'staleID')
+
+        post.return_value = Mock(json=lambda: {
+            'result': {'resources': [{'name': 'resource', 'id': 'freshID'}]}
+        })
+        type(post.return_value).status_code = PropertyMock(side_effect=[404, 200])
+        self.assertEquals(loader.upsert_chunk([{'words': 'a'}]), 200)
+        self.assertEquals(loader.resource_id, 'freshID')
+        self.assertEquals(
+            loader.metadata_cache.get('localhost:9000/api/3/', 'package', 'resource')[0],
+            'freshID'
+        )
+
+
+class TestRowHashStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'hashes.db')
+        self.store = RowHashStore(self.path)
+        self.records = [{'words': str(i), 'numbers': i} for i in range(3)]
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_changed_after_commit(self):
+        self.assertEquals(self.store.changed('url', 'anID', self.records, ['words']), self.records)
+        self.store.commit()
+        records = [dict(i) for i in self.records] + [{'words': '3', 'numbers': 3}]
+        records[1]['numbers'] = 10
+        self.assertEquals(
+            RowHashStore(self.path).changed('url', 'anID', records, ['words']),
+            [records[1], records[3]]
+        )
+
+    def test_rollback(self):
+        self.store.changed('url', 'anID', self.records, ['words'])
+        self.store.rollback()
+        self.store.commit()
+        self.assertEquals(self.store.changed('url', 'anID', self.records, ['words']), self.records)
+
+    def test_salt(self):
+        self.store.changed('url', 'anID', self.records, ['words'])
+        self.store.commit()
+        self.assertEquals(
+            self.store.changed('url', 'anID', self.records, ['words'], salt='new fields'),
+            self.records
+        )
+
+
+class TestDeltaLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(HERE, '../mock/first_test_settings.json')) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        self.ckan_config.update({
+            'row_hashes': os.path.join(self.tmpdir, 'hashes.db'),
+            'fields': [{'id': 'words', 'type': 'text'}, {'id': 'numbers', 'type': 'numeric'}],
+            'key_fields': ['words'],
+        })
+        self.records = [{'words': str(i), 'numbers': i} for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('requests.Session.post')
+    def load(self, records, post, status_code=200):
+        type(post.return_value).status_code = PropertyMock(return_value=status_code)
+        loader = CKANDatastoreLoader(**self.ckan_config)
+        loader.resource_id = 'anID'
+        upserted = []
+        loader.upsert = lambda resource_id, data, method: upserted.extend(data) or status_code
+        self.loader = loader
+        loader.load(records)
+        return upserted, loader.skipped_rows
+
+    def test_only_changed_rows_upserted(self):
+        self.assertEquals(self.load(self.records), (self.records, 0))
+        records = [dict(i) for i in self.records]
+        records[2]['numbers'] = 20
+        self.assertEquals(self.load(records), ([records[2]], 4))
+
+    def test_failed_load_not_saved(self):
+        with self.assertRaises(RuntimeError):
+            self.load(self.records, status_code=409)
+        self.assertEquals(self.load(self.records), (self.records, 0))
+
+    def test_store_closed_after_load(self):
+        self.load(self.records)
+        self.assertIsNone(self.loader.row_hashes._conn)
+        with self.assertRaises(RuntimeError):
+            self.load(self.records, status_code=409)
+        self.assertIsNone(self.loader.row_hashes._conn)
+
+    def test_requires_key_fields(self):
+        self.ckan_config.update({'key_fields': None, 'method': 'insert'})
+        with self.assertRaises(RuntimeError):
+            self.load(self.records)
@@ -1,11 +1,21 @@
 import os
 import io
+import bz2
+import gzip
+import lzma
+import shutil
+import hashlib
+import zlib
+import zipfile
+import tempfile
 import unittest
+import urllib.error
+import paramiko
 
 from io import TextIOBase, TextIOWrapper, StringIO
 
 import pipeline as pl
-from pipeline.connectors import Connector
+from pipeline.connectors import Connector, SFTPSessionPool, new_hash
 
 from unittest.mock import patch, PropertyMock, Mock
 
@@ -31,23 +41,254 @@ class TestCSVConnector(unittest.TestCase):
         self.connector.close()
         self.assertTrue(f.closed)
 
+    def test_checksum_from_extraction_read(self):
+        with open(self.path, 'rb') as f:
+            expected = hashlib.md5(f.read()).hexdigest()
+        f = self.connector.connect(self.path)
+        f.readline()
+        self.assertEquals(self.connector.checksum_contents(self.path), expected)
+        self.connector.close()
+
+    def test_checksum_before_read(self):
+        with open(self.path, 'rb') as f:
+            contents = f.read()
+        f = self.connector.connect(self.path)
+        self.assertEquals(
+            self.connector.checksum_contents(self.path),
+            hashlib.md5(contents).hexdigest()
+        )
+        self.assertEquals(f.read(), contents.decode('utf-8'))
+        self.connector.close()
+
+class TestHashAlgorithms(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(HERE, '../mock/simple_mock.csv')
+        with open(self.path, 'rb') as f:
+            self.contents = f.read()
+
+    def test_new_hash(self):
+        checksum = new_hash('crc32')
+        checksum.update(self.contents[:10])
+        checksum.update(self.contents[10:])
+        self.assertEquals(checksum.hexdigest(), '{:08x}'.format(zlib.crc32(self.contents)))
+        self.assertEquals(new_hash('blake2b').name, 'blake2b')
+        with self.assertRaises(ValueError):
+            new_hash('not_a_hash')
+
+    @patch('pipeline.connectors.xxhash', None)
+    def test_xxhash_missing(self):
+        with self.assertRaises(RuntimeError):
+            pl.FileConnector('', hash_algorithm='xxh3_64')
+
+    def test_connector_algorithm(self):
+        expected = hashlib.blake2b(self.contents).hexdigest()
+        for connector_class in (pl.FileConnector, pl.MmapFileConnector):
+            connector = connector_class('', hash_algorithm='blake2b', blocksize=16)
+            f = connector.connect(self.path)
+            f.readline()
+            self.assertEquals(connector.checksum_contents(self.path), expected)
+            connector.close()
+
+class TestMmapFileConnector(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(HERE, '../mock/simple_mock.csv')
+        self.connector = pl.MmapFileConnector('')
+        with open(self.path, 'rb') as f:
+            self.contents = f.read()
+
+    def test_connect(self):
+        f = self.connector.connect(self.path)
+        self.assertIsInstance(f, TextIOBase)
+        self.assertEquals(f.name, self.path)
+        self.assertEquals(f.read(), self.contents.decode('utf-8'))
+        self.connector.close()
+        self.assertTrue(f.closed)
+        self.assertTrue(self.connector._mapping.closed)
+
+    def test_checksum_does_not_move_reader(self):
+        f = self.connector.connect(self.path)
+        line = f.readline()
+        self.assertEquals(
+            self.connector.checksum_contents(self.path),
+            hashlib.md5(self.contents).hexdigest()
+        )
+        self.assertEquals(line + f.read(), self.contents.decode('utf-8'))
+        self.connector.close()
+
+    def test_binary(self):
+        connector = pl.MmapFileConnector('', encoding=None)
+        f = connector.connect(self.path)
+        self.assertEquals(f.read(), self.contents)
+        connector.close()
+
+    def test_empty_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'empty.csv')
+        open(path, 'wb').close()
+        f = self.connector.connect(path)
+        self.assertEquals(f.read(), '')
+        self.assertEquals(
+            self.connector.checksum_contents(path), hashlib.md5(b'').hexdigest()
+        )
+        self.connector.close()
+
+    def test_extract(self):
+        extractor = pl.CSVExtractor(self.connector.connect(self.path))
+        self.assertListEqual(extractor.schema_headers, ['one', 'two_words', 'trailing_spaces'])
+        self.assertEquals(next(extractor.process_connection()), ['1', '2', '1'])
+        self.connector.close()
+
+class TestCompressedFileConnector(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        with open(os.path.join(HERE, '../mock/simple_mock.csv'), 'rb') as f:
+            self.contents = f.read()
+
+    def write(self, name, opener):
+        path = os.path.join(self.dir, name)
+        with opener(path, 'wb') as f:
+            f.write(self.contents)
+        with open(path, 'rb') as f:
+            return path, hashlib.md5(f.read()).hexdigest()
+
+    def check(self, connector, path, checksum):
+        f = connector.connect(path)
+        self.assertEquals(f.read(), self.contents.decode('utf-8'))
+        self.assertEquals(connector.checksum_contents(path), checksum)
+        connector.close()
+        self.assertTrue(f.closed)
+
+    def test_by_extension(self):
+        for name, opener in [
+            ('mock.csv.gz', gzip.open), ('mock.csv.bz2', bz2.open), ('mock.csv.xz', lzma.open)
+        ]:
+            path, checksum = self.write(name, opener)
+            self.check(pl.FileConnector(''), path, checksum)
+            self.check(pl.MmapFileConnector(''), path, checksum)
+
+    def test_by_signature(self):
+        for name, opener in [('gz', gzip.open), ('bz', bz2.open), ('lz', lzma.open)]:
+            path, checksum = self.write(name, opener)
+            self.check(pl.FileConnector(''), path, checksum)
+
+    def test_compression_disabled(self):
+        path, checksum = self.write('mock.csv.gz', gzip.open)
+        f = pl.FileConnector('', encoding=None, compression=None).connect(path)
+        self.assertTrue(f.read().startswith(b'\x1f\x8b'))
+        f.close()
+
+    def test_zip_member(self):
+        path = os.path.join(self.dir, 'mock.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('readme.txt', 'not this one')
+            archive.writestr('data/mock.csv', self.contents)
+        with open(path, 'rb') as f:
+            checksum = hashlib.md5(f.read()).hexdigest()
+        self.check(pl.FileConnector('', zip_member='data/mock.csv'), path, checksum)
+        with self.assertRaises(RuntimeError):
+            pl.FileConnector('').connect(path)
+
+    def test_zip_not_seekable(self):
+        path = os.path.join(self.dir, 'mock.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('mock.csv', self.contents)
+        with open(path, 'rb') as f:
+            body = f.read()
+        raw = Mock(wraps=io.BytesIO(body))
+        raw.seekable.return_value = False
+        connector = pl.FileConnector('')
+        f = connector.wrap(raw, 'http://a.b/mock.zip')
+        self.assertEquals(f.read(), self.contents.decode('utf-8'))
+        self.assertEquals(connector.checksum_contents(''), hashlib.md5(body).hexdigest())
+        connector.close()
+
+    def test_xlsx_not_unzipped(self):
+        path = os.path.join(HERE, '../mock/excel_mock.xlsx')
+        connector = pl.FileConnector('', encoding=None)
+        with open(path, 'rb') as f:
+            self.assertEquals(connector.connect(path).read(), f.read())
+        connector.close()
+
+    def test_local_path(self):
+        path, _ = self.write('mock.csv.bz2', bz2.open)
+        connector = pl.FileConnector('')
+        self.assertIsNone(connector.connect(path).local_path)
+        connector.close()
+        plain = os.path.join(HERE, '../mock/simple_mock.csv')
+        self.assertEquals(connector.connect(plain).local_path, os.path.abspath(plain))
+        connector.close()
+
+    def test_extract_bz2_parallel(self):
+        path, _ = self.write('mock.csv.bz2', bz2.open)
+        connector = pl.FileConnector('')
+        extractor = pl.CSVExtractor(connector.connect(path), parse_workers=2)
+        self.assertListEqual(extractor.schema_headers, ['one', 'two_words', 'trailing_spaces'])
+        self.assertEquals(list(extractor.process_connection()), [['1', '2', '1'], ['3', '4', '1']])
+        connector.close()
+
+    def test_extract_gzip(self):
+        path, _ = self.write('mock.csv.gz', gzip.open)
+        connector = pl.FileConnector('')
+        extractor = pl.CSVExtractor(connector.connect(path), parse_workers=2)
+        self.assertListEqual(extractor.schema_headers, ['one', 'two_words', 'trailing_spaces'])
+        self.assertEquals(next(extractor.process_connection()), ['1', '2', '1'])
+        connector.close()
+
+class TestHashingReader(unittest.TestCase):
+    def test_non_seekable(self):
+        raw = Mock(wraps=io.BytesIO(b'a,b\n1,2\n'))
+        raw.seekable.return_value = False
+        reader = pl.HashingReader(raw, blocksize=2)
+        self.assertEquals(reader.read(3), b'a,b')
+        self.assertEquals(reader.hexdigest(), hashlib.md5(b'a,b\n1,2\n').hexdigest())
+        self.assertFalse(raw.seek.called)
+
+    def test_rewind_resets(self):
+        reader = pl.HashingReader(io.BytesIO(b'abcdef'))
+        reader.read(4)
+        reader.seek(0)
+        self.assertEquals(reader.read(), b'abcdef')
+        self.assertEquals(reader.hexdigest(), hashlib.md5(b'abcdef').hexdigest())
+
 class TestRemoteFileConnector(unittest.TestCase):
     def setUp(self):
         self.connector = pl.RemoteFileConnector('')
 
-    @patch('urllib.request.urlopen', return_value=StringIO())
+    @patch('urllib.request.urlopen', return_value=io.BytesIO())
     def test_remote_connection(self, urlopen):
         fileobj = self.connector.connect('')
         self.assertIsInstance(fileobj, TextIOWrapper)
         self.assertFalse(fileobj.closed)
 
-    @patch('urllib.request.urlopen', return_value=StringIO())
+    @patch('urllib.request.urlopen', return_value=io.BytesIO())
     def test_remote_close(self, urlopen):
         fileobj = self.connector.connect('')
         self.assertFalse(fileobj.closed)
         self.connector.close()
         self.assertTrue(fileobj.closed)
 
+    @patch('urllib.request.urlopen')
+    def test_conditional_request(self, urlopen):
+        urlopen.side_effect = urllib.error.HTTPError('http://a.b/c.csv', 304, '', {}, None)
+        self.connector.previous_validators = {'etag': '"abc"', 'last_modified': None}
+        with self.assertRaises(pl.NotModifiedException):
+            self.connector.connect('http://a.b/c.csv')
+        request = urlopen.call_args[0][0]
+        self.assertEquals(request.get_header('If-none-match'), '"abc"')
+
+    @patch('urllib.request.urlopen')
+    def test_validators_recorded(self, urlopen):
+        urlopen.return_value = Mock(
+            wraps=io.BytesIO(b''), status=200,
+            headers={'ETag': '"abc"', 'Content-Length': '0'}
+        )
+        self.connector.connect('http://a.b/c.csv')
+        self.assertEquals(self.connector.validators, {
+            'etag': '"abc"', 'last_modified': None, 'content_length': 0
+        })
+
 class TestHTTPConnector(unittest.TestCase):
     def setUp(self):
         self.connector = pl.HTTPConnector('')
@@ -78,9 +319,24 @@ class TestHTTPConnector(unittest.TestCase):
             'woohoo!'
         )
 
+    @patch('requests.get')
+    def test_not_modified(self, get):
+        type(get.return_value).status_code = PropertyMock(return_value=304)
+        self.connector.previous_validators = {'last_modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        with self.assertRaises(pl.NotModifiedException):
+            self.connector.connect(None)
+        self.assertEquals(
+            get.call_args[1]['headers'],
+            {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        )
+
     def test_http_connector_close(self):
         self.assertTrue(self.connector.close())
 
+class FakeSFTPFile(io.BytesIO):
+    def prefetch(self, file_size=None):
+        self.prefetched = file_size
+
 class TestSFTPConnector(unittest.TestCase):
     def setUp(self):
         self.connector = pl.SFTPConnector(**{
@@ -130,6 +386,22 @@ class TestSFTPConnector(unittest.TestCase):
         SFTPClient.from_transport().open.side_effect = IOError()
         with self.assertRaises(IOError):
             self.connector.connect('')
+        self.assertTrue(SFTPClient.from_transport().close.called)
+        self.assertTrue(Transport.return_value.close.called)
+
+    @patch('pipeline.connectors.sftp_pool', new_callable=SFTPSessionPool)
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_failed_pooled_session_discarded(self, Transport, SFTPClient, sftp_pool):
+        SFTPClient.from_transport.return_value.stat.side_effect = PermissionError()
+        connector = pl.SFTPConnector(host='host', username='user', pool=True)
+        with self.assertRaises(PermissionError):
+            connector.connect('myfile.txt')
+        self.assertTrue(Transport.return_value.close.called)
+        self.assertFalse(any(sftp_pool._sessions.values()))
+        # closing the connector afterwards doesn't return the session either
+        connector.close()
+        self.assertFalse(any(sftp_pool._sessions.values()))
 
     @patch('pipeline.connectors.paramiko.SFTPClient')
     @patch('pipeline.connectors.paramiko.Transport')
@@ -144,3 +416,98 @@ class TestSFTPConnector(unittest.TestCase):
         self.assertTrue(self.connector.conn.close.called)
         self.assertTrue(self.connector.transport.close.called)
         self.assertTrue(self.connector._file.closed)
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_connector_streams_with_prefetch(self, Transport, SFTPClient):
+        client = SFTPClient.from_transport.return_value
+        client.stat.return_value = Mock(st_size=4, st_mtime=1000.5)
+        client.open.return_value = FakeSFTPFile(b'a,b\n')
+        f = self.connector.connect('myfile.txt')
+        self.assertEquals(client.open.return_value.prefetched, 4)
+        self.assertEquals(f.read(), 'a,b\n')
+        self.assertEquals(self.connector.validators, {
+            'etag': None, 'last_modified': '1000', 'content_length': 4
+        })
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_unchanged_file_skipped(self, Transport, SFTPClient):
+        client = SFTPClient.from_transport.return_value
+        client.stat.return_value = Mock(st_size=4, st_mtime=1000.5)
+        self.connector.previous_validators = {
+            'etag': None, 'last_modified': '1000', 'content_length': 4
+        }
+        with self.assertRaises(pl.NotModifiedException):
+            self.connector.connect('myfile.txt')
+        self.assertFalse(client.open.called)
+        self.assertTrue(client.close.called)
+        self.assertTrue(Transport.return_value.close.called)
+
+class TestSFTPSessionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = SFTPSessionPool()
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_session_reused(self, Transport, SFTPClient):
+        transport, client = self.pool.acquire('host', 22, 'user', 'pass')
+        self.pool.release('host', 22, 'user', 'pass', transport, client)
+        self.assertEquals(self.pool.acquire('host', 22, 'user', 'pass'), (transport, client))
+        self.assertEquals(Transport.call_count, 1)
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_unhealthy_session_replaced(self, Transport, SFTPClient):
+        transport, client = self.pool.acquire('host', 22, 'user', 'pass')
+        self.pool.release('host', 22, 'user', 'pass', transport, client)
+        transport.is_active.return_value = False
+        self.pool.acquire('host', 22, 'user', 'pass')
+        self.assertEquals(Transport.call_count, 2)
+        self.assertTrue(transport.close.called)
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_idle_session_evicted(self, Transport, SFTPClient):
+        transport, client = self.pool.acquire('host', 22, 'user', 'pass')
+        self.pool.release('host', 22, 'user', 'pass', transport, client, idle_timeout=-1)
+        self.assertTrue(transport.close.called)
+        self.assertEquals(self.pool._sessions[SFTPSessionPool.key('host', 22, 'user', 'pass')], [])
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_sessions_keyed_by_password(self, Transport, SFTPClient):
+        transport, client = self.pool.acquire('host', 22, 'user', 'pass')
+        self.pool.release('host', 22, 'user', 'pass', transport, client)
+        self.pool.acquire('host', 22, 'user', 'other')
+        self.assertEquals(Transport.call_count, 2)
+        self.assertNotIn('pass', repr(self.pool._sessions))
+
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_health_checked_without_lock(self, Transport, SFTPClient):
+        transport, client = self.pool.acquire('host', 22, 'user', 'pass')
+        self.pool.release('host', 22, 'user', 'pass', transport, client)
+        locked = []
+        client.normalize.side_effect = lambda path: locked.append(self.pool._lock.locked())
+        self.pool.acquire('host', 22, 'user', 'pass')
+        self.assertEquals(locked, [False])
+
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_transport_closed_on_failed_connect(self, Transport):
+        Transport.return_value.connect.side_effect = paramiko.AuthenticationException
+        with self.assertRaises(paramiko.AuthenticationException):
+            self.pool.acquire('host', 22, 'user', 'pass')
+        self.assertTrue(Transport.return_value.close.called)
+
+    @patch('pipeline.connectors.sftp_pool', new_callable=SFTPSessionPool)
+    @patch('pipeline.connectors.paramiko.SFTPClient')
+    @patch('pipeline.connectors.paramiko.Transport')
+    def test_pooled_connectors(self, Transport, SFTPClient, sftp_pool):
+        SFTPClient.from_transport.return_value.open.side_effect = lambda *args: FakeSFTPFile(b'')
+        for _ in range(2):
+            connector = pl.SFTPConnector(host='host', username='user', pool=True)
+            connector.connect('myfile.txt')
+            connector.close()
+        self.assertEquals(Transport.call_count, 1)
+        self.assertFalse(Transport.return_value.close.called)
@@ -1,9 +1,16 @@
 import os
 import csv
 import xlrd
+import pickle
+import shutil
+import hashlib
+import tempfile
+import datetime
 import unittest
+from unittest.mock import patch
 
 import pipeline as pl
+from pipeline.extractors import Row, header_end, split_records, parse_range, ascii_compatible
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -97,3 +104,165 @@ class TestExcelExtractor(unittest.TestCase):
             {'one': 1, 'two': 'a', 'three_things': 'ccc', 'trailing_spaces': 123}
         )
 
+    def test_workbook_opened_once(self):
+        workbook = self.extractor.workbook
+        self.assertIsNotNone(workbook)
+        rows = self.extractor.process_connection()
+        next(rows)
+        self.assertIs(self.extractor.workbook, workbook)
+        with patch.object(workbook, 'close', wraps=workbook.close) as close:
+            self.assertEquals(len(list(rows)), 2)
+        close.assert_called_once_with()
+        self.assertIsNone(self.extractor.workbook)
+
+class TestXLSExtractor(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(HERE, '../mock/excel_mock.xls')
+        self.conn = pl.FileConnector('', encoding=None)
+        self.extractor = pl.ExcelExtractor(self.conn.connect(self.path))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_initialization(self):
+        self.assertListEqual(self.extractor.schema_headers, ['one', 'two', 'three_things', 'trailing_spaces'])
+        self.assertEquals(self.extractor.datemode, 0)
+
+    def test_extract_lines(self):
+        lines = self.extractor.process_connection()
+        with self.assertRaises(pl.IsHeaderException):
+            self.extractor.handle_line(next(lines))
+        self.assertEquals(
+            self.extractor.handle_line(next(lines)),
+            {'one': 1, 'two': 'a', 'three_things': 'ccc', 'trailing_spaces': 123}
+        )
+        self.assertEquals(
+            self.extractor.handle_line(next(lines)),
+            {'one': 2, 'two': 'b', 'three_things': '01/02/2016', 'trailing_spaces': None}
+        )
+        with self.assertRaises(StopIteration):
+            next(lines)
+
+    def test_date_format(self):
+        extractor = pl.ExcelExtractor(self.conn.connect(self.path), date_format='%Y-%m-%d')
+        self.assertEquals(list(extractor.process_connection())[2][2], '2016-01-02')
+
+    def test_native_dates(self):
+        extractor = pl.ExcelExtractor(self.conn.connect(self.path), native_dates=True)
+        self.assertEquals(list(extractor.process_connection())[2][2], datetime.datetime(2016, 1, 2))
+
+    def test_workbook_released(self):
+        workbook = self.extractor.workbook
+        with patch.object(workbook, 'release_resources', wraps=workbook.release_resources) as release:
+            self.assertEquals(len(list(self.extractor.process_connection())), 3)
+        release.assert_called_once_with()
+        self.assertIsNone(self.extractor.workbook)
+        # read again, from a freshly opened workbook
+        self.assertEquals(len(list(self.extractor.process_connection())), 3)
+
+class TestCompactRows(unittest.TestCase):
+    def test_row(self):
+        row = Row({'one': 0, 'two': 1, 'three': 2}, ['1', ''])
+        self.assertEquals(row, {'one': '1', 'two': None})
+        self.assertEquals(row.get('three', 'default'), 'default')
+        self.assertEquals(row.get('four'), None)
+        with self.assertRaises(KeyError):
+            row['three']
+        self.assertEquals(pickle.loads(pickle.dumps(row)), row)
+
+    def test_extract_rows_csv(self):
+        conn = pl.FileConnector('')
+        extractor = pl.CSVExtractor(
+            conn.connect(os.path.join(HERE, '../mock/simple_mock.csv')),
+            compact_rows=True
+        )
+        rows = list(extractor.extract_rows(extractor.process_connection()))
+        conn.close()
+        self.assertEquals(rows, [
+            {'one': '1', 'two_words': '2', 'trailing_spaces': '1'},
+            {'one': '3', 'two_words': '4', 'trailing_spaces': '1'}
+        ])
+
+    def test_extract_rows_excel(self):
+        conn = pl.FileConnector('', encoding=None)
+        extractor = pl.ExcelExtractor(
+            conn.connect(os.path.join(HERE, '../mock/excel_mock.xlsx')),
+            compact_rows=True
+        )
+        rows = list(extractor.extract_rows(extractor.process_connection()))
+        conn.close()
+        self.assertEquals(len(rows), 2)
+        self.assertEquals(rows[0], {'one': 1, 'two': 'a', 'three_things': 'ccc', 'trailing_spaces': 123})
+
+class TestParallelCSVExtractor(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'parallel.csv')
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'Notes "quoted"'])
+            for i in range(500):
+                notes = 'line one\nline "two",\n' if i % 7 == 0 else 'plain'
+                writer.writerow([i, notes])
+        self.conn = pl.FileConnector('')
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_split_records_quote_aware(self):
+        start = header_end(self.path)
+        ranges = split_records(self.path, start, 100, blocksize=64)
+        self.assertGreater(len(ranges), 10)
+        self.assertEquals(ranges[0][0], start)
+        self.assertEquals(ranges[-1][1], os.path.getsize(self.path))
+        rows = []
+        for range_start, range_end in ranges:
+            rows.extend(parse_range(self.path, range_start, range_end))
+        with open(self.path, newline='') as f:
+            self.assertEquals(rows, list(csv.reader(f))[1:])
+
+    def test_parallel_matches_sequential(self):
+        sequential = pl.CSVExtractor(self.conn.connect(self.path))
+        expected = list(sequential.process_connection())
+        self.conn.close()
+        self.addCleanup(self.conn.close)
+        extractor = pl.CSVExtractor(
+            self.conn.connect(self.path), parse_workers=2, range_size=256
+        )
+        self.assertListEqual(extractor.schema_headers, ['id', 'notes_"quoted"'])
+        self.assertEquals(list(extractor.process_connection()), expected)
+        self.assertEquals(len(expected), 500)
+
+    def test_parallel_keeps_checksum(self):
+        with open(self.path, 'rb') as f:
+            expected = hashlib.md5(f.read()).hexdigest()
+        self.addCleanup(self.conn.close)
+        extractor = pl.CSVExtractor(
+            self.conn.connect(self.path), parse_workers=2, range_size=256
+        )
+        list(extractor.process_connection())
+        self.assertEquals(self.conn.checksum_contents(self.path), expected)
+
+    def test_parallel_crlf_matches_sequential(self):
+        path = os.path.join(self.dir, 'crlf.csv')
+        with open(path, 'wb') as f:
+            f.write(b'a,b\r\n' + b''.join(
+                '{},"x\r\ny{}"\r\n{},z\r\n'.format(i, i, i + 1).encode('ascii') for i in range(0, 200, 2)
+            ))
+        sequential = pl.CSVExtractor(self.conn.connect(path))
+        expected = list(sequential.process_connection())
+        self.conn.close()
+        self.addCleanup(self.conn.close)
+        extractor = pl.CSVExtractor(self.conn.connect(path), parse_workers=2, range_size=64)
+        self.assertEquals(expected[0], ['0', 'x\ny0'])
+        self.assertEquals(list(extractor.process_connection()), expected)
+
+    def test_parallel_refuses_utf16(self):
+        path = os.path.join(self.dir, 'utf16.csv')
+        with open(path, 'w', encoding='utf-16') as f:
+            f.write('a,b\n1,2\n')
+        connector = pl.FileConnector('', encoding='utf-16')
+        self.addCleanup(connector.close)
+        with self.assertRaises(RuntimeError):
+            pl.CSVExtractor(connector.connect(path), parse_workers=2)
+        self.assertTrue(ascii_compatible('utf-8-sig'))
+        self.assertTrue(ascii_compatible('latin-1'))
+        self.assertFalse(ascii_compatible('utf-32'))
@@ -25,7 +25,7 @@ class TestCKANDatastoreBase(unittest.TestCase):
 
 class TestCKANDatastore(TestCKANDatastoreBase):
     def setUp(self):
-        patcher = patch('requests.post')
+        patcher = patch('requests.Session.post')
         mock_post = patcher.start()
         mock_post.json.side_effect = [
             {'id': {'someNumber': []}},
@@ -34,12 +34,18 @@ class TestCKANDatastore(TestCKANDatastoreBase):
         self.ckan_loader = CKANLoader(**self.ckan_config)
         patcher.stop()
 
+    def test_session_shared(self):
+        with patch('requests.Session.post'):
+            other = CKANLoader(**self.ckan_config)
+        self.assertIs(other.session, self.ckan_loader.session)
+        self.assertEquals(other.session.headers['authorization'], 'FUN FUN FUN')
+
     def test_datapusher_init(self):
         self.assertIsNotNone(self.ckan_loader)
         self.assertEquals(self.ckan_loader.ckan_url, 'localhost:9000/api/3/')
         self.assertEquals(self.ckan_loader.dump_url, 'localhost:9000/datastore/dump/')
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_get_resource_id(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -53,7 +59,7 @@ class TestCKANDatastore(TestCKANDatastoreBase):
         self.assertIsNone(self.ckan_loader.get_resource_id(None, 'exists'))
         self.assertEqual(self.ckan_loader.get_resource_id(None, 'exists'), 'anID')
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_resource_exists(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -67,7 +73,7 @@ class TestCKANDatastore(TestCKANDatastoreBase):
         self.assertFalse(self.ckan_loader.resource_exists(None, 'exists'))
         self.assertTrue(self.ckan_loader.resource_exists(None, 'exists'))
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_create_resource(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -80,7 +86,7 @@ class TestCKANDatastore(TestCKANDatastoreBase):
         with self.assertRaises(CKANException):
             self.ckan_loader.create_resource(None, None)
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_create_datastore(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -93,7 +99,7 @@ class TestCKANDatastore(TestCKANDatastoreBase):
         with self.assertRaises(CKANException):
             self.ckan_loader.create_datastore(None, [])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_generate_datastore(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -104,17 +110,17 @@ class TestCKANDatastore(TestCKANDatastoreBase):
 
         self.assertEquals(self.ckan_loader.generate_datastore([]), 1)
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_delete_datastore(self, post):
         type(post.return_value).status_code = PropertyMock(return_value=204)
         self.assertEquals(self.ckan_loader.delete_datastore(None), 204)
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_upsert(self, post):
         type(post.return_value).status_code = PropertyMock(return_value=200)
         self.assertEquals(self.ckan_loader.upsert(None, None), 200)
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_update_metadata(self, post):
         type(post.return_value).status_code = PropertyMock(return_value=200)
         self.assertEquals(self.ckan_loader.update_metadata(None), 200)
@@ -122,7 +128,7 @@ class TestCKANDatastore(TestCKANDatastoreBase):
 
 class TestCKANDatastoreLoader(TestCKANDatastoreBase):
     def setUp(self):
-        patcher = patch('requests.post')
+        patcher = patch('requests.Session.post')
         mock_post = patcher.start()
         mock_post.json.side_effect = [
             {'id': {'someNumber': []}},
@@ -152,7 +158,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         self.error_codes = [409, 500]
         patcher.stop()
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_loader_no_fields(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -161,7 +167,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         with self.assertRaises(RuntimeError):
             pl.CKANDatastoreLoader(**self.ckan_config)
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load__insert_successful(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -171,7 +177,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         post.return_value = mock_post
         self.insert_loader.load([])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load_insert_failed(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -188,7 +194,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
             with self.assertRaises(RuntimeError):
                 self.insert_loader.load([])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load__upsert_successful(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -198,7 +204,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         post.return_value = mock_post
         self.upsert_loader.load([])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load_upsert_failed(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -215,7 +221,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
             with self.assertRaises(RuntimeError):
                 self.upsert_loader.load([])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load_insert_update_metadata_failed(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -229,7 +235,7 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
             with self.assertRaises(RuntimeError):
                 self.insert_loader.load([])
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_datastore_load_upsert_update_metadata_failed(self, post):
         mock_post = Mock()
         mock_post.json.side_effect = [
@@ -241,4 +247,96 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         for error in self.error_codes:
             type(post.return_value).status_code = PropertyMock(return_value=error)
             with self.assertRaises(RuntimeError):
-                self.upsert_loader.load([])
\ No newline at end of file
+                self.upsert_loader.load([])
+    def test_chunk_records_by_size(self):
+        self.upsert_loader.chunk_size = 2
+        chunks = list(self.upsert_loader.chunk_records(
+            [{'words': str(i), 'numbers': i} for i in range(5)]
+        ))
+        self.assertEquals([len(i) for i in chunks], [2, 2, 1])
+
+    def test_chunk_records_by_bytes(self):
+        self.upsert_loader.chunk_bytes = 60
+        records = [{'words': str(i), 'numbers': i} for i in range(5)]
+        chunks = list(self.upsert_loader.chunk_records(records))
+        self.assertEquals(sum(chunks, []), records)
+        for chunk in chunks:
+            self.assertLessEqual(len(json.dumps(chunk)), 60)
+
+    @patch('requests.Session.post')
+    def test_datastore_load_chunked(self, post):
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.chunk_size = 2
+        self.upsert_loader.load([{'words': str(i), 'numbers': i} for i in range(5)])
+        upserts = [i for i in post.call_args_list if i[0][0].endswith('datastore_upsert')]
+        self.assertEquals(len(upserts), 3)
+
+    @patch('requests.Session.post')
+    def test_datastore_load_chunk_retried(self, post):
+        type(post.return_value).status_code = PropertyMock(side_effect=[502, 200, 200])
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.chunk_retries = 1
+        self.upsert_loader.retry_backoff = 0
+        self.assertEquals(
+            self.upsert_loader.load([{'words': 'a', 'numbers': 1}]),
+            (200, 200)
+        )
+
+    def test_partition_records_by_key(self):
+        self.upsert_loader.concurrency = 3
+        records = [{'words': str(i % 4), 'numbers': i} for i in range(12)]
+        partitions = self.upsert_loader.partition_records(records)
+        self.assertEquals(len(partitions), 3)
+        for word in set(i['words'] for i in records):
+            self.assertEquals(
+                len([p for p in partitions if any(i['words'] == word for i in p)]), 1
+            )
+
+    @patch('requests.Session.post')
+    def test_datastore_load_concurrent(self, post):
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        upserted = []
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.chunk_size = 2
+        self.upsert_loader.concurrency = 3
+        self.upsert_loader.upsert = lambda resource_id, data, method: upserted.extend(data) or 200
+        records = [{'words': str(i), 'numbers': i} for i in range(10)]
+        self.assertEquals(self.upsert_loader.load(records), (200, 200))
+        self.assertEquals(sorted(upserted, key=lambda i: i['numbers']), records)
+
+    @patch('requests.Session.post')
+    def test_datastore_load_concurrent_failed(self, post):
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.concurrency = 2
+        self.upsert_loader.upsert = lambda resource_id, data, method: 409
+        with self.assertRaises(RuntimeError):
+            self.upsert_loader.load([{'words': str(i), 'numbers': i} for i in range(4)])
+
+    @patch('requests.Session.post')
+    def test_datastore_load_resumed(self, post):
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        upserted, checkpoints = [], []
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.chunk_size = 2
+        self.upsert_loader.resume_from = 3
+        self.upsert_loader.checkpoint = checkpoints.append
+        self.upsert_loader.upsert = lambda resource_id, data, method: upserted.extend(data) or 200
+        records = [{'words': str(i), 'numbers': i} for i in range(8)]
+        self.upsert_loader.load_batches([records[:4], records[4:]])
+        self.assertEquals(upserted, records[3:])
+        self.assertEquals(checkpoints, [4, 6, 8])
+
+    @patch('requests.Session.post')
+    def test_datastore_load_checkpoint_stops_on_failure(self, post):
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        checkpoints = []
+        self.upsert_loader.resource_id = 1
+        self.upsert_loader.chunk_size = 2
+        self.upsert_loader.checkpoint = checkpoints.append
+        statuses = iter([200, 502])
+        self.upsert_loader.upsert = lambda resource_id, data, method: next(statuses)
+        with self.assertRaises(RuntimeError):
+            self.upsert_loader.load([{'words': str(i), 'numbers': i} for i in range(4)])
+        self.assertEquals(checkpoints, [2])
@@ -0,0 +1,93 @@
+import time
+import unittest
+
+import requests
+
+import pipeline as pl
+from pipeline.exceptions import CKANException
+from pipeline.mock_ckan import MockCKAN, MockCKANServer, Throttle
+
+FIELDS = [{'id': 'id', 'type': 'int'}, {'id': 'name', 'type': 'text'}]
+
+class TestMockCKAN(unittest.TestCase):
+    def setUp(self):
+        self.ckan = MockCKAN(seed=1)
+        self.server = MockCKANServer(self.ckan).start()
+        self.addCleanup(self.server.stop)
+
+    def loader(self, **kwargs):
+        options = dict(
+            ckan_root_url=self.server.url, ckan_api_key='key',
+            package_id='package', resource_name='resource',
+            fields=FIELDS, key_fields=['id'], session=requests.Session()
+        )
+        options.update(kwargs)
+        return pl.CKANDatastoreLoader(**options)
+
+    def records(self, count, name='a'):
+        return [{'id': i, 'name': name} for i in range(count)]
+
+    def test_load(self):
+        upsert_status, update_status = self.loader(chunk_size=10).load(self.records(25))
+        self.assertEquals((upsert_status, update_status), (200, 200))
+        resource_id = self.ckan.packages['package'][0]['id']
+        self.assertEquals(self.ckan.records(resource_id), self.records(25))
+        self.assertEquals(self.ckan.stats['requests']['datastore_upsert'], 3)
+        self.assertEquals(self.ckan.stats['records'], 25)
+
+    def test_upsert_replaces_by_primary_key(self):
+        self.loader().load(self.records(5))
+        self.loader(concurrency=2, chunk_size=2).load(self.records(8, name='b'))
+        resource_id = self.ckan.packages['package'][0]['id']
+        self.assertEquals(
+            sorted(self.ckan.records(resource_id), key=lambda i: i['id']), self.records(8, name='b')
+        )
+        self.assertEquals(self.ckan.stats['requests']['resource_create'], 1)
+
+    def test_insert_duplicate_key(self):
+        self.loader().load(self.records(3))
+        with self.assertRaises(RuntimeError):
+            self.loader(method='insert').load(self.records(3))
+
+    def test_max_payload(self):
+        self.ckan.max_payload = 300
+        with self.assertRaises(RuntimeError):
+            self.loader().load(self.records(50))
+        self.loader(chunk_bytes=100).load(self.records(50))
+        self.assertEquals(self.ckan.stats['records'], 50)
+
+    def test_injected_errors(self):
+        self.ckan.fail_next('datastore_upsert', 503, count=2)
+        loader = self.loader(chunk_retries=2, retry_backoff=0)
+        self.assertEquals(loader.load(self.records(5))[0], 200)
+        self.assertEquals(self.ckan.stats['errors']['datastore_upsert'], 2)
+        self.assertEquals(self.ckan.stats['requests']['datastore_upsert'], 3)
+
+    def test_create_conflict(self):
+        self.ckan.fail_next('datastore_create', 409)
+        with self.assertRaises(CKANException):
+            self.loader().load(self.records(5))
+
+    def test_error_rate(self):
+        self.ckan.error_rate = 1
+        with self.assertRaises(RuntimeError):
+            self.loader().load(self.records(5))
+
+    def test_latency(self):
+        self.ckan.latency = 0.05
+        start = time.monotonic()
+        self.loader().load(self.records(5))
+        # package_show, resource_create, datastore_create, upsert, patch
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_unknown_action(self):
+        response = requests.post(self.server.url + 'api/3/action/nope', data='{}')
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+class TestThrottle(unittest.TestCase):
+    def test_reserve(self):
+        throttle = Throttle(100)
+        self.assertAlmostEqual(throttle.reserve(50), 0.5, places=2)
+        self.assertAlmostEqual(throttle.reserve(50), 1.0, places=2)
+        self.assertEquals(Throttle().reserve(50), 0)
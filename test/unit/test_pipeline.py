@@ -1,8 +1,14 @@
 import unittest
 
+import io
 import os
+import gzip
+import hashlib
 import pipeline as pl
-from test.base import TestLoader, TestBase, TestSchema
+from unittest.mock import patch
+from marshmallow import fields
+from pipeline.pipeline import validate_batch, _worker_schemas
+from test.base import TestLoader, TestBase, TestSchema, TestConnector, TestExtractor
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -104,3 +110,332 @@ class TestStatusLogging(TestBase):
 
         status = self.cur.execute('select * from status').fetchall()
         self.assertEquals(len(status), 1)
+
+    def test_checksum_algorithm_recorded(self):
+        def build(algorithm):
+            return pl.Pipeline(
+                'fatal_od_pipeline', 'Fatal OD Pipeline',
+                settings_file=self.settings_file,
+                log_status=True, conn=self.conn
+            ) \
+                .connect(
+                    pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv'),
+                    hash_algorithm=algorithm
+                ) \
+                .extract(pl.CSVExtractor, firstline_headers=True) \
+                .schema(TestSchema) \
+                .load(self.Loader)
+
+        build('md5').run()
+        # a different algorithm can't be compared, so the input is reprocessed
+        build('blake2b').run()
+        with self.assertRaises(pl.DuplicateFileException):
+            build('blake2b').run()
+
+        status = self.cur.execute(
+            'select checksum_algorithm from status order by last_ran'
+        ).fetchall()
+        self.assertEquals(status, [('md5',), ('blake2b',)])
+
+class BatchRecordingLoader(TestLoader):
+    batches = []
+
+    def load_batches(self, batches):
+        for batch in batches:
+            BatchRecordingLoader.batches.append(batch)
+
+class NoSuperLoader(TestLoader):
+    loaded = []
+
+    def __init__(self, *args, **kwargs):
+        self.target = kwargs.get('target')
+
+    def load(self, data):
+        NoSuperLoader.loaded.extend(data)
+
+class TestStreaming(TestBase):
+    def setUp(self):
+        super(TestStreaming, self).setUp()
+        BatchRecordingLoader.batches = []
+
+    def test_streaming_batches(self):
+        pipeline = pl.Pipeline(
+            'streaming_pipeline', 'Streaming Pipeline',
+            settings_file=self.settings_file,
+            log_status=True, conn=self.conn,
+            streaming=True, batch_size=1
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema) \
+            .load(BatchRecordingLoader)
+
+        pipeline.run()
+
+        self.assertEquals(len(BatchRecordingLoader.batches), 2)
+        self.assertTrue(all(len(i) == 1 for i in BatchRecordingLoader.batches))
+        self.assertEquals(pipeline.data, [])
+
+        num_lines = self.cur.execute('select num_lines from status').fetchone()[0]
+        self.assertEquals(num_lines, 2)
+
+    def test_loader_without_super_init(self):
+        NoSuperLoader.loaded = []
+        pl.Pipeline(
+            'streaming_pipeline', 'Streaming Pipeline',
+            settings_file=self.settings_file,
+            log_status=False, streaming=True
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema) \
+            .load(NoSuperLoader) \
+            .run()
+        self.assertEquals(len(NoSuperLoader.loaded), 2)
+
+    @patch('urllib.request.urlopen')
+    def test_streaming_remote_gzip(self, urlopen):
+        with open(os.path.join(HERE, '../mock/simple_mock.csv'), 'rb') as f:
+            data = gzip.compress(f.read())
+        urlopen.return_value = UnseekableBytesIO(data)
+        pl.Pipeline(
+            'streaming_pipeline', 'Streaming Pipeline',
+            settings_file=self.settings_file,
+            log_status=True, conn=self.conn, streaming=True, batch_size=1
+        ) \
+            .connect(pl.RemoteFileConnector, 'http://a.b/simple_mock.csv.gz') \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema) \
+            .load(BatchRecordingLoader) \
+            .run()
+
+        self.assertEquals(len(BatchRecordingLoader.batches), 2)
+        checksum = self.cur.execute('select input_checksum from status').fetchone()[0]
+        self.assertEquals(checksum, hashlib.md5(data).hexdigest())
+
+    def test_streaming_duplicate_prevention(self):
+        pipeline = pl.Pipeline(
+            'streaming_pipeline', 'Streaming Pipeline',
+            settings_file=self.settings_file,
+            log_status=True, conn=self.conn, streaming=True
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema) \
+            .load(BatchRecordingLoader)
+
+        pipeline.run()
+        self.assertEquals(len(BatchRecordingLoader.batches), 1)
+
+        with self.assertRaises(pl.DuplicateFileException):
+            pipeline.run()
+
+        self.assertEquals(len(BatchRecordingLoader.batches), 1)
+        status = self.cur.execute('select * from status').fetchall()
+        self.assertEquals(len(status), 1)
+
+class UnseekableBytesIO(io.BytesIO):
+    def seekable(self):
+        return False
+
+class ValidatingConnector(TestConnector):
+    def connect(self, target):
+        if self.previous_validators.get('etag') == 'same':
+            raise pl.NotModifiedException
+        self.validators = {'etag': 'same'}
+        return []
+
+class TestConditionalRequests(TestBase):
+    def test_validators_round_trip(self):
+        pipeline = pl.Pipeline(
+            'conditional_pipeline', 'Conditional Pipeline',
+            settings_file=self.settings_file,
+            log_status=True, conn=self.conn
+        ) \
+            .connect(ValidatingConnector, 'http://a.b/c.csv') \
+            .extract(TestExtractor) \
+            .schema(TestSchema) \
+            .load(self.Loader)
+
+        pipeline.run()
+        with self.assertRaises(pl.NotModifiedException):
+            pipeline.run()
+
+        status = self.cur.execute('select status from status').fetchall()
+        self.assertEquals(status, [('success',)])
+
+class TestReentrantPipeline(TestBase):
+    def test_run_twice(self):
+        pipeline = pl.Pipeline(
+            'reentrant_pipeline', 'Reentrant Pipeline',
+            settings_file=self.settings_file, log_status=False
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema) \
+            .load(self.Loader)
+
+        pipeline.run()
+        self.assertEquals(len(pipeline.data), 2)
+        pipeline.run()
+        self.assertEquals(len(pipeline.data), 2)
+        self.assertEquals(pipeline.num_lines, 2)
+
+        pipeline.reset()
+        self.assertEquals(pipeline.data, [])
+
+class TestCompiledSchema(TestBase):
+    def build_pipeline(self, compiled):
+        return pl.Pipeline(
+            'compiled_pipeline', 'Compiled Pipeline',
+            settings_file=self.settings_file, log_status=False
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(TestSchema, compiled=compiled) \
+            .load(self.Loader)
+
+    def test_compiled_matches_uncompiled(self):
+        compiled = self.build_pipeline(True).run()
+        uncompiled = self.build_pipeline(False).run()
+        self.assertEquals(len(compiled.data), 2)
+        self.assertEquals(compiled.data, uncompiled.data)
+
+class RowsExtractor(TestExtractor):
+    rows = [{'age': str(i)} for i in range(5)] + [{'age': 'old'}]
+
+    def process_connection(self):
+        return ['header'] + self.rows
+
+    def handle_line(self, line):
+        if line == 'header':
+            raise pl.IsHeaderException
+        return line
+
+class TestBatchedValidation(TestBase):
+    def build_pipeline(self, **kwargs):
+        return pl.Pipeline(
+            'batched_pipeline', 'Batched Pipeline',
+            settings_file=self.settings_file, log_status=False, **kwargs
+        ) \
+            .connect(TestConnector, None) \
+            .extract(RowsExtractor) \
+            .schema(TestSchema) \
+            .load(self.Loader)
+
+    def test_batches_match_single_rows(self):
+        RowsExtractor.rows = [{'age': str(i)} for i in range(5)]
+        batched = self.build_pipeline(validation_batch_size=2).run()
+        single = self.build_pipeline().run()
+        self.assertEquals(batched.data, single.data)
+        self.assertEquals(batched.data, [{'age': i} for i in range(5)])
+
+    def test_errors_report_row_index(self):
+        RowsExtractor.rows = [{'age': str(i)} for i in range(5)] + [{'age': 'old'}]
+        with self.assertRaisesRegex(RuntimeError, r"{5: {'age': \['Not a valid integer.'\]}}"):
+            self.build_pipeline(validation_batch_size=2).run()
+
+    def test_parallel_matches_single_rows(self):
+        RowsExtractor.rows = [{'age': str(i)} for i in range(25)]
+        parallel = self.build_pipeline(validation_workers=2, validation_batch_size=3).run()
+        single = self.build_pipeline().run()
+        self.assertEquals(parallel.data, single.data)
+        self.assertEquals(parallel.num_lines, 25)
+
+    def test_parallel_errors_report_row_index(self):
+        RowsExtractor.rows = [{'age': str(i)} for i in range(5)] + [{'age': 'old'}]
+        with self.assertRaisesRegex(RuntimeError, r"{5: {'age': \['Not a valid integer.'\]}}"):
+            self.build_pipeline(validation_workers=2, validation_batch_size=2).run()
+
+    def test_worker_schema_instantiated_once(self):
+        _worker_schemas.clear()
+        self.assertEquals(validate_batch(TestSchema, True, [{'age': '1'}]), ([{'age': 1}], {}))
+        schema = _worker_schemas[(TestSchema, True)]
+        validate_batch(TestSchema, True, [{'age': '2'}])
+        self.assertIs(_worker_schemas[(TestSchema, True)], schema)
+
+class SimpleSchema(pl.BaseSchema):
+    one = fields.Integer()
+    two_words = fields.Integer()
+    trailing_spaces = fields.String()
+
+class TestCompactRows(TestBase):
+    def build_pipeline(self, compact_rows):
+        return pl.Pipeline(
+            'compact_pipeline', 'Compact Pipeline',
+            settings_file=self.settings_file, log_status=False
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, compact_rows=compact_rows) \
+            .schema(SimpleSchema) \
+            .load(self.Loader)
+
+    def test_compact_matches_dicts(self):
+        compact = self.build_pipeline(True).run()
+        self.assertEquals(compact.data, self.build_pipeline(False).run().data)
+        self.assertEquals(compact.data, [
+            {'one': 1, 'two_words': 2, 'trailing_spaces': '1'},
+            {'one': 3, 'two_words': 4, 'trailing_spaces': '1'}
+        ])
+
+class FlakyLoader(TestLoader):
+    loaded = []
+    fail_on = None
+
+    def load(self, data):
+        for line in data:
+            if line == FlakyLoader.fail_on:
+                raise RuntimeError('CKAN returned a 502')
+            FlakyLoader.loaded.append(line)
+
+class TestResume(TestBase):
+    def setUp(self):
+        super(TestResume, self).setUp()
+        FlakyLoader.loaded = []
+        self.pipeline = pl.Pipeline(
+            'resume_pipeline', 'Resume Pipeline',
+            settings_file=self.settings_file,
+            log_status=True, conn=self.conn,
+            streaming=True, batch_size=1
+        ) \
+            .connect(pl.FileConnector, os.path.join(HERE, '../mock/simple_mock.csv')) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(SimpleSchema) \
+            .load(FlakyLoader)
+
+    def test_resume_after_failure(self):
+        FlakyLoader.fail_on = {'one': 3, 'two_words': 4, 'trailing_spaces': '1'}
+        with self.assertRaises(RuntimeError):
+            self.pipeline.run()
+        self.assertEquals(len(FlakyLoader.loaded), 1)
+        committed = self.cur.execute('select committed from checkpoints').fetchall()
+        self.assertEquals(committed, [(1,)])
+
+        FlakyLoader.fail_on = None
+        self.pipeline.run(resume=True)
+        self.assertEquals(len(FlakyLoader.loaded), 2)
+        self.assertEquals(self.pipeline.num_lines, 2)
+        self.assertEquals(self.cur.execute('select * from checkpoints').fetchall(), [])
+
+    @patch('urllib.request.urlopen')
+    def test_resume_without_checksum(self, urlopen):
+        FlakyLoader.fail_on = {'one': 3, 'two_words': 4, 'trailing_spaces': '1'}
+        with self.assertRaises(RuntimeError):
+            self.pipeline.run()
+
+        with open(os.path.join(HERE, '../mock/simple_mock.csv'), 'rb') as f:
+            urlopen.return_value = UnseekableBytesIO(f.read())
+        FlakyLoader.fail_on = None
+        self.pipeline.connect(pl.RemoteFileConnector, 'http://a.b/simple_mock.csv')
+        with self.assertRaisesRegex(RuntimeError, 'Cannot resume'):
+            self.pipeline.run(resume=True)
+        self.assertEquals(len(FlakyLoader.loaded), 1)
+
+    def test_no_resume(self):
+        FlakyLoader.fail_on = {'one': 3, 'two_words': 4, 'trailing_spaces': '1'}
+        with self.assertRaises(RuntimeError):
+            self.pipeline.run()
+
+        FlakyLoader.fail_on = None
+        self.pipeline.run()
+        self.assertEquals(len(FlakyLoader.loaded), 3)
@@ -0,0 +1,74 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import Mock
+
+from pipeline.scheduler import CronSchedule, Scheduler
+
+NOW = datetime.datetime(2016, 3, 15, 10, 7, 30)  # a Tuesday
+
+
+class TestCronSchedule(TestCase):
+    def test_every_fifteen_minutes(self):
+        self.assertEquals(
+            CronSchedule('*/15 * * * *').next_run(NOW),
+            datetime.datetime(2016, 3, 15, 10, 15)
+        )
+
+    def test_daily(self):
+        self.assertEquals(
+            CronSchedule('0 3 * * *').next_run(NOW),
+            datetime.datetime(2016, 3, 16, 3, 0)
+        )
+
+    def test_weekdays(self):
+        self.assertEquals(
+            CronSchedule('0 9 * * 1-5').next_run(datetime.datetime(2016, 3, 18, 10)),
+            datetime.datetime(2016, 3, 21, 9, 0)
+        )
+
+    def test_day_of_month_or_weekday(self):
+        schedule = CronSchedule('0 0 1 * 0')
+        self.assertTrue(schedule.matches(datetime.datetime(2016, 3, 20)))
+        self.assertTrue(schedule.matches(datetime.datetime(2016, 4, 1)))
+        self.assertFalse(schedule.matches(datetime.datetime(2016, 4, 2)))
+
+    def test_strictly_after(self):
+        self.assertEquals(
+            CronSchedule('* * * * *').next_run(datetime.datetime(2016, 3, 15, 10, 7)),
+            datetime.datetime(2016, 3, 15, 10, 8)
+        )
+
+    def test_invalid(self):
+        for expression in ['* * * *', '60 * * * *', '*/0 * * * *', 'a * * * *']:
+            with self.assertRaises(ValueError):
+                CronSchedule(expression)
+        with self.assertRaises(ValueError):
+            CronSchedule('0 0 30 2 *').next_run(NOW)
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        self.runner = Mock(side_effect=lambda job_path, pipeline: (job_path, 'success', None))
+        self.scheduler = Scheduler(self.runner)
+        self.pipeline = Mock()
+        self.scheduler.add('job:pipeline', self.pipeline, '*/15 * * * *', now=NOW)
+
+    def test_next_due(self):
+        self.assertEquals(self.scheduler.next_due(), datetime.datetime(2016, 3, 15, 10, 15))
+        self.assertIsNone(Scheduler(self.runner).next_due())
+
+    def test_not_due(self):
+        self.assertEquals(self.scheduler.run_pending(now=NOW), [])
+        self.assertFalse(self.runner.called)
+
+    def test_run_pending(self):
+        results = self.scheduler.run_pending(now=datetime.datetime.now() + datetime.timedelta(days=365 * 50))
+        self.assertEquals(results, [('job:pipeline', 'success', None)])
+        self.assertTrue(self.pipeline.reset.called)
+        self.assertGreater(self.scheduler.next_due(), datetime.datetime.now())
+
+    def test_reset_after_failure(self):
+        self.runner.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.scheduler.run_pending(now=datetime.datetime.now() + datetime.timedelta(days=365 * 50))
+        self.assertTrue(self.pipeline.reset.called)
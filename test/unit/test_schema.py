@@ -1,8 +1,9 @@
+import datetime
 from operator import itemgetter
 from unittest import TestCase
 
 import pipeline as pl
-from marshmallow import fields
+from marshmallow import fields, pre_load
 
 class FakeSchema(pl.BaseSchema):
     str = fields.String()
@@ -38,3 +39,103 @@ class TestSchema(TestCase):
                 {'id': 'STR', 'type': 'text'}
             ]
         )
+
+class CompiledSchema(pl.BaseSchema):
+    str = fields.String(required=True)
+    int = fields.Integer(allow_none=True)
+    num = fields.Number(as_string=True)
+    flt = fields.Float(validate=lambda i: i >= 0)
+    datetime = fields.DateTime()
+    formatted = fields.DateTime(format='%m/%d/%Y %H:%M')
+    date = fields.Date(dump_to='a_different_name')
+    other = fields.Boolean(load_from='OTHER')
+    with_default = fields.String(missing='a default')
+    not_there = fields.String(load_only=True)
+    dumped = fields.String(dump_only=True, default='dumped')
+
+class HookSchema(pl.BaseSchema):
+    str = fields.String()
+
+    @pre_load
+    def upper(self, data):
+        return {'str': data['str'].upper()}
+
+class TestCompiledSchema(TestCase):
+    rows = [
+        {
+            'str': 'a', 'int': '1', 'num': '1.5', 'flt': 2,
+            'datetime': '2016-01-01T12:30:00', 'formatted': '01/02/2016 03:04',
+            'date': '2016-01-01', 'OTHER': 'true', 'not_there': 'x'
+        },
+        {'str': 'b', 'int': None, 'num': 3, 'flt': '0', 'date': '2016-02-29'},
+        {
+            'int': 'one', 'num': None, 'flt': -1, 'datetime': '',
+            'formatted': '2016-01-01', 'date': 'not a date', 'other': 'maybe'
+        },
+        {'str': 1, 'int': 1.7, 'flt': '1e400', 'datetime': 'nope', 'OTHER': 'nope'},
+    ]
+
+    def test_compile(self):
+        self.assertIsInstance(CompiledSchema().compile(), pl.CompiledSchema)
+        schema = HookSchema()
+        self.assertIs(schema.compile(), schema)
+        strict = CompiledSchema(strict=True)
+        self.assertIs(strict.compile(), strict)
+
+    def test_load_matches_marshmallow(self):
+        schema = CompiledSchema()
+        compiled = schema.compile()
+        for row in self.rows:
+            self.assertEquals(compiled.load(row), schema.load(row))
+
+    def test_dump_matches_marshmallow(self):
+        schema = CompiledSchema()
+        compiled = schema.compile()
+        for row in self.rows:
+            loaded = schema.load(row).data
+            self.assertEquals(compiled.dump(loaded), schema.dump(loaded))
+
+    def test_invalid_input_type(self):
+        schema = CompiledSchema()
+        self.assertEquals(schema.compile().load(['a']), schema.load(['a']))
+
+    def test_many_matches_marshmallow(self):
+        schema = CompiledSchema()
+        compiled = schema.compile()
+        loaded = compiled.load(self.rows, many=True)
+        self.assertEquals(loaded, schema.load(self.rows, many=True))
+        self.assertEquals(sorted(loaded.errors.keys()), [2, 3])
+        self.assertEquals(
+            compiled.dump(loaded.data, many=True),
+            schema.dump(loaded.data, many=True)
+        )
+
+class NativeSchema(pl.BaseSchema):
+    datetime = pl.NativeDateTime(format='%m/%d/%Y')
+    date = pl.NativeDate()
+
+class TestNativeFields(TestCase):
+    rows = [
+        {'datetime': datetime.datetime(2016, 1, 2, 3, 4), 'date': datetime.datetime(2016, 1, 2)},
+        {'datetime': '01/02/2016', 'date': datetime.date(2016, 1, 2)},
+        {'datetime': 'not a date', 'date': '2016-01-02'},
+    ]
+
+    def test_native_values(self):
+        loaded = NativeSchema().load(self.rows[0])
+        self.assertEquals(loaded.errors, {})
+        self.assertEquals(loaded.data, {
+            'datetime': datetime.datetime(2016, 1, 2, 3, 4),
+            'date': datetime.date(2016, 1, 2)
+        })
+
+    def test_compiled_matches_marshmallow(self):
+        schema = NativeSchema()
+        compiled = schema.compile()
+        self.assertEquals(compiled.load(self.rows, many=True), schema.load(self.rows, many=True))
+
+    def test_ckan_types(self):
+        self.assertEquals(
+            sorted(NativeSchema().serialize_to_ckan_fields(), key=itemgetter('id')),
+            [{'id': 'date', 'type': 'date'}, {'id': 'datetime', 'type': 'timestamp'}]
+        )
@@ -1,10 +1,14 @@
+import sys
 import sqlite3
+import subprocess
 from unittest import TestCase
+from unittest.mock import patch
 
 import os
 import pipeline as pl
+import click
 from click.testing import CliRunner
-from pipeline.scripts import create_db, run_job
+from pipeline.scripts import create_db, run_job, load_schedule
 from test.base import TestLoader, TestExtractor, TestConnector
 
 HERE = os.path.abspath(os.path.dirname(__file__))
@@ -149,3 +153,72 @@ class TestRunJobScript(TestCase):
             ]
         )
         self.assertEquals(result.exit_code, 0)
+
+    def test_run_multiple_jobs(self):
+        result = self.runner.invoke(run_job, [
+            'test.unit.test_scripts:test_pipeline',
+            'test.unit.test_scripts:test_pipeline',
+        ])
+        self.assertEquals(result.exit_code, 0)
+        self.assertTrue('2 succeeded, 0 skipped, 0 failed' in result.output)
+
+    def test_run_multiple_jobs_in_pool(self):
+        result = self.runner.invoke(run_job, [
+            'test.unit.test_scripts:test_pipeline',
+            'test.unit.test_scripts:junk',
+            '--workers', '2'
+        ])
+        self.assertNotEquals(result.exit_code, 0)
+        self.assertTrue('test.unit.test_scripts:junk: failed' in result.output)
+        self.assertTrue('1 succeeded, 0 skipped, 1 failed' in result.output)
+
+    def test_run_manifest(self):
+        with self.runner.isolated_filesystem():
+            with open('manifest.txt', 'w') as f:
+                f.write('# hourly jobs\ntest.unit.test_scripts:test_pipeline\n\n')
+            result = self.runner.invoke(run_job, [
+                'test.unit.test_scripts:test_pipeline', '--manifest', 'manifest.txt'
+            ])
+        self.assertEquals(result.exit_code, 0)
+        self.assertTrue('2 succeeded' in result.output)
+
+    def test_run_job_resume(self):
+        with patch.object(test_pipeline, 'run') as run:
+            result = self.runner.invoke(run_job, [
+                'test.unit.test_scripts:test_pipeline', '--resume'
+            ])
+        self.assertEquals(result.exit_code, 0)
+        run.assert_called_once_with(resume=True)
+
+    def test_run_job_no_jobs(self):
+        result = self.runner.invoke(run_job, [])
+        self.assertNotEquals(result.exit_code, 0)
+
+    def test_mock_ckan_not_imported(self):
+        # the mock server needs a newer Python than the job commands
+        code = "import sys, pipeline.scripts; sys.exit('pipeline.mock_ckan' in sys.modules)"
+        self.assertEquals(subprocess.call([sys.executable, '-c', code], cwd=os.path.join(HERE, '../..')), 0)
+
+
+class TestLoadSchedule(TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+    def test_load_schedule(self):
+        with self.runner.isolated_filesystem():
+            with open('schedule.json', 'w') as f:
+                f.write('''{"jobs": [
+                    {"job": "test.unit.test_scripts:test_pipeline", "schedule": "*/5 * * * *"}
+                ]}''')
+            scheduler = load_schedule('schedule.json', SETTINGS_FILE)
+        self.assertEquals(len(scheduler.jobs), 1)
+        self.assertIs(scheduler.jobs[0]['pipeline'], test_pipeline)
+
+    def test_load_schedule_bad_job(self):
+        with self.runner.isolated_filesystem():
+            with open('schedule.json', 'w') as f:
+                f.write('''{"jobs": [
+                    {"job": "test.unit.test_scripts:junk", "schedule": "*/5 * * * *"}
+                ]}''')
+            with self.assertRaises(click.ClickException):
+                load_schedule('schedule.json')